@@ -0,0 +1,47 @@
+"""Throughput of /api/recommend (one request per profile) vs. /api/recommend/batch.
+
+    python benchmarks/bench_batch.py [--profiles 5000] [--batch-size 1000]
+
+Runs in-process through TestClient with the recommendation cache cleared
+before each pass, so both paths do the same inference work.
+"""
+import argparse
+import time
+
+from fastapi.testclient import TestClient
+from synthetic import make_profiles
+
+from main import app, recommendation_cache
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--profiles", type=int, default=5000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    client = TestClient(app)
+    profiles = make_profiles(args.profiles)
+    distinct = len({tuple(sorted(p.items())) for p in profiles})
+    print(f"{args.profiles} profiles, {distinct} distinct")
+
+    recommendation_cache.clear()
+    start = time.perf_counter()
+    for profile in profiles:
+        assert client.post("/api/recommend", json=profile).status_code == 200
+    single = time.perf_counter() - start
+
+    recommendation_cache.clear()
+    start = time.perf_counter()
+    for offset in range(0, len(profiles), args.batch_size):
+        chunk = profiles[offset:offset + args.batch_size]
+        assert client.post("/api/recommend/batch", json={"profiles": chunk}).status_code == 200
+    batch = time.perf_counter() - start
+
+    print(f"{'endpoint':<24} {'seconds':>8} {'profiles/s':>11}")
+    print(f"{'/api/recommend':<24} {single:>8.2f} {args.profiles / single:>11.0f}")
+    print(f"{'/api/recommend/batch':<24} {batch:>8.2f} {args.profiles / batch:>11.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Records per second and peak RSS of streaming NDJSON bulk scoring.
+
+    python benchmarks/bench_bulk.py [--records 10000000] [--workers 0,2] [--distinct 100000]
+
+The input is generated while it is read, and results are counted and dropped,
+so the only memory that can grow with the record count is the scorer's own.
+Peak RSS is the high-water mark of this process (plus the largest worker when
+a pool is used); a run is "bounded" if it stays flat as --records grows.
+Profiles are drawn at random from --distinct synthetic ones; "memo hits" is
+the share answered from the scorer's line memo (in-process runs only).
+"""
+import argparse
+import random
+import resource
+import time
+
+from synthetic import make_profiles
+
+import bulk
+import main as service
+
+
+class ProfileStream:
+    """File-like NDJSON source yielding ``count`` lines without materializing them"""
+
+    def __init__(self, count: int, distinct: int, seed: int = 3):
+        self.lines = [service.encode_json(p) + b"\n" for p in make_profiles(distinct)]
+        self.remaining = count
+        self.rng = random.Random(seed)
+
+    def read(self, size: int) -> bytes:
+        lines = []
+        length = 0
+        while self.remaining and length < size:
+            line = self.lines[self.rng.randrange(len(self.lines))]
+            lines.append(line)
+            length += len(line)
+            self.remaining -= 1
+        return b"".join(lines)
+
+
+def peak_rss_mb() -> float:
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    workers = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, workers) / 1024  # Linux reports KiB
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", default="100000,1000000")
+    parser.add_argument("--workers", default="0")
+    parser.add_argument("--distinct", type=int, default=100000)
+    parser.add_argument("--chunk-size", type=int, default=bulk.DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--scoring", choices=["strict", "partial"], default="strict")
+    args = parser.parse_args()
+
+    print(f"rss after startup: {peak_rss_mb():.0f} MB")
+    print(f"{'records':>10} {'workers':>8} {'seconds':>8} {'records/s':>10} {'peak rss MB':>12} {'memo hits':>10}")
+    for workers in (int(w) for w in args.workers.split(",")):
+        for count in (int(r) for r in args.records.split(",")):
+            system = service.expert_system
+            scorer = bulk.BulkScorer(bulk.ChunkScorer(service.UserInput, service.response_body, lambda: system.version),
+                                     lambda: system.rules, workers=workers, chunk_size=args.chunk_size)
+            source = ProfileStream(count, args.distinct)
+            started = time.perf_counter()
+            records = 0
+            for block in scorer.score_lines(bulk.read_lines(source), args.scoring):
+                records += block.count(b"\n")
+            elapsed = time.perf_counter() - started
+            scorer.close()
+            assert records == count
+            hits = f"{scorer.scorer.memo.stats()['hit_ratio']:.0%}" if not workers else "-"
+            print(f"{count:>10} {workers:>8} {elapsed:>8.1f} {count / elapsed:>10.0f} {peak_rss_mb():>12.0f} {hits:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Request latency under concurrency for each inference execution mode.
+
+    python benchmarks/bench_executor.py [--rules 20000] [--seconds 5] [--light 16] [--heavy 2] [--workers 2]
+
+Light clients send cached /api/recommend requests on a fixed schedule
+(--rate per second each); heavy clients send ``?scoring=partial`` requests for
+profiles not seen before, which always run the engine, back to back. All clients share
+one event loop and call the ASGI app directly (no sockets). Light latency is
+measured from when a request was due, so time spent waiting for the loop
+while a heavy evaluation holds it is counted. "shed" counts 429 responses.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+
+from synthetic import make_profiles, make_rules
+
+os.environ.setdefault("METRICS_ENABLED", "false")
+os.environ.setdefault("RECOMMENDATION_TABLE", "off")
+import main as service  # noqa: E402
+from executor import InferenceExecutor  # noqa: E402
+
+
+async def call(app, path, body):
+    """Status of one POST request"""
+    status = [0]
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status[0] = message["status"]
+
+    path, _, query = path.partition("?")
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "", "query_string": query.encode(),
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        "client": ("127.0.0.1", 1), "server": ("127.0.0.1", 80),
+    }
+    await service.app(scope, receive, send)
+    return status[0]
+
+
+async def light_client(bodies, rate, deadline, latencies):
+    interval = 1 / rate
+    due = time.perf_counter()
+    n = 0
+    while due < deadline:
+        await asyncio.sleep(max(0.0, due - time.perf_counter()))
+        await call(service.app, "/api/recommend", bodies[n % len(bodies)])
+        latencies.append(time.perf_counter() - due)
+        due += interval
+        n += 1
+
+
+async def heavy_client(bodies, deadline, latencies, shed):
+    n = 0
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        status = await call(service.app, "/api/recommend?scoring=partial", next(bodies))
+        if status == 429:
+            shed.append(1)
+            await asyncio.sleep(0.01)
+        else:
+            latencies.append(time.perf_counter() - start)
+            await asyncio.sleep(0)
+        n += 1
+
+
+def percentile(values, q):
+    if not values:
+        return float("nan")
+    return statistics.quantiles(values, n=100)[q - 1] if len(values) > 1 else values[0]
+
+
+async def scenario(args, light_bodies, heavy_bodies):
+    light, heavy, shed = [], [], []
+    deadline = time.perf_counter() + args.seconds
+    await asyncio.gather(
+        *[light_client(light_bodies, args.rate, deadline, light) for _ in range(args.light)],
+        *[heavy_client(heavy_bodies, deadline, heavy, shed) for _ in range(args.heavy)],
+    )
+    return light, heavy, len(shed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rules", type=int, default=20000)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--light", type=int, default=16, help="clients sending cached requests")
+    parser.add_argument("--rate", type=float, default=50, help="requests per second per light client")
+    parser.add_argument("--heavy", type=int, default=2, help="clients sending uncached partial-scoring requests")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--max-pending", type=int, default=64)
+    parser.add_argument("--modes", default="inline,thread,process,auto")
+    args = parser.parse_args()
+
+    service.expert_system.load_rules(make_rules(args.rules))
+    light_bodies = [json.dumps(p).encode() for p in make_profiles(20)]
+    # Distinct profiles, so heavy requests miss the cache
+    heavy_bodies = iter(json.dumps(dict(p, age_range=str(n))).encode()
+                        for n, p in enumerate(make_profiles(100000, seed=5)))
+
+    print(f"{args.rules} rules, {args.light} light + {args.heavy} heavy clients, {args.seconds:g}s per mode\n")
+    print(f"{'mode':<8} {'light req/s':>11} {'light p50 ms':>12} {'light p99 ms':>12} "
+          f"{'heavy req/s':>11} {'heavy p50 ms':>12} {'heavy p99 ms':>12} {'shed':>6}")
+    loop = asyncio.new_event_loop()
+    for mode in args.modes.split(","):
+        service.inference.close()
+        service.inference = InferenceExecutor(service.expert_system, mode=mode, workers=args.workers,
+                                              max_pending=args.max_pending, factory=service.worker_engine)
+        service.inference.warm()
+        # Fill the cache for the light profiles and let workers start and estimates settle
+        for body in light_bodies:
+            loop.run_until_complete(call(service.app, "/api/recommend", body))
+        for _ in range(3):
+            loop.run_until_complete(call(service.app, "/api/recommend?scoring=partial", next(heavy_bodies)))
+        light, heavy, shed = loop.run_until_complete(scenario(args, light_bodies, heavy_bodies))
+        ms = 1000
+        print(f"{mode:<8} {len(light) / args.seconds:>11.0f} {percentile(light, 50) * ms:>12.1f} "
+              f"{percentile(light, 99) * ms:>12.1f} {len(heavy) / args.seconds:>11.1f} "
+              f"{percentile(heavy, 50) * ms:>12.1f} {percentile(heavy, 99) * ms:>12.1f} {shed:>6}")
+    service.inference.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""Latency added by per-user re-ranking, with 1M users of feedback history in SQLite.
+
+    python benchmarks/bench_feedback.py [--users 1000000] [--per-user 5] [--rules 2000]
+
+Fills a fresh feedback database with ``--per-user`` rows for each of
+``--users`` users, then measures:
+
+- the re-ranking stage alone, for users in the LRU ("hot") and users loaded
+  from SQLite on the spot ("cold")
+- /api/recommend through the ASGI app without ``user_id`` and with a hot or cold one
+  (profiles repeat, so both sides are served from caches rather than the engine)
+- POST /api/feedback, and the batched commits behind it
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from synthetic import make_profiles, make_rules
+
+TMP = tempfile.mkdtemp()
+os.environ.setdefault("METRICS_ENABLED", "false")
+os.environ.setdefault("RECOMMENDATION_TABLE", "off")
+os.environ["FEEDBACK_DB"] = str(Path(TMP) / "feedback.db")
+import feedback  # noqa: E402
+import main as service  # noqa: E402
+
+
+def fill(path, users, per_user, rule_ids, seed=7):
+    rng = random.Random(seed)
+    db = feedback.connect(path)
+    db.execute("BEGIN")
+    db.executemany("INSERT INTO user_affinity VALUES (?, ?, ?)", (
+        (f"user{n:08d}", rule_id, rng.choice((-1, 1, 1, 2)))
+        for n in range(users) for rule_id in rng.sample(rule_ids, per_user)))
+    db.executemany("INSERT INTO rule_feedback VALUES (?, ?, ?)",
+                   ((rule_id, rng.randrange(1000), rng.randrange(300)) for rule_id in rule_ids))
+    db.execute("COMMIT")
+    db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    db.close()
+
+
+async def call(method, path, body=b""):
+    status = [0]
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status[0] = message["status"]
+
+    path, _, query = path.partition("?")
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method,
+        "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "", "query_string": query.encode(),
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        "client": ("127.0.0.1", 1), "server": ("127.0.0.1", 80),
+    }
+    await service.app(scope, receive, send)
+    return status[0]
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    q = statistics.quantiles(samples, n=100)
+    return q[49] * 1e6, q[98] * 1e6
+
+
+def timed(fn, items):
+    samples = []
+    for item in items:
+        start = time.perf_counter()
+        fn(item)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--per-user", type=int, default=5)
+    parser.add_argument("--rules", type=int, default=2000)
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+
+    rules = make_rules(args.rules, titles=args.rules // 4)
+    service.expert_system.load_rules(rules)
+    rule_ids = [rule["id"] for rule in rules]
+    path = Path(os.environ["FEEDBACK_DB"])
+    service.feedback_store.close()
+    started = time.perf_counter()
+    fill(path, args.users, args.per_user, rule_ids)
+    print(f"filled {args.users * args.per_user} rows for {args.users} users in {time.perf_counter() - started:.0f}s "
+          f"({path.stat().st_size / 1e6:.0f} MB)")
+    store = service.feedback_store = feedback.FeedbackStore(path)
+
+    rng = random.Random(3)
+    profiles = [service.UserInput(**p) for p in make_profiles(200)]
+    candidates = [service.expert_system.rank_candidates(p) for p in profiles]
+    print(f"{sum(map(len, candidates)) / len(candidates):.1f} candidates per profile on average\n")
+    hot_users = [f"user{rng.randrange(args.users):08d}" for _ in range(1000)]
+    for user in hot_users:
+        store.user_scores(user)
+
+    print(f"{'stage':<34} {'p50 us':>8} {'p99 us':>8}")
+    rows = [
+        ("rerank, hot user", timed(lambda n: store.rerank(candidates[n % 200], store.user_scores(hot_users[n % 1000]), 3),
+                                   range(args.requests))),
+        ("rerank, cold user (SQLite read)", timed(
+            lambda n: store.rerank(candidates[n % 200], store.user_scores(f"user{rng.randrange(args.users):08d}"), 3),
+            range(args.requests))),
+    ]
+    loop = asyncio.new_event_loop()
+    bodies = [json.dumps(p.dict(exclude_none=True)).encode() for p in profiles]
+    for body in bodies:
+        loop.run_until_complete(call("POST", "/api/recommend", body))
+        loop.run_until_complete(call("POST", f"/api/recommend?user_id={hot_users[0]}", body))
+    for label, user in (("/api/recommend", None), ("/api/recommend, hot user", "hot"),
+                        ("/api/recommend, cold user", "cold")):
+        def request(n):
+            if user is None:
+                path = "/api/recommend"
+            else:
+                uid = hot_users[n % 1000] if user == "hot" else f"user{rng.randrange(args.users):08d}"
+                path = f"/api/recommend?user_id={uid}"
+            assert loop.run_until_complete(call("POST", path, bodies[n % 200])) == 200
+        rows.append((label, timed(request, range(args.requests))))
+
+    def post_feedback(n):
+        body = json.dumps({"user_id": f"user{rng.randrange(args.users):08d}", "matched_rules": [rng.choice(rule_ids)],
+                           "action": rng.choice(["like", "dismiss"])}).encode()
+        assert loop.run_until_complete(call("POST", "/api/feedback", body)) == 202
+    rows.append(("POST /api/feedback", timed(post_feedback, range(args.requests))))
+    for label, samples in rows:
+        p50, p99 = percentiles(samples)
+        print(f"{label:<34} {p50:>8.1f} {p99:>8.1f}")
+
+    started = time.perf_counter()
+    store.close()
+    stats = store.stats()
+    print(f"\n{stats['flushed']} feedback rows committed in {stats['batches']} batches; "
+          f"final flush {(time.perf_counter() - started) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    finally:
+        shutil.rmtree(TMP, ignore_errors=True)
@@ -0,0 +1,84 @@
+"""Byte savings of the generated image variants, and throughput of the static image route.
+
+    python benchmarks/bench_images.py [--widths 320,640,1024] [--requests 2000]
+
+Builds variants of images/ into a temporary directory, prints per-image sizes,
+then serves them through /static/images by calling the ASGI app directly (no
+sockets), for whole files, byte ranges and 304 revalidations.
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import synthetic  # noqa: F401  puts the repo root on sys.path
+
+import image_assets
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+async def serve(app, path, headers, count):
+    """Requests per second and response bytes per second for GET ``path``"""
+    received = [0]
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            received[0] += len(message.get("body", b""))
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"",
+        "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()],
+        "client": ("127.0.0.1", 1), "server": ("127.0.0.1", 80),
+    }
+    await app(dict(scope), receive, send)
+    received[0] = 0
+    start = time.perf_counter()
+    for _ in range(count):
+        await app(dict(scope), receive, send)
+    elapsed = time.perf_counter() - start
+    return count / elapsed, received[0] / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--widths", default=",".join(map(str, image_assets.DEFAULT_WIDTHS)))
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    output = Path(tempfile.mkdtemp(prefix="stylist-images-"))
+    started = time.perf_counter()
+    manifest = image_assets.build(ROOT / "images", output, [int(w) for w in args.widths.split(",")])
+    print(f"built {sum(len(e['variants']) for e in manifest['images'].values())} variants "
+          f"in {time.perf_counter() - started:.1f}s\n")
+
+    print(f"{'image':<28} {'original':>10} {'webp max':>10} {'jpeg max':>10} {'webp min':>10} {'saved':>7}")
+    for row in image_assets.savings_report(manifest):
+        largest = row["webp_largest_bytes"]
+        print(f"{row['image']:<28} {row['original_bytes']:>10} {largest:>10} {row['jpeg_largest_bytes']:>10} "
+              f"{row['webp_smallest_bytes']:>10} {1 - largest / row['original_bytes']:>7.1%}")
+
+    os.environ["IMAGE_DIR"] = str(output)
+    os.environ["METRICS_ENABLED"] = "false"
+    import main as service
+
+    variant = max((v for e in manifest["images"].values() for v in e["variants"]), key=lambda v: v["bytes"])
+    etag = '"' + hashlib.sha256((output / variant["file"]).read_bytes()).hexdigest()[:32] + '"'
+    loop = asyncio.new_event_loop()
+    print(f"\nserving {variant['file']} ({variant['bytes']} bytes)")
+    print(f"{'request':<12} {'req/s':>9} {'MB/s':>9}")
+    for label, headers in [("full", {}), ("range 64KB", {"Range": "bytes=0-65535"}),
+                           ("304", {"If-None-Match": etag})]:
+        rate, throughput = loop.run_until_complete(serve(service.app, variant["url"], headers, args.requests))
+        print(f"{label:<12} {rate:>9.0f} {throughput / 1e6:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Memory per rule and allocation per request: plain rule dicts vs. compiled rules.
+
+    python benchmarks/bench_memory.py [--sizes 10000,100000] [--request-rules 10000] [--profiles 200]
+
+Rules are generated, written to JSON and parsed back, as they are when
+loaded from rules.json, so every string is its own object before compiling.
+"bytes/rule" is what tracemalloc attributes to the rule list alone. Request
+columns run each profile through the engine: "peak KB/req" is the most
+memory a request allocates above its starting point (tracemalloc's peak) and
+"us/req" the time without tracing. Per-snapshot caches are warmed first.
+Request columns are comparable across commits, so run the script before and
+after a change to the engine.
+"""
+import argparse
+import contextlib
+import gc
+import io
+import json
+import time
+import tracemalloc
+
+from synthetic import make_profiles, make_rules
+
+from main import FashionExpertSystem, UserInput, validate_rule
+from compact_rules import RuleCompiler
+
+
+def traced_bytes(build):
+    """Bytes held by what ``build()`` returns, and the result"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return size, result
+
+
+def compiled(text):
+    compiler = RuleCompiler()
+    return [compiler.compile(rule) for rule in map(validate_rule, json.loads(text))]
+
+
+def per_request(fn, inputs):
+    """(peak KB, microseconds) per call, averaged over ``inputs``"""
+    for item in inputs:
+        fn(item)  # warm per-snapshot caches, which are not per-request costs
+    tracemalloc.start()
+    peak = 0
+    for item in inputs:
+        start = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        fn(item)
+        peak += tracemalloc.get_traced_memory()[1] - start
+    tracemalloc.stop()
+    started = time.perf_counter()
+    for item in inputs:
+        fn(item)
+    elapsed = time.perf_counter() - started
+    n = len(inputs)
+    return peak / n / 1024, elapsed / n * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10000,100000")
+    parser.add_argument("--titles", type=int, default=500, help="distinct recommendation titles (0: one per rule)")
+    parser.add_argument("--request-rules", type=int, default=10000, help="rule count for the request columns")
+    parser.add_argument("--profiles", type=int, default=200)
+    args = parser.parse_args()
+
+    user_inputs = [UserInput(**p) for p in make_profiles(args.profiles)]
+    print(f"{'rules':>8} {'dict bytes/rule':>16} {'compiled bytes/rule':>20} {'saved':>6}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        text = json.dumps(make_rules(size, titles=args.titles))
+        plain, _ = traced_bytes(lambda: [validate_rule(rule) for rule in json.loads(text)])
+        compact, _ = traced_bytes(lambda: compiled(text))
+        print(f"{size:>8} {plain / size:>16.0f} {compact / size:>20.0f} {1 - compact / plain:>6.0%}")
+
+    system = FashionExpertSystem(make_rules(args.request_rules, titles=args.titles))
+    print(f"\n{len(system.rules)} rules, {len(user_inputs)} profiles")
+    print(f"{'request':<16} {'peak KB/req':>12} {'us/req':>9}")
+    requests = {
+        "forward_chain": system.forward_chain,
+        "recommend_json": lambda u: system.recommend_json(u, record=False),
+        "partial": lambda u: system.recommend_json(u, record=False, scoring="partial"),
+    }
+    with contextlib.redirect_stdout(io.StringIO()):
+        rows = [(name, per_request(fn, user_inputs)) for name, fn in requests.items()]
+    for name, (peak, us) in rows:
+        print(f"{name:<16} {peak:>12.1f} {us:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
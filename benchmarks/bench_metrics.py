@@ -0,0 +1,115 @@
+"""Overhead of the Prometheus instrumentation on the engine and on full requests.
+
+    python benchmarks/bench_metrics.py [--rules 12,1000] [--profiles 500] [--requests 5000]
+
+"engine" times recommend_json with and without EngineMetrics attached. "http"
+drives POST /api/recommend straight through the ASGI app (no sockets or test
+client), once as is and once wrapped in MetricsMiddleware with engine metrics
+on, so the difference is everything a request pays for instrumentation.
+Off and on runs alternate and the fastest of ``--rounds`` is reported, which
+keeps machine noise from swamping differences of a few percent.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+os.environ["METRICS_ENABLED"] = "false"
+
+from synthetic import make_profiles, make_rules
+
+import main as service
+from main import KNOWLEDGE_BASE, FashionExpertSystem, UserInput
+from metrics import EngineMetrics, Histogram, MetricsMiddleware, Registry
+
+
+def per_call_us(fn, inputs, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for item in inputs:
+            fn(item)
+    return (time.perf_counter() - start) / (repeat * len(inputs)) * 1e6
+
+
+async def request_us(app, bodies, count):
+    """Mean latency of POST /api/recommend calls made directly on the ASGI app"""
+    async def call(body):
+        messages = [{"type": "http.request", "body": body, "more_body": False}]
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+            "scheme": "http", "path": "/api/recommend", "raw_path": b"/api/recommend", "root_path": "",
+            "query_string": b"", "headers": [(b"content-type", b"application/json")],
+            "client": ("127.0.0.1", 1), "server": ("127.0.0.1", 80),
+        }
+
+        async def receive():
+            return messages.pop() if messages else {"type": "http.disconnect"}
+
+        async def send(message):
+            pass
+
+        await app(scope, receive, send)
+
+    for body in bodies[:100]:
+        await call(body)
+    start = time.perf_counter()
+    for i in range(count):
+        await call(bodies[i % len(bodies)])
+    return (time.perf_counter() - start) / count * 1e6
+
+
+def compare(run_off, run_on, rounds):
+    """Fastest off and on timings over alternating rounds"""
+    off, on = [], []
+    for i in range(rounds):
+        # Alternate which goes first so warm-up and drift hit both equally
+        for run, times in ((run_off, off), (run_on, on))[::1 if i % 2 else -1]:
+            times.append(run())
+    return min(off), min(on)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rules", default="12,1000", help="comma separated rule counts; 12 is KNOWLEDGE_BASE")
+    parser.add_argument("--profiles", type=int, default=500)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    profiles = make_profiles(args.profiles)
+    user_inputs = [UserInput(**p) for p in profiles]
+
+    print(f"{'engine':<8} {'rules':>7} {'off us':>9} {'on us':>9} {'overhead':>9}")
+    for size in (int(s) for s in args.rules.split(",")):
+        system = FashionExpertSystem(KNOWLEDGE_BASE["rules"] if size == 12 else make_rules(size))
+        repeat = max(1, 2000 // size)
+        metrics = EngineMetrics(Registry())
+
+        def run(enabled):
+            system.metrics = metrics if enabled else None
+            return per_call_us(system.recommend_json, user_inputs, repeat)
+
+        off, on = compare(lambda: run(False), lambda: run(True), args.rounds)
+        print(f"{'':<8} {size:>7} {off:>9.2f} {on:>9.2f} {(on - off) / off:>9.1%}")
+
+    bodies = [json.dumps(p).encode() for p in profiles]
+    registry = Registry()
+    instrumented = MetricsMiddleware(service.app, registry.register(Histogram(
+        "http_request_duration_seconds", "HTTP request latency", labels=["method", "route", "status"])))
+    metrics = EngineMetrics(registry)
+    loop = asyncio.new_event_loop()
+
+    def serve(enabled):
+        service.expert_system.metrics = metrics if enabled else None
+        app = instrumented if enabled else service.app
+        return loop.run_until_complete(request_us(app, bodies, args.requests))
+
+    off, on = compare(lambda: serve(False), lambda: serve(True), args.rounds)
+    print(f"\n{'http':<8} {'source':>7} {'off us':>9} {'on us':>9} {'overhead':>9}")
+    source = "table" if service.recommendation_table is not None else "cache"
+    print(f"{'':<8} {source:>7} {off:>9.1f} {on:>9.1f} {(on - off) / off:>9.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Latency impact of rule edits on concurrent inference traffic.
+
+    python benchmarks/bench_reload.py [--rules 10000] [--seconds 3] [--readers 4]
+
+Reader threads run forward_chain continuously while a writer applies one
+rule change every --interval seconds, either incrementally (copy-on-write
+snapshot swap) or by rebuilding the whole index. Also reports the cost of a
+persisted edit through RuleStore, which rewrites the rules file.
+"""
+import argparse
+import json
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from synthetic import make_profiles, make_rules
+
+from main import FashionExpertSystem, UserInput, validate_rule
+from rule_store import RuleStore
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def run(system, user_inputs, readers, seconds, write=None, interval=0.05):
+    stop = threading.Event()
+    latencies = [[] for _ in range(readers)]
+    write_times = []
+
+    def reader(n):
+        i = n
+        while not stop.is_set():
+            start = time.perf_counter()
+            system.forward_chain(user_inputs[i % len(user_inputs)])
+            latencies[n].append(time.perf_counter() - start)
+            i += readers
+
+    def writer():
+        n = 0
+        while not stop.is_set():
+            start = time.perf_counter()
+            write(n)
+            write_times.append(time.perf_counter() - start)
+            n += 1
+            stop.wait(interval)
+
+    threads = [threading.Thread(target=reader, args=(n,)) for n in range(readers)]
+    if write is not None:
+        threads.append(threading.Thread(target=writer))
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    samples = [s for per_thread in latencies for s in per_thread]
+    return samples, write_times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rules", type=int, default=10000)
+    parser.add_argument("--seconds", type=float, default=3)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--interval", type=float, default=0.05)
+    args = parser.parse_args()
+
+    rules = make_rules(args.rules)
+    user_inputs = [UserInput(**p) for p in make_profiles(500)]
+    system = FashionExpertSystem(rules)
+
+    def incremental(n):
+        rule = dict(rules[n % len(rules)], confidence=0.5 + (n % 40) / 100)
+        system.apply_changes(upserts=[rule])
+
+    def full_rebuild(n):
+        system.load_rules([dict(rule) for rule in system.rules])
+
+    print(f"rules={args.rules} readers={args.readers} one edit every {args.interval * 1000:.0f} ms")
+    print(f"{'writer':<14} {'requests/s':>11} {'p50 ms':>8} {'p99 ms':>8} {'edits':>6} {'edit ms':>8}")
+    for name, write in [("none", None), ("incremental", incremental), ("full rebuild", full_rebuild)]:
+        samples, write_times = run(system, user_inputs, args.readers, args.seconds, write, args.interval)
+        edit_ms = statistics.mean(write_times) * 1000 if write_times else 0.0
+        print(f"{name:<14} {len(samples) / args.seconds:>11.0f} {percentile(samples, 0.5) * 1000:>8.2f} "
+              f"{percentile(samples, 0.99) * 1000:>8.2f} {len(write_times):>6} {edit_ms:>8.2f}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "rules.json"
+        path.write_text(json.dumps({"rules": rules}))
+        store = RuleStore(path, FashionExpertSystem(rules), validate=validate_rule)
+        times = []
+        for n in range(20):
+            start = time.perf_counter()
+            store.update(rules[n]["id"], dict(rules[n], confidence=0.7))
+            times.append(time.perf_counter() - start)
+        print(f"persisted RuleStore.update: {statistics.mean(times) * 1000:.1f} ms (rewrites {path.stat().st_size // 1024} KB)")
+
+
+if __name__ == "__main__":
+    main()
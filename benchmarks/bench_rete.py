@@ -0,0 +1,79 @@
+"""Multi-step forward chaining: Rete network versus re-scanning every rule after each firing.
+
+    python benchmarks/bench_rete.py [--sizes 1000,5000] [--depths 5,8] [--profiles 200]
+
+The re-scan baseline implements the same agenda (salience, then knowledge base
+order, each rule firing once) by testing every unfired rule again after each
+firing, which is what chaining costs without a match network. The two are
+checked to fire the same rules before timing. "single pass" is the index
+engine on the same number of plain rules, for reference.
+"""
+import argparse
+import time
+
+from synthetic import make_chained_rules, make_profiles, make_rules
+
+from main import FashionExpertSystem, UserInput
+from rete import ReteNetwork
+
+
+def rescan_forward_chain(rules, facts):
+    """Fired rule positions, re-testing every unfired rule after each firing"""
+    facts = dict(facts)
+    fired = set()
+    while True:
+        ready = [
+            (-rule.get("salience", 0), position) for position, rule in enumerate(rules)
+            if position not in fired and all(facts.get(k) == v for k, v in rule["conditions"].items())
+        ]
+        if not ready:
+            return sorted(fired), facts
+        _, position = min(ready)
+        fired.add(position)
+        for key, value in rules[position].get("derives", {}).items():
+            facts.setdefault(key, value)
+
+
+def per_call_us(fn, inputs, repeat=1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for item in inputs:
+            fn(item)
+    return (time.perf_counter() - start) / (repeat * len(inputs)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1000,5000")
+    parser.add_argument("--depths", default="5,8")
+    parser.add_argument("--profiles", type=int, default=200)
+    parser.add_argument("--rescan-profiles", type=int, default=3,
+                        help="profiles timed with the (slow) re-scan baseline")
+    args = parser.parse_args()
+
+    profiles = make_profiles(args.profiles)
+    user_inputs = [UserInput(**p) for p in profiles]
+
+    print(f"{'rules':>7} {'depth':>6} {'fired':>7} {'rete us':>9} {'engine us':>10} "
+          f"{'rescan us':>11} {'single pass us':>15}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        plain = FashionExpertSystem(make_rules(size))
+        single = per_call_us(plain.recommend_json, user_inputs)
+        for depth in (int(d) for d in args.depths.split(",")):
+            rules = make_chained_rules(size, depth)
+            network = ReteNetwork(rules)
+            sessions = [network.run(p) for p in profiles[:args.rescan_profiles]]
+            for profile, session in zip(profiles, sessions):
+                assert rescan_forward_chain(rules, profile) == (session.fired, session.facts)
+
+            system = FashionExpertSystem(rules)
+            fired = sum(len(network.run(p).fired) for p in profiles) / len(profiles)
+            rete = per_call_us(network.run, profiles)
+            engine = per_call_us(system.recommend_json, user_inputs)
+            rescan = per_call_us(lambda p: rescan_forward_chain(rules, p), profiles[:args.rescan_profiles])
+            print(f"{size:>7} {depth:>6} {fired:>7.1f} {rete:>9.1f} {engine:>10.1f} "
+                  f"{rescan:>11.0f} {single:>15.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Latency of rule matching vs. rule count: linear scan vs. compiled RuleIndex.
+
+    python benchmarks/bench_rule_index.py [--sizes 10,1000,10000,100000]
+"""
+import argparse
+import contextlib
+import io
+import time
+
+from synthetic import make_profiles, make_rules
+
+from main import FashionExpertSystem, UserInput
+from rule_index import RuleIndex
+
+
+def linear_match(rules, user_dict):
+    """The pre-index matching loop: test every rule's conditions in turn"""
+    matched = []
+    for rule in rules:
+        for key, expected in rule["conditions"].items():
+            if user_dict.get(key) != expected:
+                break
+        else:
+            matched.append(rule)
+    return matched
+
+
+def per_call_us(fn, inputs, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for item in inputs:
+            fn(item)
+    return (time.perf_counter() - start) / (repeat * len(inputs)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10,1000,10000,100000")
+    parser.add_argument("--profiles", type=int, default=200)
+    args = parser.parse_args()
+
+    profiles = make_profiles(args.profiles)
+    user_dicts = [{k: v for k, v in p.items() if v is not None} for p in profiles]
+    user_inputs = [UserInput(**p) for p in profiles]
+
+    print(f"{'rules':>8} {'build ms':>9} {'linear us':>11} {'index us':>10} {'speedup':>8} "
+          f"{'avg matched':>12} {'forward_chain us':>17}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        rules = make_rules(size)
+        start = time.perf_counter()
+        index = RuleIndex(rules)
+        build_ms = (time.perf_counter() - start) * 1e3
+
+        for user_dict in user_dicts:
+            assert [r["id"] for r in linear_match(rules, user_dict)] == \
+                [r["id"] for r in index.matching_rules(user_dict)]
+
+        repeat = max(1, 20000 // max(size, 1))
+        linear_us = per_call_us(lambda d: linear_match(rules, d), user_dicts, repeat)
+        index_us = per_call_us(index.matching_rules, user_dicts, repeat * 10)
+        matched = sum(len(index.match(d)) for d in user_dicts) / len(user_dicts)
+
+        system = FashionExpertSystem(rules)
+        with contextlib.redirect_stdout(io.StringIO()):
+            chain_us = per_call_us(system.forward_chain, user_inputs, repeat)
+
+        print(f"{size:>8} {build_ms:>9.1f} {linear_us:>11.1f} {index_us:>10.1f} "
+              f"{linear_us / index_us:>7.1f}x {matched:>12.1f} {chain_us:>17.1f}")
+
+
+if __name__ == "__main__":
+    main()
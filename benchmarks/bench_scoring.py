@@ -0,0 +1,58 @@
+"""Strict versus partial scoring, and bounded-heap top-k versus a full sort, by rule count.
+
+    python benchmarks/bench_scoring.py [--sizes 1000,10000,100000] [--profiles 200]
+
+"groups" is the mean number of merged recommendation groups per profile in
+partial mode, which is what the top-k step has to choose from. The selection
+columns time only that step on the same groups: sorting all of them, as the
+engine used to, against heapq.nsmallest keeping the best 3.
+"""
+import argparse
+import heapq
+import time
+
+from synthetic import make_profiles, make_rules
+
+from main import TOP_K, FashionExpertSystem, UserInput
+
+
+def per_call_us(fn, inputs, repeat=1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for item in inputs:
+            fn(item)
+    return (time.perf_counter() - start) / (repeat * len(inputs)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000,100000")
+    parser.add_argument("--profiles", type=int, default=200)
+    args = parser.parse_args()
+
+    user_inputs = [UserInput(**p) for p in make_profiles(args.profiles)]
+
+    print(f"{'rules':>7} {'strict us':>10} {'partial us':>11} {'groups':>8} {'sort us':>9} {'heap us':>9}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        system = FashionExpertSystem(make_rules(size, titles=size // 4))
+        repeat = max(1, 2000 // size)
+        strict = per_call_us(system.recommend_json, user_inputs, repeat)
+        partial = per_call_us(lambda u: system.recommend_json(u, scoring="partial"), user_inputs, repeat)
+
+        # Replay the merge to get the candidate lists the selection step sees
+        candidates = []
+        for user_input in user_inputs:
+            facts = {k: v for k, v in user_input.dict().items() if v is not None}
+            scored = system.evaluate(facts, system.snapshot, "partial")[0]
+            groups = {}
+            for rule, score in scored:
+                groups.setdefault(rule["recommendation"]["title"], rule["confidence"] * score)
+            candidates.append([(-round(c, 2), order, None, None) for order, c in enumerate(groups.values())])
+        mean_groups = sum(map(len, candidates)) / len(candidates)
+        full_sort = per_call_us(lambda ranked: sorted(ranked)[:TOP_K], candidates, repeat)
+        heap = per_call_us(lambda ranked: heapq.nsmallest(TOP_K, ranked), candidates, repeat)
+        print(f"{size:>7} {strict:>10.1f} {partial:>11.1f} {mean_groups:>8.0f} {full_sort:>9.1f} {heap:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Requests per second of /api/recommend with model-based vs. fragment-based serialization.
+
+    python benchmarks/bench_serialization.py [--profiles 3000]
+
+"models" is the original path: build Recommendation/RecommendationResponse,
+then let FastAPI validate them again through response_model and encode them
+with jsonable_encoder. "fragments" is FashionExpertSystem.recommend_json. The
+HTTP figures run through TestClient with the lookup table and result cache
+disabled so every request does inference.
+"""
+import argparse
+import json
+import time
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.testclient import TestClient
+from synthetic import make_profiles
+
+import main as service
+from main import RecommendationResponse, UserInput, app, expert_system
+
+
+def models_path(user_input):
+    response = RecommendationResponse(recommendations=expert_system.forward_chain(user_input))
+    validated = RecommendationResponse(**response.dict())  # response_model re-validation
+    return json.dumps(jsonable_encoder(validated, exclude_none=True), ensure_ascii=False,
+                      separators=(",", ":")).encode("utf-8")
+
+
+def rate(fn, items):
+    start = time.perf_counter()
+    for item in items:
+        fn(item)
+    return len(items) / (time.perf_counter() - start)
+
+
+@app.post("/bench/recommend-models", response_model=RecommendationResponse, response_model_exclude_none=True)
+async def recommend_with_models(user_input: UserInput):
+    """/api/recommend as it was before the fragment path"""
+    return RecommendationResponse(recommendations=expert_system.forward_chain(user_input))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--profiles", type=int, default=3000)
+    args = parser.parse_args()
+
+    profiles = make_profiles(args.profiles)
+    user_inputs = [UserInput(**p) for p in profiles]
+    for user_input in user_inputs[:200]:
+        assert json.loads(models_path(user_input)) == json.loads(expert_system.recommend_json(user_input))
+
+    print(f"{'path':<12} {'calls/s':>13}")
+    print(f"{'models':<12} {rate(models_path, user_inputs):>13.0f}")
+    print(f"{'fragments':<12} {rate(expert_system.recommend_json, user_inputs):>13.0f}")
+
+    service.recommendation_table = None
+    service.recommendation_cache.max_size = 0
+    client = TestClient(app)
+    models = rate(lambda p: client.post("/bench/recommend-models", json=p), profiles)
+    fragments = rate(lambda p: client.post("/api/recommend", json=p), profiles)
+    print(f"HTTP, no table or cache: models {models:.0f} requests/s, fragments {fragments:.0f} requests/s")
+
+
+if __name__ == "__main__":
+    main()
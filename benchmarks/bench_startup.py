@@ -0,0 +1,85 @@
+"""Worker startup time, import to first response, with and without a rules snapshot.
+
+    python benchmarks/bench_startup.py [--sizes 1000,100000,1000000]
+
+For each rule count a synthetic rules file is written to a temporary
+directory, then a fresh interpreter imports ``main`` and answers one
+/api/recommend request through the ASGI app, three times:
+
+- ``source``: no snapshot, so the rules file is parsed, validated and indexed
+- ``cold``: ``RULES_SNAPSHOT`` set but absent, so the worker builds from source and writes it
+- ``snapshot``: the worker starts from the snapshot the cold run wrote
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+from synthetic import make_rules
+
+ROOT = Path(__file__).resolve().parent.parent
+
+WORKER = """
+import asyncio, json, resource, sys, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+body = json.dumps({"gender": "male", "occasion": "formal", "weather": "cold", "body_type": "slim",
+                   "preferred_style": "classic"}).encode()
+status = []
+
+async def receive():
+    return {"type": "http.request", "body": body, "more_body": False}
+
+async def send(message):
+    if message["type"] == "http.response.start":
+        status.append(message["status"])
+
+scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST", "scheme": "http",
+         "path": "/api/recommend", "raw_path": b"/api/recommend", "root_path": "", "query_string": b"",
+         "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+         "client": ("127.0.0.1", 1), "server": ("127.0.0.1", 80)}
+asyncio.run(main.app(scope, receive, send))
+assert status == [200], status
+json.dump({"import": imported - started, "first_response": time.perf_counter() - imported,
+           "restored": main.saved_rules is not None,
+           "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}, sys.stdout)
+"""
+
+
+def start_worker(rules_file: Path, snapshot: str) -> dict:
+    env = dict(os.environ, RULES_FILE=str(rules_file), RULES_RELOAD_INTERVAL="0")
+    env.pop("RULES_SNAPSHOT", None)
+    if snapshot:
+        env["RULES_SNAPSHOT"] = snapshot
+    result = subprocess.run([sys.executable, "-c", WORKER], cwd=ROOT, env=env, check=True,
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    return json.loads(result.stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1000,100000,1000000")
+    args = parser.parse_args()
+
+    print(f"{'rules':>8} {'start':<9} {'import s':>9} {'first ms':>9} {'total s':>8} {'rss MB':>7} {'file MB':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in (int(s) for s in args.sizes.split(",")):
+            rules_file = Path(tmp) / f"rules-{size}.json"
+            rules_file.write_text(json.dumps({"rules": make_rules(size)}))
+            snapshot = Path(tmp) / f"rules-{size}.snap"
+            for name, setting in (("source", ""), ("cold", str(snapshot)), ("snapshot", str(snapshot))):
+                run = start_worker(rules_file, setting)
+                assert run["restored"] == (name == "snapshot")
+                size_mb = (snapshot if setting else rules_file).stat().st_size / 1e6
+                print(f"{size:>8} {name:<9} {run['import']:>9.2f} {run['first_response'] * 1000:>9.1f} "
+                      f"{run['import'] + run['first_response']:>8.2f} {run['rss_mb']:>7.0f} {size_mb:>8.1f}")
+            rules_file.unlink()
+            snapshot.unlink()
+
+
+if __name__ == "__main__":
+    main()
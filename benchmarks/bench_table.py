@@ -0,0 +1,57 @@
+"""Size and build time of the precomputed recommendation table vs. rule count.
+
+    python benchmarks/bench_table.py [--rules 12,20,50] [--max-entries 5000000]
+
+12 uses KNOWLEDGE_BASE; other sizes use synthetic rules. Lookup latency is
+compared with computing and encoding the response on every request.
+"""
+import argparse
+import os
+import time
+
+from synthetic import make_profiles, make_rules
+
+from lookup_table import TableTooLarge
+from main import (KNOWLEDGE_BASE, FashionExpertSystem, RecommendationResponse, UserInput,
+                  build_recommendation_table, encode_response)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rules", default="12,20,50")
+    parser.add_argument("--max-entries", type=int, default=5_000_000)
+    args = parser.parse_args()
+    os.environ["RECOMMENDATION_TABLE_MAX_ENTRIES"] = str(args.max_entries)
+
+    user_inputs = [UserInput(**p) for p in make_profiles(2000)]
+    fields = [u.dict() for u in user_inputs]
+
+    print(f"{'rules':>6} {'classes':>9} {'responses':>10} {'index KB':>9} {'payload KB':>11} "
+          f"{'build s':>8} {'lookup us':>10} {'compute us':>11}")
+    for size in (int(s) for s in args.rules.split(",")):
+        rules = KNOWLEDGE_BASE["rules"] if size == 12 else make_rules(size, titles=max(1, size // 2))
+        system = FashionExpertSystem(rules)
+        try:
+            table = build_recommendation_table(system)
+        except TableTooLarge as e:
+            print(f"{size:>6} skipped: {e}")
+            continue
+        stats = table.stats()
+
+        start = time.perf_counter()
+        for f in fields:
+            table.lookup(f)
+        lookup_us = (time.perf_counter() - start) / len(fields) * 1e6
+
+        start = time.perf_counter()
+        for u in user_inputs:
+            encode_response(RecommendationResponse(recommendations=system.forward_chain(u)))
+        compute_us = (time.perf_counter() - start) / len(user_inputs) * 1e6
+
+        print(f"{size:>6} {stats['classes']:>9} {stats['distinct_responses']:>10} "
+              f"{stats['index_bytes'] / 1024:>9.1f} {stats['payload_bytes'] / 1024:>11.1f} "
+              f"{stats['build_seconds']:>8.2f} {lookup_us:>10.2f} {compute_us:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Cost of the inference hot path with tracing off, tracing on, and the old per-rule prints.
+
+    python benchmarks/bench_trace.py [--rules 12] [--profiles 500]
+
+The print baseline replays the original stdout tracing (one line per rule and
+condition) against /dev/null, so it measures formatting and write syscalls
+without flooding the terminal.
+"""
+import argparse
+import os
+import sys
+import time
+
+from synthetic import make_profiles, make_rules
+
+from main import KNOWLEDGE_BASE, FashionExpertSystem, UserInput
+from tracing import InferenceTrace
+
+
+def legacy_forward_chain(system, user_input):
+    """Matching loop as it was before tracing became opt-in"""
+    user_dict = {k: v for k, v in user_input.dict().items() if v is not None}
+    print(f"Processing user input: {user_dict}")
+    for rule in system.rules:
+        print(f"\nEvaluating rule {rule['id']}")
+        print(f"Checking rule conditions: {rule['conditions']}")
+        print(f"Against user input: {user_dict}")
+        for key, expected_value in rule["conditions"].items():
+            user_value = user_dict.get(key)
+            print(f"  {key}: expected='{expected_value}', user='{user_value}'")
+            if user_value is None or user_value != expected_value:
+                print(f"  -> No match for {key}")
+                break
+        else:
+            print(f"  -> All conditions matched!")
+    return system.forward_chain(user_input)
+
+
+def per_call_us(fn, inputs, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for item in inputs:
+            fn(item)
+    return (time.perf_counter() - start) / (repeat * len(inputs)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rules", default="12,1000", help="comma separated rule counts; 12 is KNOWLEDGE_BASE")
+    parser.add_argument("--profiles", type=int, default=500)
+    args = parser.parse_args()
+
+    user_inputs = [UserInput(**p) for p in make_profiles(args.profiles)]
+    devnull = open(os.devnull, "w")
+
+    print(f"{'rules':>7} {'off us':>9} {'on us':>9} {'prints us':>10}")
+    for size in (int(s) for s in args.rules.split(",")):
+        rules = KNOWLEDGE_BASE["rules"] if size == 12 else make_rules(size)
+        system = FashionExpertSystem(rules)
+        repeat = max(1, 2000 // size)
+
+        off = per_call_us(system.forward_chain, user_inputs, repeat)
+        on = per_call_us(lambda u: system.forward_chain(u, InferenceTrace()), user_inputs, repeat)
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            legacy = per_call_us(lambda u: legacy_forward_chain(system, u), user_inputs, repeat)
+        finally:
+            sys.stdout = stdout
+        print(f"{size:>7} {off:>9.1f} {on:>9.1f} {legacy:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""Vectorized NumPy scoring vs. forward_chain at large profile counts.
+
+    python benchmarks/bench_vectorized.py [--profiles 1000000] [--rules 12]
+
+--rules 12 uses KNOWLEDGE_BASE; larger values use synthetic rules with shared
+titles. forward_chain throughput is measured on a sample and extrapolated.
+"""
+import argparse
+import time
+
+from synthetic import make_profiles, make_rules
+
+from main import KNOWLEDGE_BASE, FashionExpertSystem, UserInput
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--profiles", type=int, default=1_000_000)
+    parser.add_argument("--rules", type=int, default=12)
+    parser.add_argument("--sample", type=int, default=5000)
+    args = parser.parse_args()
+
+    rules = KNOWLEDGE_BASE["rules"] if args.rules == 12 else make_rules(args.rules, titles=args.rules // 4)
+    system = FashionExpertSystem(rules)
+    profiles = make_profiles(args.profiles)
+
+    start = time.perf_counter()
+    engine = system.vectorized_engine()
+    build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    codes = engine.encode(profiles)
+    encode = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = engine.score_codes(codes)
+    score = time.perf_counter() - start
+
+    sample = [UserInput(**p) for p in profiles[:args.sample]]
+    start = time.perf_counter()
+    expected = [system.forward_chain(p) for p in sample]
+    chain_per_profile = (time.perf_counter() - start) / len(sample)
+    assert system.forward_chain_vectorized(sample) == expected
+
+    print(f"rules={len(rules)} profiles={args.profiles} distinct encoded profiles={len(result.codes)}")
+    print(f"  build engine        {build * 1e3:10.1f} ms")
+    print(f"  encode profiles     {encode:10.2f} s  ({args.profiles / encode:,.0f} profiles/s)")
+    print(f"  vectorized scoring  {score:10.2f} s  ({args.profiles / score:,.0f} profiles/s)")
+    print(f"  forward_chain       {chain_per_profile * args.profiles:10.2f} s  "
+          f"({1 / chain_per_profile:,.0f} profiles/s, extrapolated from {len(sample)})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""Load test for the recommendation service: throughput, latency percentiles and memory.
+
+    python benchmarks/loadtest.py                       # in-process, KNOWLEDGE_BASE
+    python benchmarks/loadtest.py --mode uvicorn --workers 4 --rules 10000
+    python benchmarks/loadtest.py --compare benchmarks/results/previous.json
+
+Runs entirely offline. In ``inprocess`` mode requests go straight to the ASGI
+app through httpx; in ``uvicorn`` mode the app is started with the given
+number of workers on a local port. Each scenario keeps ``--concurrency``
+requests in flight for ``--duration`` seconds. Results are written as JSON
+(with the git commit) so runs can be compared between commits.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+from synthetic import make_rules, make_skewed_profiles
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def rss_kb(pid):
+    try:
+        for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def child_pids(pid):
+    try:
+        return [int(p) for p in Path(f"/proc/{pid}/task/{pid}/children").read_text().split()]
+    except OSError:
+        return []
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def scenarios(profiles, batch_size):
+    """name -> callable(client, i) issuing one request"""
+    batches = [profiles[i:i + batch_size] for i in range(0, len(profiles), batch_size)]
+
+    return {
+        "recommend": lambda client, i: client.post("/api/recommend", json=profiles[i % len(profiles)]),
+        "rules": lambda client, i: client.get("/api/rules"),
+        "rules_page": lambda client, i: client.get("/api/rules?limit=100&fields=id,conditions"),
+        "batch": lambda client, i: client.post("/api/recommend/batch", json={"profiles": batches[i % len(batches)]}),
+    }
+
+
+async def drive(client, request, concurrency, duration):
+    latencies, errors, counter = [], 0, iter(range(10 ** 12))
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            i = next(counter)
+            start = time.perf_counter()
+            try:
+                response = await request(client, i)
+                ok = response.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3) if latencies else None,
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+        "mean_ms": round(statistics.mean(latencies) * 1000, 3) if latencies else None,
+    }
+
+
+async def run_inprocess(args, selected):
+    import main
+    transport = httpx.ASGITransport(app=main.app)
+    results = {}
+    async with httpx.AsyncClient(transport=transport, base_url="http://loadtest") as client:
+        for name, request in selected.items():
+            await drive(client, request, args.concurrency, min(args.warmup, args.duration))
+            results[name] = await drive(client, request, args.concurrency, args.duration)
+    results["memory"] = {"max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+    return results
+
+
+async def run_uvicorn(args, selected, env):
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(args.workers), "--log-level", "warning"],
+        cwd=ROOT, env=env,
+    )
+    results = {}
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=60) as client:
+            for _ in range(600):
+                try:
+                    if (await client.get("/")).status_code == 200:
+                        break
+                except httpx.HTTPError:
+                    await asyncio.sleep(0.1)
+            else:
+                raise RuntimeError("uvicorn did not start")
+            for name, request in selected.items():
+                await drive(client, request, args.concurrency, min(args.warmup, args.duration))
+                results[name] = await drive(client, request, args.concurrency, args.duration)
+        workers = child_pids(server.pid) if args.workers > 1 else [server.pid]
+        results["memory"] = {"rss_kb_per_process": [rss_kb(pid) for pid in workers]}
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+    return results
+
+
+def print_results(results, previous=None):
+    print(f"{'scenario':<12} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for name, r in results.items():
+        if name == "memory":
+            continue
+        line = (f"{name:<12} {r['throughput_rps']:>9.1f} {r['p50_ms'] or 0:>8.2f} {r['p95_ms'] or 0:>8.2f} "
+                f"{r['p99_ms'] or 0:>8.2f} {r['errors']:>7}")
+        before = (previous or {}).get(name)
+        if before and before.get("throughput_rps"):
+            change = (r["throughput_rps"] / before["throughput_rps"] - 1) * 100
+            line += f"   {change:+.1f}% req/s vs {previous.get('_commit') or 'previous'}"
+        print(line)
+    print("memory:", results["memory"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mode", choices=["inprocess", "uvicorn"], default="inprocess")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--rules", type=int, default=0, help="synthetic rule count; 0 uses rules.json")
+    parser.add_argument("--scenarios", default="recommend,rules,rules_page,batch")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--warmup", type=float, default=2)
+    parser.add_argument("--profiles", type=int, default=20000)
+    parser.add_argument("--distinct", type=int, default=2000, help="distinct profiles in the Zipf-like mix")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--output", type=Path, default=None)
+    parser.add_argument("--compare", type=Path, default=None, help="previous results file to diff against")
+    args = parser.parse_args()
+
+    env = dict(os.environ, RULES_RELOAD_INTERVAL="0")
+    tmp = tempfile.TemporaryDirectory()
+    if args.rules:
+        rules_file = Path(tmp.name) / "rules.json"
+        rules_file.write_text(json.dumps({"rules": make_rules(args.rules, titles=max(1, args.rules // 4))}))
+        env["RULES_FILE"] = str(rules_file)
+    os.environ.update(env)
+
+    profiles = make_skewed_profiles(args.profiles, distinct=args.distinct)
+    available = scenarios(profiles, args.batch_size)
+    selected = {name: available[name] for name in args.scenarios.split(",")}
+
+    if args.mode == "inprocess":
+        results = asyncio.run(run_inprocess(args, selected))
+    else:
+        results = asyncio.run(run_uvicorn(args, selected, env))
+    tmp.cleanup()
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "config": {k: (str(v) if isinstance(v, Path) else v) for k, v in vars(args).items()},
+        "results": results,
+    }
+    output = args.output or ROOT / "benchmarks" / "results" / f"loadtest-{args.mode}-{report['commit'] or 'local'}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+
+    previous = None
+    if args.compare:
+        old = json.loads(args.compare.read_text())
+        previous = dict(old["results"], _commit=old.get("commit"))
+    print(f"mode={args.mode} rules={args.rules or 'rules.json'} concurrency={args.concurrency} commit={report['commit']}")
+    print_results(results, previous)
+    print(f"results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Synthetic rule bases and user profiles shared by the benchmark scripts."""
+import random
+import sys
+from pathlib import Path
+from typing import Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+ATTRIBUTE_VALUES = {
+    "gender": ["male", "female", "non-binary"],
+    "age_range": ["18-24", "25-34", "35-44", "45-54", "55+"],
+    "occasion": ["formal", "casual", "party", "sports", "wedding", "work", "date", "travel"],
+    "weather": ["hot", "cold", "mild", "rainy", "snowy", "windy"],
+    "body_type": ["slim", "athletic", "pear", "plus-size", "hourglass", "rectangle"],
+    "preferred_style": ["classic", "modern", "flashy", "fitted", "traditional", "minimalist", "sporty", "bohemian"],
+    "color_preference": ["dark", "neutral", "bright", "pastel"],
+    "height": ["short", "average", "tall"],
+}
+REQUIRED_ATTRIBUTES = ["gender", "occasion", "weather", "body_type", "preferred_style"]
+OPTIONAL_ATTRIBUTES = ["age_range", "color_preference", "height"]
+
+
+def make_rules(count: int, seed: int = 0, titles: int = 0) -> List[Dict]:
+    """Generate ``count`` rules shaped like the ones in KNOWLEDGE_BASE.
+
+    Each rule references one to three attributes. ``titles`` > 0 makes rules
+    share that many recommendation titles so the title merge path is exercised.
+    """
+    rng = random.Random(seed)
+    attributes = list(ATTRIBUTE_VALUES)
+    rules = []
+    for n in range(count):
+        keys = rng.sample(attributes, rng.choice([1, 2, 2, 3]))
+        title = f"Look {rng.randrange(titles)}" if titles else f"Look {n}"
+        rules.append({
+            "id": f"S{n + 1}",
+            "conditions": {key: rng.choice(ATTRIBUTE_VALUES[key]) for key in keys},
+            "recommendation": {
+                "title": title,
+                "items": [f"Item {n}a", f"Item {n}b", f"Item {n}c"],
+                "explanation": f"Synthetic rule {n + 1}.",
+            },
+            "confidence": round(rng.uniform(0.6, 0.98), 2),
+            "images": [f"https://example.com/look-{n}.jpg"],
+        })
+    return rules
+
+
+def make_chained_rules(count: int, depth: int = 5, seed: int = 0, values: int = 8) -> List[Dict]:
+    """Generate ``count`` rules where recommendations depend on chains of ``depth`` derived facts.
+
+    Rules at level 1 derive ``level1`` from input attributes; each later level
+    derives ``level<k>`` from ``level<k-1>`` (sometimes also testing an input
+    attribute). A fifth of the rules recommend looks, mostly from the deepest
+    level, so a matched recommendation needs the whole chain to fire.
+    """
+    rng = random.Random(seed)
+    attributes = list(ATTRIBUTE_VALUES)
+    derivations = count - count // 5
+    rules = []
+    for n in range(count):
+        if n < derivations:
+            level = n * depth // derivations + 1
+            conditions = {} if level > 1 else {
+                key: rng.choice(ATTRIBUTE_VALUES[key]) for key in rng.sample(attributes, rng.choice([1, 2]))}
+        else:
+            level = depth + 1 if rng.random() < 0.8 else rng.randint(2, depth)
+            conditions = {}
+        if level > 1:
+            conditions[f"level{level - 1}"] = f"v{rng.randrange(values)}"
+            if rng.random() < 0.3:
+                key = rng.choice(attributes)
+                conditions[key] = rng.choice(ATTRIBUTE_VALUES[key])
+        rule = {"id": f"C{n + 1}", "conditions": conditions, "confidence": round(rng.uniform(0.6, 0.98), 2)}
+        if n < derivations:
+            rule["derives"] = {f"level{level}": f"v{rng.randrange(values)}"}
+        else:
+            rule["recommendation"] = {
+                "title": f"Look {n}",
+                "items": [f"Item {n}a", f"Item {n}b"],
+                "explanation": f"Synthetic chained rule {n + 1}.",
+            }
+            rule["images"] = [f"https://example.com/look-{n}.jpg"]
+        rules.append(rule)
+    return rules
+
+
+def make_profiles(count: int, seed: int = 1) -> List[Dict]:
+    """Generate request bodies for /api/recommend with a realistic spread of values"""
+    rng = random.Random(seed)
+    profiles = []
+    for _ in range(count):
+        profile = {key: rng.choice(ATTRIBUTE_VALUES[key]) for key in REQUIRED_ATTRIBUTES}
+        for key in OPTIONAL_ATTRIBUTES:
+            if rng.random() < 0.5:
+                profile[key] = rng.choice(ATTRIBUTE_VALUES[key])
+        profiles.append(profile)
+    return profiles
+
+
+def make_skewed_profiles(count: int, distinct: int = 500, exponent: float = 1.1, seed: int = 2) -> List[Dict]:
+    """Profiles drawn from a Zipf-like popularity distribution over ``distinct`` profiles,
+    closer to production traffic where a few combinations dominate"""
+    rng = random.Random(seed)
+    pool = make_profiles(distinct, seed)
+    weights = [1 / (rank + 1) ** exponent for rank in range(distinct)]
+    return rng.choices(pool, weights=weights, k=count)
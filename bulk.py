@@ -0,0 +1,295 @@
+"""Streaming bulk scoring of newline-delimited JSON profiles.
+
+    python bulk.py profiles.ndjson [-o results.ndjson] [--workers 4] [--scoring partial]
+
+Reads one ``UserInput`` JSON object per line and writes one result per line,
+in input order: the same body ``/api/recommend`` returns, or
+``{"line": n, "error": "..."}`` for a line that is not a valid profile. Blank
+lines are skipped. ``-`` reads stdin / writes stdout.
+
+Input is consumed in chunks of ``chunk_size`` lines, and only ``window``
+chunks are ever in flight, so memory stays bounded however long the input is:
+the next chunk is read only once the oldest result has been handed to the
+consumer, which is how a slow reader pushes back on the producer. With
+``workers`` > 0 chunks are scored in a process pool; otherwise in-process.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, AsyncIterator, Callable, Deque, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; the stdlib parser gives the same values
+    orjson = None
+
+from http_cache import encode_json
+from result_cache import RecommendationCache
+
+DEFAULT_CHUNK_SIZE = 1000
+# Longer lines are reported as errors instead of being buffered
+MAX_LINE_BYTES = 64 * 1024
+READ_SIZE = 64 * 1024
+# Distinct input lines whose results each scorer remembers
+MEMO_SIZE = 65536
+
+# A line of input, or None for one that exceeded MAX_LINE_BYTES
+Line = Optional[bytes]
+Chunk = Tuple[int, List[Line]]
+
+
+def _loads(line: bytes) -> Any:
+    return orjson.loads(line) if orjson is not None else json.loads(line)
+
+
+class LineSplitter:
+    """Splits a byte stream into lines, holding at most one partial line of ``max_line`` bytes"""
+
+    def __init__(self, max_line: int = MAX_LINE_BYTES):
+        self.max_line = max_line
+        self._partial = b""
+        self._overlong = False
+
+    def feed(self, data: bytes) -> List[Line]:
+        lines: List[Line] = (self._partial + data).split(b"\n")
+        self._partial = lines.pop()
+        if self._overlong and lines:
+            # The first complete line is the tail of the one being discarded
+            lines[0] = None
+            self._overlong = False
+        for i, line in enumerate(lines):
+            if line is not None and len(line) > self.max_line:
+                lines[i] = None
+        if len(self._partial) > self.max_line:
+            self._partial = b""
+            self._overlong = True
+        return lines
+
+    def close(self) -> List[Line]:
+        if self._overlong:
+            return [None]
+        return [self._partial] if self._partial else []
+
+
+def read_lines(stream, max_line: int = MAX_LINE_BYTES, read_size: int = READ_SIZE) -> Iterator[Line]:
+    """Lines of a binary file object, read ``read_size`` bytes at a time"""
+    splitter = LineSplitter(max_line)
+    while True:
+        data = stream.read(read_size)
+        if not data:
+            break
+        yield from splitter.feed(data)
+    yield from splitter.close()
+
+
+def chunked(lines: Iterable[Line], size: int) -> Iterator[Chunk]:
+    """(first line number, lines) groups of ``size`` lines; numbering starts at 1"""
+    chunk: List[Line] = []
+    first = 1
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= size:
+            yield first, chunk
+            first += len(chunk)
+            chunk = []
+    if chunk:
+        yield first, chunk
+
+
+class ChunkScorer:
+    """Turns a chunk of NDJSON profiles into NDJSON results, one output line per non-blank input line
+
+    Bulk inputs repeat a lot, so results are also remembered by the raw line:
+    a repeated line skips parsing and validation as well as inference. The
+    memo is dropped whenever ``version()`` changes.
+    """
+
+    def __init__(self, parse: Callable[..., Any], render: Callable[[Any, str], bytes],
+                 version: Callable[[], Any] = lambda: None, memo_size: int = MEMO_SIZE):
+        self.parse = parse
+        self.render = render
+        self.version = version
+        self.memo = RecommendationCache(max_size=memo_size)
+
+    def __call__(self, lines: List[Line], first_line: int, scoring: str = "strict") -> bytes:
+        out = []
+        version = self.version()
+        for number, line in enumerate(lines, first_line):
+            if line is None:
+                out.append(encode_json({"line": number, "error": f"Line exceeds {MAX_LINE_BYTES} bytes"}))
+                continue
+            line = line.strip()
+            if not line:
+                continue
+            body = self.memo.get((line, scoring), version)
+            if body is not None:
+                out.append(body)
+                continue
+            try:
+                fields = _loads(line)
+            except ValueError as e:
+                out.append(encode_json({"line": number, "error": f"Invalid JSON: {e}"}))
+                continue
+            if not isinstance(fields, dict):
+                out.append(encode_json({"line": number, "error": "Expected a JSON object"}))
+                continue
+            try:
+                user_input = self.parse(**fields)
+            except ValueError as e:  # pydantic's ValidationError
+                out.append(encode_json({"line": number, "error": str(e)}))
+                continue
+            body = self.render(user_input, scoring)
+            self.memo.put((line, scoring), body, version)
+            out.append(body)
+        out.append(b"")
+        return b"\n".join(out) if len(out) > 1 else b""
+
+
+# Process pool workers score with their own copy of the service's engine
+_worker_scorer: Optional[ChunkScorer] = None
+
+
+def _init_worker(rules: List[dict]) -> None:
+    global _worker_scorer
+    import main
+    # A forked worker already has the rules; a spawned one loaded them from the file
+    if main.expert_system.rules != rules:
+        main.expert_system.load_rules(rules)
+    _worker_scorer = ChunkScorer(main.UserInput, main.response_body, lambda: main.expert_system.version)
+
+
+def _score_in_worker(lines: List[Line], first_line: int, scoring: str) -> bytes:
+    return _worker_scorer(lines, first_line, scoring)
+
+
+class BulkScorer:
+    """Scores NDJSON streams in order, with at most ``window`` chunks in flight"""
+
+    def __init__(self, scorer: ChunkScorer, rules: Callable[[], List[dict]], workers: int = 0,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE, window: Optional[int] = None):
+        self.scorer = scorer
+        self.rules = rules
+        self.workers = workers
+        self.chunk_size = chunk_size
+        # In-process scoring runs one chunk at a time; a pool keeps every worker busy
+        self.window = window or (2 * workers if workers else 1)
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(self.workers, initializer=_init_worker, initargs=(self.rules(),))
+        return self._pool
+
+    def submit(self, lines: List[Line], first_line: int, scoring: str) -> Future:
+        """Score a chunk in the current pool
+
+        Streams submit to whichever pool is current, so one that spans a
+        rule change carries on with the new workers instead of failing.
+        """
+        while True:
+            pool = self.pool()
+            try:
+                return pool.submit(_score_in_worker, lines, first_line, scoring)
+            except RuntimeError:
+                # reset() shut this pool down in between; a pool that is still current is really broken
+                if pool is self._pool:
+                    raise
+
+    def reset(self) -> None:
+        """Drop the pool so new workers start from the current rules; running chunks finish first"""
+        pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False)
+
+    def close(self) -> None:
+        pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown()
+
+    def score_lines(self, lines: Iterable[Line], scoring: str = "strict") -> Iterator[bytes]:
+        """NDJSON result blocks, one per chunk, in input order"""
+        if not self.workers:
+            for first, chunk in chunked(lines, self.chunk_size):
+                yield self.scorer(chunk, first, scoring)
+            return
+        pending: Deque = deque()
+        for first, chunk in chunked(lines, self.chunk_size):
+            pending.append(self.submit(chunk, first, scoring))
+            if len(pending) >= self.window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    async def score_stream(self, data: AsyncIterator[bytes], scoring: str = "strict") -> AsyncIterator[bytes]:
+        """score_lines over an async byte stream such as a request body
+
+        Chunks are scored off the event loop: in the pool, or in a thread.
+        """
+        loop = asyncio.get_running_loop()
+        splitter = LineSplitter()
+        pending: Deque[asyncio.Future] = deque()
+        chunk: List[Line] = []
+        first = 1
+
+        def submit():
+            nonlocal chunk, first
+            if self.workers:
+                pending.append(asyncio.wrap_future(self.submit(chunk, first, scoring)))
+            else:
+                pending.append(loop.run_in_executor(None, self.scorer, chunk, first, scoring))
+            first += len(chunk)
+            chunk = []
+
+        async for block in data:
+            for line in splitter.feed(block):
+                chunk.append(line)
+                if len(chunk) >= self.chunk_size:
+                    submit()
+                    if len(pending) >= self.window:
+                        yield await pending.popleft()
+        chunk.extend(splitter.close())
+        if chunk:
+            submit()
+        while pending:
+            yield await pending.popleft()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("input", help="NDJSON profiles, or - for stdin")
+    parser.add_argument("-o", "--output", default="-", help="NDJSON results, or - for stdout")
+    parser.add_argument("--workers", type=int, default=0, help="scoring processes (0: in-process)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--scoring", choices=["strict", "partial"], default=None)
+    args = parser.parse_args()
+
+    import main as service
+    system = service.expert_system
+    bulk = BulkScorer(ChunkScorer(service.UserInput, service.response_body, lambda: system.version),
+                      lambda: system.rules, workers=args.workers, chunk_size=args.chunk_size)
+    source = sys.stdin.buffer if args.input == "-" else open(args.input, "rb")
+    target = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    started = time.perf_counter()
+    records = 0
+    try:
+        for block in bulk.score_lines(read_lines(source), args.scoring or service.SCORING_MODE):
+            records += block.count(b"\n")
+            target.write(block)
+    finally:
+        bulk.close()
+        target.flush()
+        if source is not sys.stdin.buffer:
+            source.close()
+        if target is not sys.stdout.buffer:
+            target.close()
+    elapsed = time.perf_counter() - started
+    print(f"{records} records in {elapsed:.1f}s ({records / elapsed:.0f}/s)" if elapsed else f"{records} records",
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Compact in-memory rules: one ``__slots__`` object per rule, built from shared parts.
+
+A validated rule is a dict holding a conditions dict, a recommendation dict
+and two lists, which is several hundred bytes of containers per rule before
+any of its strings. ``CompiledRule`` keeps the same data in fixed slots, with
+tuples for items and images, and ``RuleCompiler`` makes equal values share
+one object: attribute names and values, titles, explanations, image URLs,
+item tuples, and whole condition dicts that several rules test.
+
+The engine reads the slots directly. Everything else can keep treating a
+rule as a read-only mapping shaped like the ``Rule`` schema's output: item
+access returns fresh plain dicts and lists, so a caller can never modify the
+shared parts, and ``dict(rule)`` is the JSON-ready rule.
+"""
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+# Keys in the order validate_rule produces them
+FIELDS = ("id", "conditions", "derives", "recommendation", "confidence", "images", "salience", "weights")
+
+
+class CompiledRule(Mapping):
+    """Immutable rule; see the module docstring. Build with RuleCompiler.compile"""
+
+    __slots__ = ("id", "conditions", "derives", "title", "outfit", "explanation", "confidence", "images",
+                 "salience", "weights", "present")
+
+    id: str
+    conditions: Dict[str, str]
+    derives: Optional[Dict[str, str]]
+    # None for rules that only derive facts
+    title: Optional[str]
+    # The recommendation's items (``items`` is the Mapping method)
+    outfit: Tuple[str, ...]
+    explanation: Optional[str]
+    confidence: float
+    images: Tuple[str, ...]
+    salience: int
+    weights: Optional[Dict[str, float]]
+    # The mapping keys present, in FIELDS order
+    present: Tuple[str, ...]
+
+    @property
+    def recommends(self) -> bool:
+        return self.title is not None
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self.present:
+            raise KeyError(key)
+        if key == "id":
+            return self.id
+        if key == "recommendation":
+            return {"title": self.title, "items": list(self.outfit), "explanation": self.explanation}
+        if key == "images":
+            return list(self.images)
+        value = getattr(self, key)
+        return dict(value) if isinstance(value, dict) else value
+
+    def __contains__(self, key: object) -> bool:
+        return key in self.present
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.present)
+
+    def __len__(self) -> int:
+        return len(self.present)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self[key] if key in self.present else default
+
+    def __repr__(self) -> str:
+        return f"CompiledRule({dict(self)!r})"
+
+    def fields(self) -> tuple:
+        """Slot values in ``__slots__`` order, for ``from_fields``"""
+        return (self.id, self.conditions, self.derives, self.title, self.outfit, self.explanation,
+                self.confidence, self.images, self.salience, self.weights, self.present)
+
+    @classmethod
+    def from_fields(cls, fields: tuple) -> "CompiledRule":
+        """Rebuild a rule from ``fields()``, e.g. read back from a snapshot file, without recompiling"""
+        rule = cls.__new__(cls)
+        (rule.id, rule.conditions, rule.derives, rule.title, rule.outfit, rule.explanation,
+         rule.confidence, rule.images, rule.salience, rule.weights, rule.present) = fields
+        return rule
+
+    def __reduce__(self):
+        # Slots don't pickle by default without a __dict__; rebuild from the plain form
+        return _uncompiled, (dict(self),)
+
+
+def _uncompiled(rule: Dict) -> CompiledRule:
+    return RuleCompiler().compile(rule)
+
+
+class RuleCompiler:
+    """Compiles rule dicts, sharing equal values between every rule it compiles
+
+    The pool only grows, so an engine starts a new compiler whenever it
+    replaces its whole rule base.
+    """
+
+    def __init__(self):
+        self._pool: Dict[Any, Any] = {}
+
+    def shared(self, value: Any) -> Any:
+        """The first value equal to ``value`` this compiler has seen"""
+        return self._pool.setdefault(value, value)
+
+    def _mapping(self, mapping: Optional[Dict]) -> Optional[Dict]:
+        if mapping is None:
+            return None
+        items = tuple((self.shared(key), self.shared(value)) for key, value in mapping.items())
+        key = ("mapping", items)
+        shared = self._pool.get(key)
+        if shared is None:
+            shared = self._pool[key] = dict(items)
+        return shared
+
+    def compile(self, rule: Dict) -> CompiledRule:
+        if isinstance(rule, CompiledRule):
+            return rule
+        compiled = CompiledRule.__new__(CompiledRule)
+        recommendation = rule.get("recommendation")
+        compiled.id = self.shared(rule["id"])
+        compiled.conditions = self._mapping(rule["conditions"])
+        compiled.derives = self._mapping(rule.get("derives"))
+        compiled.title = self.shared(recommendation["title"]) if recommendation else None
+        compiled.outfit = self.shared(tuple(map(self.shared, recommendation["items"]))) if recommendation else ()
+        compiled.explanation = self.shared(recommendation["explanation"]) if recommendation else None
+        compiled.confidence = rule["confidence"]
+        compiled.images = self.shared(tuple(map(self.shared, rule.get("images", ()))))
+        compiled.salience = rule.get("salience", 0)
+        # Not pooled: 1 == 1.0, so equal weights could come back with another type
+        compiled.weights = dict(rule["weights"]) if rule.get("weights") is not None else None
+        compiled.present = self.shared(tuple(key for key in FIELDS if rule.get(key) is not None))
+        return compiled
@@ -0,0 +1,203 @@
+"""Where CPU-bound inference runs, so one slow evaluation never stalls the event loop.
+
+Modes:
+
+- ``inline``: on the event loop; cheapest when every evaluation is tiny
+- ``thread``: in a thread pool; the loop keeps serving between GIL switches
+- ``process``: in a pre-warmed process pool whose workers hold the compiled rules
+- ``auto``: chosen per call from the observed cost of that kind of call:
+  inline under ``inline_budget`` seconds, a process above ``process_threshold``
+  when there are workers, a thread otherwise (and while the cost is unknown)
+
+At most ``max_pending`` calls are offloaded at once; beyond that ``run``
+raises ``Saturated`` immediately rather than queueing without bound, and the
+API answers 429.
+"""
+import asyncio
+import collections
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence
+
+from metrics import ObservationLog
+
+MODES = ("inline", "thread", "process", "auto")
+# Weight of the newest timing in a kind's running cost estimate
+EWMA_WEIGHT = 0.2
+
+
+class Saturated(RuntimeError):
+    pass
+
+
+# Each worker process evaluates with its own engine, built once by the initializer
+_worker_system: Any = None
+
+
+def _init_worker(factory: Callable[[List[Dict]], Any], rules: List[Dict]) -> None:
+    global _worker_system
+    _worker_system = factory(rules)
+
+
+def _worker_pid() -> int:
+    return os.getpid()
+
+
+def _call_in_worker(method: str, args: Sequence) -> tuple:
+    # Metrics live in the parent; the worker only logs what to count
+    log = _worker_system.metrics = ObservationLog()
+    start = time.perf_counter()
+    result = getattr(_worker_system, method)(*args)
+    return result, time.perf_counter() - start, log
+
+
+def _timed(fn: Callable, args: Sequence) -> tuple:
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+class InferenceExecutor:
+    """Runs engine methods inline, in threads or in worker processes, and sheds load when full
+
+    ``factory(rules)`` returns the engine a worker process evaluates with; it
+    must be picklable (a module-level function) when workers are spawned.
+    """
+
+    def __init__(self, system: Any, mode: str = "auto", workers: int = 0, threads: int = 4,
+                 max_pending: int = 64, inline_budget: float = 0.0005, process_threshold: float = 0.005,
+                 factory: Optional[Callable[[List[Dict]], Any]] = None):
+        if mode not in MODES:
+            raise ValueError(f"Unknown executor mode {mode!r}; expected one of {', '.join(MODES)}")
+        if mode == "process" and (workers < 1 or factory is None):
+            raise ValueError("Process mode needs at least one worker and an engine factory")
+        self.system = system
+        self.mode = mode
+        self.workers = workers if factory is not None else 0
+        self.threads = threads
+        self.max_pending = max_pending
+        self.inline_budget = inline_budget
+        self.process_threshold = process_threshold
+        self.factory = factory
+        # kind -> seconds per unit of work, from recent calls
+        self.estimates: Dict[Hashable, float] = {}
+        self.pending = 0
+        self.rejected = 0
+        self.runs: Dict[str, int] = collections.Counter()
+        self._threads: Optional[ThreadPoolExecutor] = None
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def choose(self, kind: Hashable, units: int = 1) -> str:
+        if self.mode != "auto":
+            return self.mode
+        estimate = self.estimates.get(kind)
+        if estimate is None:
+            return "thread"
+        cost = estimate * units
+        if cost <= self.inline_budget:
+            return "inline"
+        if cost >= self.process_threshold and self.workers:
+            return "process"
+        return "thread"
+
+    def _observe(self, kind: Hashable, elapsed: float, units: int) -> None:
+        cost = elapsed / max(units, 1)
+        estimate = self.estimates.get(kind)
+        self.estimates[kind] = cost if estimate is None else estimate + EWMA_WEIGHT * (cost - estimate)
+
+    def thread_pool(self) -> ThreadPoolExecutor:
+        if self._threads is None:
+            self._threads = ThreadPoolExecutor(self.threads, thread_name_prefix="inference")
+        return self._threads
+
+    def process_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(self.workers, initializer=_init_worker,
+                                             initargs=(self.factory, self.system.rules))
+        return self._pool
+
+    def warm(self) -> None:
+        """Start the worker processes now, so the first offloaded request doesn't pay for it"""
+        if self.workers and self.mode in ("process", "auto"):
+            pool = self.process_pool()
+            for _ in range(self.workers):
+                pool.submit(_worker_pid)
+
+    def reset(self) -> None:
+        """Replace the workers after a rule change; calls already running finish on the old ones"""
+        self.estimates.clear()
+        pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False)
+            self.warm()
+
+    def close(self) -> None:
+        for pool in (self._pool, self._threads):
+            if pool is not None:
+                pool.shutdown(wait=False)
+        self._pool = self._threads = None
+
+    def _finished(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Done callback of offloaded work, called from the pool; the count is updated on the loop"""
+        try:
+            loop.call_soon_threadsafe(self._release)
+        except RuntimeError:  # the loop has closed, so nothing else touches the count
+            self._release()
+
+    def _release(self) -> None:
+        self.pending -= 1
+
+    async def run(self, kind: Hashable, method: str, args: Sequence = (), units: int = 1) -> Any:
+        """``getattr(system, method)(*args)`` wherever its ``kind`` of call is cheapest to run
+
+        ``units`` scales the estimate for calls whose work grows with their
+        input, such as a batch of profiles.
+        """
+        mode = self.choose(kind, units)
+        self.runs[mode] += 1
+        if mode == "inline":
+            result, elapsed = _timed(getattr(self.system, method), args)
+            self._observe(kind, elapsed, units)
+            return result
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise Saturated(f"Inference queue is full ({self.max_pending} pending)")
+        loop = asyncio.get_running_loop()
+        if mode == "thread":
+            pool, task = self.thread_pool(), (_timed, getattr(self.system, method), args)
+        else:
+            # The rules the worker evaluates with; workers are replaced when they change
+            version = getattr(self.system, "version", None)
+            pool, task = self.process_pool(), (_call_in_worker, method, args)
+        future = pool.submit(*task)
+        # Counted until the work itself ends, not the request awaiting it: a
+        # cancelled request's work keeps running and still occupies the queue
+        self.pending += 1
+        future.add_done_callback(lambda _: self._finished(loop))
+        if mode == "thread":
+            result, elapsed = await asyncio.wrap_future(future)
+        else:
+            try:
+                result, elapsed, log = await asyncio.wrap_future(future)
+            except BrokenProcessPool:
+                self.reset()
+                raise
+            if self.system.metrics is not None:
+                log.replay(self.system.metrics, version)
+        self._observe(kind, elapsed, units)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "workers": self.workers,
+            "threads": self.threads,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "rejected": self.rejected,
+            "runs": dict(self.runs),
+            "estimates_us": {"/".join(map(str, kind)) if isinstance(kind, tuple) else str(kind): round(cost * 1e6, 1)
+                             for kind, cost in self.estimates.items()},
+        }
@@ -0,0 +1,281 @@
+"""Per-user feedback on recommendations, and the re-ranking it drives.
+
+A like or dismiss names the rules behind a recommendation (its
+``matched_rules``). Each user keeps a net score per rule (likes minus
+dismisses), and every rule keeps global like and dismiss totals. Both live in
+SQLite. Writes are queued in memory and committed by a background thread in
+batches of up to ``batch_size``, at least every ``flush_interval`` seconds.
+
+Re-ranking takes the engine's top candidates and orders them by::
+
+    confidence + user_weight * user affinity + global_weight * global affinity
+
+Affinities lie in (-1, 1) and are averaged over a candidate's matched rules.
+A user's net score ``n`` gives ``n / (|n| + 1)``. A rule's global affinity is
+``(likes - dismisses) / (likes + dismisses + global_prior)``, so a few votes
+barely move it. Without feedback the order is the engine's. Reported
+confidences are never changed.
+
+Per-user scores are loaded from SQLite on first use, one indexed range read,
+and kept in an LRU of ``cache_users`` users for ``cache_ttl`` seconds. A
+user's own feedback drops their entry, so their next request sees it even
+before it is committed. Feedback sent to another worker is seen once the
+entry expires. Global totals are read at startup and updated in memory.
+
+Loads never wait for the writer. Each batch is numbered, and its number is
+committed with it; a load reads the number in the same (WAL snapshot)
+transaction as the user's rows, then adds the queued and recently committed
+batches its snapshot doesn't include. A load still does I/O, so callers on
+an event loop run ``user_scores`` in a thread when ``cached_scores`` misses.
+"""
+import heapq
+import sqlite3
+import threading
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from result_cache import RecommendationCache
+
+ACTIONS = {"like": 1, "dismiss": -1}
+
+# (rule id, confidence, matched rule ids), as returned by FashionExpertSystem.rank_candidates
+Candidate = Tuple[str, float, List[str]]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_affinity (
+    user_id TEXT NOT NULL,
+    rule_id TEXT NOT NULL,
+    score INTEGER NOT NULL,
+    PRIMARY KEY (user_id, rule_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rule_feedback (
+    rule_id TEXT PRIMARY KEY,
+    likes INTEGER NOT NULL,
+    dismisses INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS feedback_meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+# Committed batches kept in memory for loads whose snapshot predates them
+KEEP_BATCHES = 8
+
+
+def connect(path: Path) -> sqlite3.Connection:
+    db = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.executescript(SCHEMA)
+    return db
+
+
+class FeedbackStore:
+    """SQLite-backed feedback with batched writes, a per-user LRU and re-ranking"""
+
+    def __init__(self, path: Path, cache_users: int = 100_000, cache_ttl: Optional[float] = 60.0,
+                 batch_size: int = 1000, flush_interval: float = 1.0, user_weight: float = 0.3,
+                 global_weight: float = 0.1, global_prior: float = 10.0):
+        self.path = Path(path)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.user_weight = user_weight
+        self.global_weight = global_weight
+        self.global_prior = global_prior
+        self.users = RecommendationCache(max_size=cache_users, ttl=cache_ttl)
+        self.recorded = 0
+        self.flushed = 0
+        self.batches = 0
+        self.last_error: Optional[str] = None
+        # The writer has its own connection, and each loading thread one of its; WAL lets them overlap
+        self._writer = connect(self.path)
+        self._local = threading.local()
+        self._readers: List[sqlite3.Connection] = []
+        # rule id -> [likes, dismisses], including writes not yet committed
+        self.totals: Dict[str, List[int]] = {
+            rule_id: [likes, dismisses]
+            for rule_id, likes, dismisses in self._writer.execute("SELECT rule_id, likes, dismisses FROM rule_feedback")}
+        # Number of the last committed batch
+        self._committed = self._writer.execute(
+            "SELECT coalesce(max(value), 0) FROM feedback_meta WHERE key = 'batches'").fetchone()[0]
+        # user -> rule -> net score not yet in a batch
+        self._pending: Dict[str, Dict[str, int]] = defaultdict(dict)
+        # (number, user -> rule -> net score) for the batch being committed and the last KEEP_BATCHES committed
+        self._batches: List[Tuple[int, Dict[str, Dict[str, int]]]] = []
+        # rule -> [likes, dismisses] not yet committed
+        self._votes: Dict[str, List[int]] = defaultdict(lambda: [0, 0])
+        self._pending_count = 0
+        # Guards the queues and the totals; never held during I/O
+        self._lock = threading.Lock()
+        # One flush at a time
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+
+    def record(self, user_id: str, rule_ids: Sequence[str], action: str) -> None:
+        """Queue a like or dismiss of the rules behind one recommendation"""
+        delta = ACTIONS[action]
+        with self._lock:
+            pending = self._pending[user_id]
+            for rule_id in rule_ids:
+                pending[rule_id] = pending.get(rule_id, 0) + delta
+                side = 0 if delta > 0 else 1
+                self.totals.setdefault(rule_id, [0, 0])[side] += 1
+                self._votes[rule_id][side] += 1
+            self._pending_count += len(rule_ids)
+            self.recorded += len(rule_ids)
+            self.users.discard(user_id)
+            full = self._pending_count >= self.batch_size
+        if self._thread is None:
+            self._start()
+        if full:
+            self._wake.set()
+
+    def cached_scores(self, user_id: str) -> Optional[Dict[str, int]]:
+        """A user's scores if they are in the LRU; never does I/O"""
+        return self.users.get(user_id)
+
+    def _reader(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = connect(self.path)
+            with self._lock:
+                self._readers.append(db)
+        return db
+
+    def user_scores(self, user_id: str, check_cache: bool = True) -> Dict[str, int]:
+        """Net score per rule for a user, from the LRU or one indexed read
+
+        Pass ``check_cache=False`` after ``cached_scores`` has missed, so the
+        request counts as one cache miss rather than two.
+        """
+        if check_cache:
+            scores = self.users.get(user_id)
+            if scores is not None:
+                return scores
+        db = self._reader()
+        while True:
+            db.execute("BEGIN")
+            try:
+                scores = dict(db.execute("SELECT rule_id, score FROM user_affinity WHERE user_id = ?", (user_id,)))
+                seen = db.execute("SELECT coalesce(max(value), 0) FROM feedback_meta WHERE key = 'batches'").fetchone()[0]
+            finally:
+                db.execute("COMMIT")
+            with self._lock:
+                oldest = self._batches[0][0] if self._batches else self._committed + 1
+                if seen + 1 < oldest:
+                    # Batches newer than the snapshot have already been dropped from memory; read again
+                    continue
+                for number, batch in self._batches:
+                    if number > seen:
+                        for rule_id, delta in batch.get(user_id, {}).items():
+                            scores[rule_id] = scores.get(rule_id, 0) + delta
+                for rule_id, delta in self._pending.get(user_id, {}).items():
+                    scores[rule_id] = scores.get(rule_id, 0) + delta
+                self.users.put(user_id, scores)
+            return scores
+
+    def rerank(self, candidates: Sequence[Candidate], scores: Dict[str, int], top_k: int) -> List[Candidate]:
+        """The ``top_k`` candidates by confidence blended with a user's ``scores`` and everyone's feedback"""
+        totals = self.totals
+        prior = self.global_prior
+        ranked = []
+        for order, candidate in enumerate(candidates):
+            _, confidence, matched = candidate
+            user = everyone = 0.0
+            for rule_id in matched:
+                net = scores.get(rule_id)
+                if net:
+                    user += net / (abs(net) + 1)
+                votes = totals.get(rule_id)
+                if votes is not None:
+                    everyone += (votes[0] - votes[1]) / (votes[0] + votes[1] + prior)
+            score = confidence + (self.user_weight * user + self.global_weight * everyone) / len(matched)
+            ranked.append((-score, order, candidate))
+        return [candidate for _, _, candidate in heapq.nsmallest(top_k, ranked)]
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is None and not self._closed:
+                self._thread = threading.Thread(target=self._run, name="feedback-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except sqlite3.Error as e:  # the batch was requeued; retry on the next round
+                self.last_error = str(e)
+
+    def flush(self) -> int:
+        """Commit everything queued in one transaction; returns the user rows written"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                number = self._committed + 1
+                batch, self._pending = self._pending, defaultdict(dict)
+                votes, self._votes = self._votes, defaultdict(lambda: [0, 0])
+                self._pending_count = 0
+                self._batches.append((number, batch))
+            rows = [(user_id, rule_id, delta) for user_id, rules in batch.items() for rule_id, delta in rules.items()]
+            try:
+                self._writer.execute("BEGIN")
+                self._writer.executemany(
+                    "INSERT INTO user_affinity (user_id, rule_id, score) VALUES (?, ?, ?) "
+                    "ON CONFLICT (user_id, rule_id) DO UPDATE SET score = score + excluded.score", rows)
+                self._writer.executemany(
+                    "INSERT INTO rule_feedback (rule_id, likes, dismisses) VALUES (?, ?, ?) "
+                    "ON CONFLICT (rule_id) DO UPDATE SET likes = likes + excluded.likes, "
+                    "dismisses = dismisses + excluded.dismisses",
+                    [(rule_id, likes, dismisses) for rule_id, (likes, dismisses) in votes.items()])
+                self._writer.execute(
+                    "INSERT INTO feedback_meta (key, value) VALUES ('batches', ?) "
+                    "ON CONFLICT (key) DO UPDATE SET value = excluded.value", (number,))
+                self._writer.execute("COMMIT")
+            except sqlite3.Error:
+                if self._writer.in_transaction:
+                    self._writer.execute("ROLLBACK")
+                # Requeue the batch for the next flush
+                with self._lock:
+                    self._batches.pop()
+                    for user_id, rules in batch.items():
+                        pending = self._pending[user_id]
+                        for rule_id, delta in rules.items():
+                            pending[rule_id] = pending.get(rule_id, 0) + delta
+                            self._pending_count += 1
+                    for rule_id, (likes, dismisses) in votes.items():
+                        self._votes[rule_id][0] += likes
+                        self._votes[rule_id][1] += dismisses
+                raise
+            with self._lock:
+                self._committed = number
+                del self._batches[:-KEEP_BATCHES]
+        self.flushed += len(rows)
+        self.batches += 1
+        return len(rows)
+
+    def close(self) -> None:
+        """Stop the writer and commit what is still queued"""
+        self._closed = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+        for db in self._readers:
+            db.close()
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "recorded": self.recorded,
+            "flushed": self.flushed,
+            "batches": self.batches,
+            "pending": self._pending_count,
+            "rules_with_feedback": len(self.totals),
+            "last_error": self.last_error,
+            "users": self.users.stats(),
+        }
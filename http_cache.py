@@ -0,0 +1,148 @@
+"""Pre-serialized JSON payloads with strong ETags and pre-compressed variants."""
+import gzip
+import hashlib
+import json
+from typing import Any, Dict, Optional, Tuple
+
+from fastapi import Request, Response
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; the stdlib encoder produces the same bytes
+    orjson = None
+
+# Bodies smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 1024
+
+
+def encode_json(data: Any) -> bytes:
+    """Compact UTF-8 JSON, as FastAPI's JSONResponse renders it"""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+class CachedPayload:
+    """A response body serialized once, compressed lazily at most once per encoding"""
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self.etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        self._encoded: Dict[str, bytes] = {}
+
+    @classmethod
+    def from_data(cls, data: Any) -> "CachedPayload":
+        return cls(encode_json(data))
+
+    def variant_etag(self, encoding: Optional[str]) -> str:
+        # Compressed bytes are a different representation, so they get their own validator
+        return self.etag if encoding is None else self.etag[:-1] + "-" + encoding + '"'
+
+    def encoded(self, encoding: Optional[str]) -> bytes:
+        if encoding is None:
+            return self.body
+        body = self._encoded.get(encoding)
+        if body is None:
+            if encoding == "br":
+                body = brotli.compress(self.body)
+            else:
+                body = gzip.compress(self.body, compresslevel=6, mtime=0)
+            self._encoded[encoding] = body
+        return body
+
+
+def choose_encoding(accept_encoding: str, size: int) -> Optional[str]:
+    """Pick br or gzip when the client accepts it and the body is large enough"""
+    if size < MIN_COMPRESS_SIZE or not accept_encoding:
+        return None
+    accepted = set()
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        params = params.replace(" ", "")
+        if params.startswith("q="):
+            try:
+                if float(params[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(name.strip().lower())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+
+def etag_matches(if_none_match: Optional[str], *etags: str) -> bool:
+    """Weak comparison, as If-None-Match requires"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return any(etag in candidates for etag in etags)
+
+
+def payload_response(request: Request, payload: CachedPayload, cache_control: str) -> Response:
+    """200 with the best encoding of ``payload``, or 304 if the client already has it"""
+    encoding = choose_encoding(request.headers.get("accept-encoding", ""), len(payload.body))
+    headers = {
+        "ETag": payload.variant_etag(encoding),
+        "Cache-Control": cache_control,
+        "Vary": "Accept-Encoding",
+    }
+    all_etags = [payload.etag, payload.variant_etag("gzip"), payload.variant_etag("br")]
+    if etag_matches(request.headers.get("if-none-match"), *all_etags):
+        return Response(status_code=304, headers=headers)
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    return Response(content=payload.encoded(encoding), media_type="application/json", headers=headers)
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Inclusive (start, end) of a single ``bytes=`` range, or None to send the whole body
+
+    Malformed and multi-range headers are ignored, as RFC 9110 allows. Raises
+    ValueError when the range lies entirely past the end of the body.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, sep, last = header[6:].strip().partition("-")
+    if not sep or not (first or last) or (first and not first.isdigit()) or (last and not last.isdigit()):
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        if int(last) == 0 or size == 0:
+            raise ValueError("empty suffix range")
+        return max(0, size - int(last)), size - 1
+    start, end = int(first), int(last) if last else size - 1
+    if start >= size:
+        raise ValueError(f"range starts past {size} bytes")
+    if end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+def range_response(request: Request, payload: CachedPayload, media_type: str, cache_control: str) -> Response:
+    """200, 206 for a byte range, 304 if the client already has it, or 416"""
+    size = len(payload.body)
+    headers = {"ETag": payload.etag, "Cache-Control": cache_control, "Accept-Ranges": "bytes"}
+    if etag_matches(request.headers.get("if-none-match"), payload.etag):
+        return Response(status_code=304, headers=headers)
+    if_range = request.headers.get("if-range")
+    if if_range is None or if_range.strip() == payload.etag:
+        try:
+            span = parse_range(request.headers.get("range"), size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        if span is not None:
+            start, end = span
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            return Response(content=payload.body[start:end + 1], status_code=206, media_type=media_type,
+                            headers=headers)
+    return Response(content=payload.body, media_type=media_type, headers=headers)
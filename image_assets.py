@@ -0,0 +1,182 @@
+"""Offline build of responsive image variants, and the manifest the API serves them from.
+
+    python image_assets.py [--source images] [--output static/images] [--widths 320,640,1024]
+                           [--base-url https://api.example.com]
+
+Every original in ``images/`` is resized to each width (never upscaled) and
+re-encoded as WebP and JPEG. File names carry a hash of their content, so
+they can be cached forever: a changed image gets a new name. The manifest
+lists the variants per original; rule image URLs are mapped to originals by
+file name, ignoring the ``_<id>`` suffix Cloudinary adds on upload.
+
+The frontend runs on another origin, so srcset URLs must be absolute:
+``--base-url`` writes the API's public URL into the manifest, and
+``ImageManifest(base_url=...)`` resolves a manifest's relative URLs against it.
+
+Building needs Pillow; serving only reads the manifest and the files.
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+MANIFEST_FORMAT = 1
+MANIFEST_NAME = "manifest.json"
+DEFAULT_WIDTHS = (320, 640, 1024)
+SOURCE_SUFFIXES = (".jpg", ".jpeg", ".png", ".webp")
+CONTENT_TYPES = {".webp": "image/webp", ".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png"}
+# format -> (Pillow format, file extension, encoder options)
+FORMATS = {
+    "webp": ("WEBP", "webp", {"quality": 80, "method": 6}),
+    "jpeg": ("JPEG", "jpg", {"quality": 82, "optimize": True, "progressive": True}),
+}
+
+
+def url_stem(url: str) -> str:
+    """File name of an image URL without directories, query string or extension"""
+    name = url.split("?", 1)[0].rsplit("/", 1)[-1]
+    return name.rsplit(".", 1)[0]
+
+
+def _encode(image, fmt: str) -> bytes:
+    pillow_format, _, options = FORMATS[fmt]
+    if pillow_format == "JPEG" and image.mode != "RGB":
+        # JPEG has no alpha channel; flatten onto white like a browser would
+        from PIL import Image
+        rgba = image.convert("RGBA")
+        flat = Image.new("RGB", rgba.size, (255, 255, 255))
+        flat.paste(rgba, mask=rgba.getchannel("A"))
+        image = flat
+    buffer = io.BytesIO()
+    image.save(buffer, pillow_format, **options)
+    return buffer.getvalue()
+
+
+def build(source_dir: Path, output_dir: Path, widths: Sequence[int] = DEFAULT_WIDTHS,
+          formats: Sequence[str] = tuple(FORMATS), url_prefix: str = "/static/images/") -> Dict:
+    """Write variants of every original into ``output_dir`` and return the manifest (also written there)"""
+    from PIL import Image, ImageOps
+
+    source_dir, output_dir = Path(source_dir), Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    images = {}
+    for path in sorted(source_dir.iterdir()):
+        if path.suffix.lower() not in SOURCE_SUFFIXES:
+            continue
+        with Image.open(path) as image:
+            image = ImageOps.exif_transpose(image)
+            image.load()
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "A" in image.getbands() or "transparency" in image.info else "RGB")
+        variants = []
+        for width in sorted({min(width, image.width) for width in widths}):
+            height = max(1, round(image.height * width / image.width))
+            resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+            for fmt in formats:
+                body = _encode(resized, fmt)
+                name = f"{path.stem}-{width}w.{hashlib.sha256(body).hexdigest()[:12]}.{FORMATS[fmt][1]}"
+                target = output_dir / name
+                if not target.exists():
+                    tmp = target.with_name(target.name + ".tmp")
+                    tmp.write_bytes(body)
+                    tmp.replace(target)
+                variants.append({"url": url_prefix + name, "file": name, "format": fmt,
+                                 "width": width, "height": height, "bytes": len(body)})
+        images[path.stem] = {
+            "original": {"file": path.name, "width": image.width, "height": image.height,
+                         "bytes": path.stat().st_size},
+            "variants": variants,
+        }
+    manifest = {"format": MANIFEST_FORMAT, "images": images}
+    tmp = output_dir / (MANIFEST_NAME + ".tmp")
+    tmp.write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    tmp.replace(output_dir / MANIFEST_NAME)
+    return manifest
+
+
+class ImageManifest:
+    """Built variants, looked up by the image URLs rules reference"""
+
+    def __init__(self, data: Dict, base_url: str = ""):
+        if data.get("format") != MANIFEST_FORMAT:
+            raise ValueError(f"Unsupported image manifest format {data.get('format')!r}")
+        self.images: Dict[str, Dict] = data["images"]
+        # Prefixed to variant URLs that are relative to the API's origin
+        self.base_url = base_url.rstrip("/")
+        self.files = {variant["file"]: variant for entry in self.images.values() for variant in entry["variants"]}
+        self._srcsets: Dict[str, Dict[str, str]] = {}
+
+    @classmethod
+    def load(cls, path: Path, base_url: str = "") -> "ImageManifest":
+        return cls(json.loads(Path(path).read_text(encoding="utf-8")), base_url)
+
+    def entry(self, url: str) -> Optional[Dict]:
+        stem = url_stem(url)
+        entry = self.images.get(stem)
+        if entry is None and "_" in stem:
+            # Cloudinary uploads are named <original>_<random id>
+            entry = self.images.get(stem.rsplit("_", 1)[0])
+        return entry
+
+    def srcset(self, url: str) -> Dict[str, str]:
+        """``srcset`` attribute value per format for an image URL; empty if it has no variants"""
+        srcset = self._srcsets.get(url)
+        if srcset is None:
+            srcset = {}
+            entry = self.entry(url)
+            for variant in entry["variants"] if entry else ():
+                variant_url = variant["url"]
+                if variant_url.startswith("/"):
+                    variant_url = self.base_url + variant_url
+                candidate = f"{variant_url} {variant['width']}w"
+                fmt = variant["format"]
+                srcset[fmt] = srcset[fmt] + ", " + candidate if fmt in srcset else candidate
+            self._srcsets[url] = srcset
+        return srcset
+
+
+def savings_report(manifest: Dict) -> List[Dict]:
+    """Per original: its size and the size of its largest and smallest variant per format"""
+    rows = []
+    for stem, entry in manifest["images"].items():
+        row = {"image": stem, "original_bytes": entry["original"]["bytes"]}
+        for fmt in FORMATS:
+            sizes = [v["bytes"] for v in entry["variants"] if v["format"] == fmt]
+            if sizes:
+                row[f"{fmt}_largest_bytes"] = sizes[-1]
+                row[f"{fmt}_smallest_bytes"] = sizes[0]
+        rows.append(row)
+    return rows
+
+
+def main():
+    root = Path(__file__).resolve().parent
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--source", default=root / "images", type=Path)
+    parser.add_argument("--output", default=root / "static" / "images", type=Path)
+    parser.add_argument("--widths", default=",".join(map(str, DEFAULT_WIDTHS)))
+    parser.add_argument("--base-url", default=os.getenv("IMAGE_BASE_URL", ""),
+                        help="public URL of the API, so variant URLs are absolute (default: $IMAGE_BASE_URL)")
+    args = parser.parse_args()
+
+    manifest = build(args.source, args.output, [int(w) for w in args.widths.split(",")],
+                     url_prefix=args.base_url.rstrip("/") + "/static/images/")
+    print(f"{'image':<28} {'original':>10} {'webp max':>10} {'jpeg max':>10} {'webp min':>10} {'saved':>7}")
+    total_original = total_largest = 0
+    for row in savings_report(manifest):
+        largest = row.get("webp_largest_bytes", row["original_bytes"])
+        total_original += row["original_bytes"]
+        total_largest += largest
+        print(f"{row['image']:<28} {row['original_bytes']:>10} {largest:>10} "
+              f"{row.get('jpeg_largest_bytes', 0):>10} {row.get('webp_smallest_bytes', 0):>10} "
+              f"{1 - largest / row['original_bytes']:>7.1%}")
+    if total_original:
+        print(f"{'total':<28} {total_original:>10} {total_largest:>10} {'':>10} {'':>10} "
+              f"{1 - total_largest / total_original:>7.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""Precomputed responses for every distinguishable input.
+
+Rules only compare attributes for equality against a handful of values, so any
+value no rule mentions behaves exactly like any other unmentioned value (or a
+missing one). Mapping each attribute onto "one of the referenced values, or
+other" splits the input space into a finite grid of equivalence classes; the
+response for each class is computed once and served by index arithmetic.
+"""
+import base64
+import hashlib
+import itertools
+import json
+import os
+import time
+from array import array
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+TABLE_FORMAT = 1
+OTHER = "__other__"
+
+
+def rules_fingerprint(rules: List[Dict]) -> str:
+    """Stable digest of a rule base, used to reject tables built from other rules"""
+    return hashlib.sha256(json.dumps([dict(rule) for rule in rules], sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class TableTooLarge(ValueError):
+    pass
+
+
+class RecommendationTable:
+    """Serialized response per input equivalence class, addressed by mixed-radix index"""
+
+    def __init__(self, attributes: List[str], values: List[List[Any]], entries: array,
+                 payloads: List[bytes], fingerprint: str, build_seconds: float = 0.0):
+        self.attributes = attributes
+        self.values = values
+        self.codes = [{value: code + 1 for code, value in enumerate(vals)} for vals in values]
+        self.radices = [len(vals) + 1 for vals in values]
+        self.entries = entries
+        self.payloads = payloads
+        self.fingerprint = fingerprint
+        self.build_seconds = build_seconds
+        self.version: Any = None
+
+    @staticmethod
+    def referenced_values(rules: List[Dict], attributes: Sequence[str],
+                          extra: Optional[Dict[str, List[Any]]] = None) -> List[List[Any]]:
+        """Per attribute, the values some rule (or ``extra``) compares against"""
+        values: List[Dict[Any, None]] = [{} for _ in attributes]
+        position = {attribute: j for j, attribute in enumerate(attributes)}
+        for rule in rules:
+            for key, value in rule["conditions"].items():
+                if key in position and value is not None:
+                    values[position[key]][value] = None
+        for key, vals in (extra or {}).items():
+            for value in vals:
+                values[position[key]][value] = None
+        return [list(v) for v in values]
+
+    @classmethod
+    def build(cls, rules: List[Dict], attributes: Sequence[str], required: Sequence[str],
+              render: Callable[[Dict[str, Any]], bytes], extra: Optional[Dict[str, List[Any]]] = None,
+              max_entries: int = 100_000, fingerprint: Optional[str] = None) -> "RecommendationTable":
+        """Render the response for a representative input of every class.
+
+        ``required`` attributes get the placeholder ``OTHER`` in the "other"
+        bucket, optional ones get None. Raises TableTooLarge when the grid has
+        more than ``max_entries`` cells. ``fingerprint`` defaults to the
+        rules' own; pass one covering anything else ``render`` depends on.
+        """
+        started = time.perf_counter()
+        attributes = list(attributes)
+        values = cls.referenced_values(rules, attributes, extra)
+        size = 1
+        for vals in values:
+            size *= len(vals) + 1
+        if size > max_entries:
+            raise TableTooLarge(f"{size} input classes exceed the limit of {max_entries}")
+
+        choices = []
+        for attribute, vals in zip(attributes, values):
+            other = OTHER if attribute in required else None
+            while other is not None and other in vals:
+                other = "_" + other
+            choices.append([other] + vals)
+
+        payload_ids: Dict[bytes, int] = {}
+        entries = array("I")
+        for combination in itertools.product(*choices):
+            payload = render(dict(zip(attributes, combination)))
+            entries.append(payload_ids.setdefault(payload, len(payload_ids)))
+        return cls(attributes, values, entries, list(payload_ids), fingerprint or rules_fingerprint(rules),
+                   time.perf_counter() - started)
+
+    def index(self, fields: Dict[str, Any]) -> int:
+        position = 0
+        for attribute, codes, radix in zip(self.attributes, self.codes, self.radices):
+            position = position * radix + codes.get(fields.get(attribute), 0)
+        return position
+
+    def lookup(self, fields: Dict[str, Any]) -> bytes:
+        """Serialized response for an input"""
+        return self.payloads[self.entries[self.index(fields)]]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "classes": len(self.entries),
+            "distinct_responses": len(self.payloads),
+            "index_bytes": self.entries.itemsize * len(self.entries),
+            "payload_bytes": sum(len(p) for p in self.payloads),
+            "build_seconds": round(self.build_seconds, 4),
+        }
+
+    def save(self, path: Path) -> None:
+        data = {
+            "format": TABLE_FORMAT,
+            "fingerprint": self.fingerprint,
+            "attributes": self.attributes,
+            "values": self.values,
+            "entries": base64.b64encode(self.entries.tobytes()).decode("ascii"),
+            "payloads": [p.decode("utf-8") for p in self.payloads],
+        }
+        path = Path(path)
+        # Per process, since workers starting together may all write the table
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(data), encoding="utf-8")
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path: Path, fingerprint: Optional[str] = None) -> "RecommendationTable":
+        """Load a saved table; raises ValueError if it was built from different rules"""
+        data = json.loads(Path(path).read_text(encoding="utf-8"))
+        if data.get("format") != TABLE_FORMAT:
+            raise ValueError(f"Unsupported table format {data.get('format')!r}")
+        if fingerprint is not None and data["fingerprint"] != fingerprint:
+            raise ValueError("Table was built from a different rule base")
+        entries = array("I")
+        entries.frombytes(base64.b64decode(data["entries"]))
+        return cls(data["attributes"], data["values"], entries,
+                   [p.encode("utf-8") for p in data["payloads"]], data["fingerprint"])
@@ -1,13 +1,33 @@
 
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field, root_validator, validator
+from typing import List, Literal, Optional, Dict, Any
+import asyncio
+import heapq
+import hashlib
 import json
 from pathlib import Path
 import os
 from dotenv import load_dotenv
 import logging
+import threading
+from rule_index import RuleIndex, RuleSnapshot
+from compact_rules import CompiledRule, RuleCompiler
+from rete import ReteNetwork
+from scoring import PartialMatcher
+from tracing import InferenceTrace
+from result_cache import RecommendationCache
+from lookup_table import RecommendationTable, rules_fingerprint
+from snapshot_file import SavedRules, load_snapshot, save_snapshot, source_digest
+from rule_store import RuleConflict, RuleNotFound, RuleStore, read_rules_file
+from http_cache import CachedPayload, encode_json, payload_response, range_response
+from image_assets import CONTENT_TYPES, MANIFEST_NAME, ImageManifest
+from executor import InferenceExecutor, Saturated
+from bulk import DEFAULT_CHUNK_SIZE, BulkScorer, ChunkScorer
+from feedback import FeedbackStore
+from metrics import Counter, EngineMetrics, Gauge, Histogram, MetricsMiddleware, Registry
 logger = logging.getLogger("uvicorn.error")
 
 load_dotenv()
@@ -47,238 +67,444 @@ class Recommendation(BaseModel):
     images: List[str]
     confidence: float
     matched_rules: List[str]
+    # Per image, a srcset value per format ("webp", "jpeg"), when variants were built
+    srcset: Optional[List[Dict[str, str]]] = None
 
 class RecommendationResponse(BaseModel):
     recommendations: List[Recommendation]
+    trace: Optional[Dict[str, Any]] = None
 
-# Knowledge Base - The exact rules from requirements
-KNOWLEDGE_BASE = {
-    "rules": [
-        {
-            "id": "R1",
-            "conditions": {"occasion": "formal", "gender": "male"},
-            "recommendation": {
-                "title": "Navy Two Piece Suit",
-                "items": ["Navy tailored suit", "White dress shirt", "Silk tie", "Oxford shoes", "Leather belt"],
-                "explanation": "Classic tailored silhouette for formal occasions. Navy is versatile and flattering for most body types."
-            },
-            "confidence": 0.95,
-            "images": ["https://res.cloudinary.com/df2q6gyuq/image/upload/v1756373710/mens-suit-navy_vshno9.png"]
-        },
-        {
-            "id": "R2",
-            "conditions": {"occasion": "formal", "gender": "female"},
-            "recommendation": {
-                "title": "Elegant Sheath Dress or Blazer Suit",
-                "items": ["Sheath dress or tailored blazer and trousers", "Heels or loafers", "Delicate jewelry"],
-                "explanation": "A structured dress or blazer suit projects confidence and works well for formal settings."
-            },
-            "confidence": 0.95,
-            "images": ["https://res.cloudinary.com/df2q6gyuq/image/upload/v1756374093/women-formal-dress_powxyg.png"]
-        },
-        {
-            "id": "R3",
-            "conditions": {"occasion": "casual", "weather": "hot"},
-            "recommendation": {
-                "title": "Light Casual Chic",
-                "items": ["Breathable T-shirt or linen shirt", "Lightweight chinos or denim shorts", "Loafers or sandals", "Sunglasses"],
-                "explanation": "Breathable fabrics keep you cool while maintaining a stylish, effortless look."
-            },
-            "confidence": 0.9,
-            "images": ["https://res.cloudinary.com/df2q6gyuq/image/upload/v1756373704/casual-outfit-summer_nyhtbx.jpg"]
-        },
-        {
-            "id": "R4",
-            "conditions": {"occasion": "casual", "weather": "cold"},
-            "recommendation": {
-                "title": "Layered Casual Warmth",
-                "items": ["Knitted sweater or hoodie", "Dark denim or tapered trousers", "Boots", "Scarf"],
-                "explanation": "Layering provides warmth and texture which elevates casual outfits."
-            },
-            "confidence": 0.9,
-            "images": ["https://res.cloudinary.com/df2q6gyuq/image/upload/v1756373699/sweater-outfit-winter_wdeqc3.jpg"]
-        },
-        {
-            "id": "R5",
-            "conditions": {"occasion": "party", "preferred_style": "flashy"},
-            "recommendation": {
-                "title": "Showstopper Party Look",
-                "items": ["Statement dress or blazer with sheen", "Bold jewellery", "Heels or stylish boots"],
-                "explanation": "High impact materials and accessories create a memorable party look."
-            },
-            "confidence": 0.92,
-            "images": ["https://res.cloudinary.com/df2q6gyuq/image/upload/v1756373697/party-outfit-glam_fjti5k.jpg"]
-        },
-        {
-            "id": "R6",
-            "conditions": {"occasion": "sports"},
-            "recommendation": {
-                "title": "Performance Sportswear",
-                "items": ["Moisture wicking top", "Athletic shorts or leggings", "Performance trainers"],
-                "explanation": "Function first, but choose sporty silhouettes and color pops to look intentional."
-            },
-            "confidence": 0.98,
-            "images": ["https://res.cloudinary.com/df2q6gyuq/image/upload/v1756374092/sportswear-athlete_a0ehji.png"]
-        },
-        {
-            "id": "R7",
-            "conditions": {"body_type": "plus-size", "preferred_style": "modern"},
-            "recommendation": {
-                "title": "Structured Modern Silhouette",
-                "items": ["Longline blazer", "High waisted trousers", "Pointed flats or low heels"],
-                "explanation": "Long lines and defined waist create a balanced silhouette while remaining comfortable."
-            },
-            "confidence": 0.88,
-            "images": ["https://res.cloudinary.com/df2q6gyuq/image/upload/v1756374093/plus-size-stylish-outfit_pszs6n.png"]
-        },
-        {
-            "id": "R8",
-            "conditions": {"body_type": "slim", "preferred_style": "fitted"},
-            "recommendation": {
-                "title": "Fitted and Tailored",
-                "items": ["Slim fit shirt", "Tapered trousers", "Low profile sneakers"],
-                "explanation": "Fitted shapes emphasize your proportions and create a sleek modern look."
-            },
-            "confidence": 0.85,
-            "images": ["https://res.cloudinary.com/df2q6gyuq/image/upload/v1756373702/slim-men-outfit_ls9kbg.jpg"]
-        },
-        {
-            "id": "R9",
-            "conditions": {"weather": "rainy"},
-            "recommendation": {
-                "title": "Smart Rain Ready",
-                "items": ["Waterproof coat or trench", "Ankle boots", "Umbrella", "Quick dry fabrics"],
-                "explanation": "Waterproof outerwear keeps the look polished and practical in wet conditions."
-            },
-            "confidence": 0.9,
-            "images": ["https://res.cloudinary.com/df2q6gyuq/image/upload/v1756373699/sweater-outfit-winter_wdeqc3.jpg"]
-        },
-        {
-            "id": "R10",
-            "conditions": {"occasion": "wedding", "preferred_style": "traditional"},
-            "recommendation": {
-                "title": "Heritage Formal",
-                "items": ["Traditional attire or ceremonial dress", "Classic accessories", "Polished shoes"],
-                "explanation": "Traditional pieces are respectful and often best for weddings that expect cultural attire."
-            },
-            "confidence": 0.93,
-            "images": ["https://res.cloudinary.com/df2q6gyuq/image/upload/v1756373697/wedding-traditional-attire_hrbvmh.jpg"]
-        },
-        {
-            "id": "R11",
-            "conditions": {"height": "short", "body_type": "pear"},
-            "recommendation": {
-                "title": "Proportional Balance",
-                "items": ["High waist bottoms", "V neck tops", "Minimal chunky shoes"],
-                "explanation": "High waisted bottoms and V necks elongate the torso and balance proportions."
-            },
-            "confidence": 0.82,
-            "images": ["https://res.cloudinary.com/df2q6gyuq/image/upload/v1756373696/fashion-proportions_tph8ks.jpg"]
-        },
-        {
-            "id": "R12",
-            "conditions": {"color_preference": "dark", "preferred_style": "minimalist"},
-            "recommendation": {
-                "title": "Minimalist Dark Palette",
-                "items": ["Monochrome top and bottom", "Textured layers", "Clean sneakers or loafers"],
-                "explanation": "Monochrome palettes with textural contrast achieve a minimalist but rich outfit."
-            },
-            "confidence": 0.8,
-            "images": ["https://res.cloudinary.com/df2q6gyuq/image/upload/v1756373705/minimalist-outfit-black_zaiiha.jpg"]
-        }
-    ]
-}
+class BatchRecommendationRequest(BaseModel):
+    profiles: List[UserInput]
+
+class BatchRecommendationResponse(BaseModel):
+    results: List[RecommendationResponse]
+
+class Feedback(BaseModel):
+    user_id: str = Field(..., min_length=1, max_length=128)
+    # The recommendation's matched_rules
+    matched_rules: List[str] = Field(..., min_items=1, max_items=100)
+    action: Literal["like", "dismiss"]
+
+class RuleRecommendation(BaseModel):
+    title: str
+    items: List[str]
+    explanation: str
+
+class Rule(BaseModel):
+    id: str
+    conditions: Dict[str, str]
+    # Facts added to working memory when the rule fires, for other rules to match on
+    derives: Optional[Dict[str, str]] = None
+    recommendation: Optional[RuleRecommendation] = None
+    confidence: float = Field(..., ge=0, le=1)
+    images: List[str] = []
+    # Higher fires first when several rules are ready at once
+    salience: Optional[int] = None
+    # Per-condition weights for partial scoring; unlisted conditions weigh 1
+    weights: Optional[Dict[str, float]] = None
+
+    @validator("conditions")
+    def conditions_not_empty(cls, conditions):
+        if not conditions:
+            raise ValueError("a rule needs at least one condition")
+        return conditions
+
+    @validator("weights")
+    def weights_apply_to_conditions(cls, weights, values):
+        if weights is None:
+            return weights
+        unknown = set(weights) - set(values.get("conditions") or {})
+        if unknown:
+            raise ValueError(f"weights for attributes without a condition: {sorted(unknown)}")
+        if any(weight <= 0 for weight in weights.values()):
+            raise ValueError("weights must be positive")
+        return weights
+
+    @root_validator(skip_on_failure=True)
+    def has_effect(cls, values):
+        if values.get("recommendation") is None and not values.get("derives"):
+            raise ValueError("a rule needs a recommendation, derived facts, or both")
+        return values
+
+def validate_rule(rule: Dict) -> Dict:
+    """Check a rule against the Rule schema and return it in canonical form"""
+    return Rule(**rule).dict(exclude_none=True)
+
+# "strict" only recommends rules whose conditions all hold; "partial" also
+# recommends near misses, scored by the weighted share of conditions that hold
+Scoring = Literal["strict", "partial"]
+SCORING_MODE = os.getenv("SCORING_MODE", "strict")
+PARTIAL_MIN_SCORE = float(os.getenv("PARTIAL_MIN_SCORE", "0.5"))
+TOP_K = 3
+# Engine candidates that feedback can re-rank into the top TOP_K
+RERANK_CANDIDATES = max(TOP_K, int(os.getenv("RERANK_CANDIDATES", "10")))
+
+# Knowledge Base - loaded from an external file so rules can change without a redeploy
+RULES_FILE = Path(os.getenv("RULES_FILE", Path(__file__).resolve().parent / "rules.json"))
+# Binary snapshot of the compiled rules, index and lookup table, so workers
+# start without parsing and indexing a large rules file; unset disables it
+RULES_SNAPSHOT = os.getenv("RULES_SNAPSHOT")
+
+def rules_source_digest() -> bytes:
+    """What a snapshot must have been built from: the rules file as validated by the current Rule schema"""
+    return source_digest(RULES_FILE, Rule.schema_json().encode("utf-8"))
+
+def read_rules_snapshot(digest: bytes) -> Optional[SavedRules]:
+    """The state saved for the current rules file, or None when it has to be built from source"""
+    path = Path(RULES_SNAPSHOT)
+    if not path.exists():
+        return None
+    try:
+        return load_snapshot(path, digest)
+    except (ValueError, EOFError, OSError) as e:
+        logger.warning(f"Rebuilding rules snapshot {path}: {e}")
+        return None
+
+rules_digest = rules_source_digest() if RULES_SNAPSHOT else None
+saved_rules = read_rules_snapshot(rules_digest) if RULES_SNAPSHOT else None
+KNOWLEDGE_BASE = {"rules": saved_rules.index.ordered_rules() if saved_rules is not None else
+                  [validate_rule(rule) for rule in read_rules_file(RULES_FILE)["rules"]]}
 
 class FashionExpertSystem:
-    def __init__(self):
-        self.rules = KNOWLEDGE_BASE["rules"]
+    def __init__(self, rules: Optional[List[Dict]] = None):
+        self._write_lock = threading.Lock()
+        self._fallback_json: Dict[bool, bytes] = {}
+        self.metrics: Optional[EngineMetrics] = None
+        self.images: Optional[ImageManifest] = None
+        self.snapshot = RuleSnapshot(RuleIndex([]), 0)
+        self.load_rules(KNOWLEDGE_BASE["rules"] if rules is None else rules)
+    
+    @property
+    def rules(self) -> List[Dict]:
+        return self.snapshot.rules
+    
+    @property
+    def index(self) -> RuleIndex:
+        return self.snapshot.index
+    
+    @property
+    def version(self) -> int:
+        """Changes whenever the rule base does; caches key their entries on it"""
+        return self.snapshot.version
+    
+    def load_rules(self, rules: List[Dict]) -> None:
+        """Replace the rule base and rebuild the index"""
+        with self._write_lock:
+            # A fresh compiler, so values only the old rules used are not kept alive
+            self.compiler = RuleCompiler()
+            rules = [self.compiler.compile(rule) for rule in rules]
+            self.snapshot = RuleSnapshot(RuleIndex(rules), self.snapshot.version + 1)
+    
+    def restore(self, saved: SavedRules) -> None:
+        """Install rules and an index read from a snapshot file, skipping compilation"""
+        with self._write_lock:
+            # Later upserts won't share values with the restored rules, which only costs memory
+            self.compiler = RuleCompiler()
+            snapshot = RuleSnapshot(saved.index, self.snapshot.version + 1)
+            snapshot.fingerprint = saved.fingerprint
+            self.snapshot = snapshot
+    
+    @property
+    def fingerprint(self) -> str:
+        """rules_fingerprint of the current rules, computed once per snapshot"""
+        snapshot = self.snapshot
+        if snapshot.fingerprint is None:
+            snapshot.fingerprint = rules_fingerprint(snapshot.rules)
+        return snapshot.fingerprint
+    
+    def apply_changes(self, upserts: List[Dict] = (), deletes: List[str] = ()) -> None:
+        """Add or replace rules (by id) and delete rules, updating the index incrementally
+
+        A new snapshot is built beside the current one and swapped in, so
+        requests already running finish against the rules they started with.
+        """
+        with self._write_lock:
+            snapshot = self.snapshot
+            upserts = [self.compiler.compile(rule) for rule in upserts]
+            self.snapshot = RuleSnapshot(snapshot.index.updated(upserts, deletes), snapshot.version + 1)
+    
+    def vectorized_engine(self, snapshot: Optional[RuleSnapshot] = None):
+        """NumPy engine over ``snapshot``'s rules (the current ones by default), built on first use (requires numpy)"""
+        snapshot = snapshot or self.snapshot
+        if snapshot.vectorized is None:
+            from vectorized import VectorizedEngine
+            snapshot.vectorized = VectorizedEngine(snapshot.rules, list(UserInput.__fields__))
+        return snapshot.vectorized
+    
+    def infer(self, facts: Dict[str, Any], snapshot: RuleSnapshot) -> tuple:
+        """(matched rules in knowledge base order, final facts, rule tests performed)
+
+        Rule bases without derived facts take a single pass through the index;
+        otherwise the Rete network chains to a fixpoint.
+        """
+        if not snapshot.chained:
+            return snapshot.index.matching_rules(facts), facts, len(snapshot.index.groups)
+        if snapshot.network is None:
+            snapshot.network = ReteNetwork(snapshot.rules)
+        session = snapshot.network.run(facts)
+        return session.fired_rules(), session.facts, session.activations
+    
+    def evaluate(self, facts: Dict[str, Any], snapshot: RuleSnapshot, scoring: str = "strict") -> tuple:
+        """(recommending rules with their scores, all matched rules, final facts, rule tests performed)
+
+        Facts are derived strictly in both modes; partial scoring only
+        changes which recommending rules count as matched.
+        """
+        if scoring == "strict":
+            matched_rules, facts, probes = self.infer(facts, snapshot)
+            return [(rule, 1.0) for rule in matched_rules if rule.recommends], matched_rules, facts, probes
+        derivations, probes = [], 0
+        if snapshot.chained:
+            fired, facts, probes = self.infer(facts, snapshot)
+            derivations = [rule for rule in fired if not rule.recommends]
+        if snapshot.partial is None:
+            snapshot.partial = PartialMatcher(snapshot.rules)
+        rules = snapshot.rules
+        scored = [(rules[position], score) for position, score in snapshot.partial.score(facts, PARTIAL_MIN_SCORE)]
+        return scored, derivations + [rule for rule, _ in scored], facts, probes + len(facts)
+    
+    def srcset(self, rule: CompiledRule) -> Optional[List[Dict[str, str]]]:
+        """Responsive variants of the rule's images, or None if none were built"""
+        if self.images is None:
+            return None
+        srcsets = [self.images.srcset(url) for url in rule.images]
+        return srcsets if any(srcsets) else None
     
     def matches_condition(self, rule_conditions: Dict, user_input: Dict) -> bool:
         """Check if user input matches all rule conditions"""
-        print(f"Checking rule conditions: {rule_conditions}")
-        print(f"Against user input: {user_input}")
+        return self.first_failed_condition(rule_conditions, user_input) is None
+    
+    def first_failed_condition(self, rule_conditions: Dict, user_input: Dict) -> Optional[tuple]:
+        """Return (key, expected, actual) for the first unmet condition, or None"""
         for key, expected_value in rule_conditions.items():
             user_value = user_input.get(key)
-            print(f"  {key}: expected='{expected_value}', user='{user_value}'")
             if user_value is None or user_value != expected_value:
-                print(f"  -> No match for {key}")
-                return False
-        print(f"  -> All conditions matched!")
-        return True
+                return key, expected_value, user_value
+        return None
     
-    def calculate_match_bonus(self, rule_conditions: Dict, user_input: Dict) -> float:
-        """Calculate bonus based on number of matching conditions"""
-        matches = sum(1 for key, value in rule_conditions.items() 
-                     if key in user_input and user_input[key] == value)
-        total_conditions = len(rule_conditions)
-        return (matches / total_conditions) * 0.1  # Up to 10% bonus
+    def calculate_match_bonus(self, rule_conditions: Dict, user_input: Dict,
+                              weights: Optional[Dict[str, float]] = None) -> float:
+        """Calculate bonus based on the (weighted) share of matching conditions"""
+        if not weights:
+            matches = sum(1 for key, value in rule_conditions.items() 
+                         if key in user_input and user_input[key] == value)
+            total_conditions = len(rule_conditions)
+            return (matches / total_conditions) * 0.1  # Up to 10% bonus
+        matched = sum(weights.get(key, 1.0) for key, value in rule_conditions.items()
+                      if key in user_input and user_input[key] == value)
+        return (matched / sum(weights.get(key, 1.0) for key in rule_conditions)) * 0.1
     
-    def forward_chain(self, user_input: UserInput) -> List[Recommendation]:
-        """Forward chaining inference engine"""
-        user_dict = user_input.dict()
+    def count_matches(self, key: tuple, fields: Dict[str, Any], scoring: str = "strict") -> None:
+        """Record match metrics for a request answered from the table or cache"""
+        if self.metrics is None:
+            return
+        snapshot = self.snapshot
+        memo = self.metrics.recall(snapshot.version, key)
+        if memo is None:
+            # Only inputs the engine never saw, such as the first table hit;
+            # the table only serves strict scoring, an index lookup
+            scored, matched_rules, _, probes = self.evaluate(
+                {k: v for k, v in fields.items() if v is not None}, snapshot, scoring)
+            memo = (probes, [rule.id for rule in matched_rules], not scored)
+            self.metrics.remember(snapshot.version, key, *memo)
+        probes, rule_ids, fallback = memo
+        self.metrics.observe_ids(probes, rule_ids)
+        if fallback:
+            self.metrics.fallback()
+    
+    def rank(self, user_input: UserInput, trace: Optional[InferenceTrace] = None,
+             snapshot: Optional[RuleSnapshot] = None, record: bool = True, scoring: str = "strict",
+             top_k: int = TOP_K) -> List[tuple]:
+        """Top ``top_k`` merged matches as (first rule, confidence, matched rule ids); empty if none matched
+
+        With ``scoring="partial"`` a rule's confidence and match bonus are
+        scaled by its score; a full match gives the same result as strict.
+        """
+        fields = user_input.dict()
         # Remove None values for cleaner matching
-        user_dict = {k: v for k, v in user_dict.items() if v is not None}
+        user_dict = {k: v for k, v in fields.items() if v is not None}
+        if trace is not None:
+            trace.stage("normalize")
         
-        print(f"Processing user input: {user_dict}")
-        
-        matched_rules = []
         recommendations_map = {}
         
-        # Find matching rules
-        for rule in self.rules:
-            print(f"\nEvaluating rule {rule['id']}")
-            if self.matches_condition(rule["conditions"], user_dict):
-                print(f"Rule {rule['id']} MATCHED!")
-                matched_rules.append(rule)
-                
-                # Group recommendations by title to merge similar ones
-                title = rule["recommendation"]["title"]
-                if title not in recommendations_map:
-                    recommendations_map[title] = {
-                        "rule": rule,
-                        "matched_rules": [rule["id"]],
-                        "confidence": rule["confidence"],
-                        "match_bonus": self.calculate_match_bonus(rule["conditions"], user_dict)
-                    }
-                else:
-                    # Merge with existing recommendation
-                    existing = recommendations_map[title]
-                    existing["matched_rules"].append(rule["id"])
-                    existing["confidence"] = (existing["confidence"] + rule["confidence"]) / 2
-                    existing["match_bonus"] += self.calculate_match_bonus(rule["conditions"], user_dict)
+        # Find matching rules through the compiled index; only rules whose
+        # conditions are all satisfied are returned, in knowledge base order
+        snapshot = snapshot or self.snapshot
+        scored, matched_rules, facts, probes = self.evaluate(user_dict, snapshot, scoring)
+        if record and self.metrics is not None:
+            self.metrics.observe(len(snapshot.rules) if trace is not None else probes, matched_rules)
+            # So table and cache hits for this input are counted without evaluating it again
+            self.metrics.remember(snapshot.version, response_key(fields, scoring), probes,
+                                  [rule.id for rule in matched_rules], not scored)
+        if trace is not None:
+            trace.stage("match")
+            trace.matched = [rule.id for rule in matched_rules]
+            trace.derived = {k: v for k, v in facts.items() if k not in user_dict}
+            # The index never looks at non-matching rules, so explain every
+            # rule separately; this only runs when a trace was requested
+            for rule in snapshot.rules:
+                trace.rule_evaluated(rule.id, self.first_failed_condition(rule.conditions, facts))
+            trace.stage("explain")
+        user_dict = facts
+        
+        for rule, score in scored:
+            confidence = rule.confidence * score
+            match_bonus = self.calculate_match_bonus(rule.conditions, user_dict, rule.weights)
+            # Group recommendations by title to merge similar ones:
+            # [first rule, matched rule ids, confidence, match bonus]
+            existing = recommendations_map.get(rule.title)
+            if existing is None:
+                recommendations_map[rule.title] = [rule, [rule.id], confidence, match_bonus]
             else:
-                print(f"Rule {rule['id']} did not match")
+                # Merge with existing recommendation
+                existing[1].append(rule.id)
+                existing[2] = (existing[2] + confidence) / 2
+                existing[3] += match_bonus
         
-        print(f"\nTotal matched rules: {len(matched_rules)}")
-        print(f"Recommendations map: {list(recommendations_map.keys())}")
+        ranked = []
+        for order, (rule, matched, confidence, match_bonus) in enumerate(recommendations_map.values()):
+            final_confidence = min(1.0, confidence + match_bonus)
+            ranked.append((-round(final_confidence, 2), order, rule, matched))
+        if trace is not None:
+            trace.stage("merge")
         
-        # Convert to recommendation objects
-        recommendations = []
-        for title, data in recommendations_map.items():
-            rule = data["rule"]
-            final_confidence = min(1.0, data["confidence"] + data["match_bonus"])
-            
-            recommendations.append(Recommendation(
-                title=rule["recommendation"]["title"],
-                items=rule["recommendation"]["items"],
-                explanation=rule["recommendation"]["explanation"],
-                images=rule["images"],
-                confidence=round(final_confidence, 2),
-                matched_rules=data["matched_rules"]
-            ))
-        
-        # Sort by confidence and return top 3
-        recommendations.sort(key=lambda x: x.confidence, reverse=True)
+        # Top k by confidence, ties in first-match order, from a bounded heap
+        # rather than sorting every merged group
+        top = heapq.nsmallest(top_k, ranked)
+        if trace is not None:
+            trace.stage("rank")
+        return [(rule, -confidence, matched) for confidence, _, rule, matched in top]
+    
+    def forward_chain(self, user_input: UserInput, trace: Optional[InferenceTrace] = None,
+                      scoring: str = "strict") -> List[Recommendation]:
+        """Forward chaining inference engine"""
+        # The fields come from validated rules, so the models skip validation
+        recommendations = [
+            Recommendation.construct(
+                title=rule.title,
+                items=list(rule.outfit),
+                explanation=rule.explanation,
+                images=list(rule.images),
+                confidence=confidence,
+                matched_rules=matched_rules,
+                srcset=self.srcset(rule)
+            )
+            for rule, confidence, matched_rules in self.rank(user_input, trace, scoring=scoring)
+        ]
         
         # If no matches, provide fallback recommendation
         if not recommendations:
             recommendations.append(self.get_fallback_recommendation(user_input))
-        
-        return recommendations[:3]
+            if trace is not None:
+                trace.fallback = True
+            if self.metrics is not None:
+                self.metrics.fallback()
+        return recommendations
+    
+    def recommend_json(self, user_input: UserInput, record: bool = True, scoring: str = "strict") -> bytes:
+        """forward_chain's result as a serialized RecommendationResponse, without building models
+
+        Each rule's title, items, explanation, images and srcset are encoded
+        once per snapshot; a response is just those fragments joined with the
+        per-request confidence and matched rule ids. Pass ``record=False``
+        when precomputing, so metrics only count real requests.
+        """
+        snapshot = self.snapshot
+        ranked = self.rank(user_input, snapshot=snapshot, record=record, scoring=scoring)
+        return self.ranked_json(user_input, ranked, snapshot, record)
+    
+    def rank_candidates(self, user_input: UserInput, scoring: str = "strict") -> List[tuple]:
+        """Top RERANK_CANDIDATES as (rule id, confidence, matched rule ids), for re-ranking
+
+        Plain values rather than rules, so they can come back from a worker
+        process and be cached across rule changes that keep the ids.
+        """
+        ranked = self.rank(user_input, scoring=scoring, top_k=RERANK_CANDIDATES)
+        return [(rule.id, confidence, matched) for rule, confidence, matched in ranked]
+    
+    def ranked_json(self, user_input: UserInput, ranked: List[tuple], snapshot: RuleSnapshot,
+                    record: bool = True) -> bytes:
+        """Serialized RecommendationResponse for ``rank``'s output, taken from ``snapshot``"""
+        if not ranked:
+            parts = [self.fallback_json(user_input)]
+            if record and self.metrics is not None:
+                self.metrics.fallback()
+        else:
+            fragments = snapshot.fragments
+            parts = []
+            for rule, confidence, matched_rules in ranked:
+                fragment = fragments.get(rule.id)
+                if fragment is None:
+                    srcset = self.srcset(rule)
+                    fragment = fragments[rule.id] = (
+                        encode_json({
+                            "title": rule.title,
+                            "items": rule.outfit,
+                            "explanation": rule.explanation,
+                            "images": rule.images,
+                        })[:-1] + b',"confidence":',
+                        b"}" if srcset is None else b',"srcset":' + encode_json(srcset) + b"}",
+                    )
+                head, tail = fragment
+                parts.append(head + repr(confidence).encode() + b',"matched_rules":'
+                             + encode_json(matched_rules) + tail)
+        return b'{"recommendations":[' + b",".join(parts) + b"]}"
+    
+    def recommend_traced_json(self, user_input: UserInput, scoring: str = "strict") -> bytes:
+        """forward_chain with a fresh InferenceTrace, as a serialized RecommendationResponse
+
+        Encoded here rather than by the endpoint's response model: a trace
+        lists every rule, and FastAPI's validation and encoding of it costs
+        far more than the inference itself.
+        """
+        trace = InferenceTrace()
+        recommendations = self.forward_chain(user_input, trace, scoring)
+        return encode_response(RecommendationResponse(recommendations=recommendations,
+                                                      trace=without_none(trace.to_dict())))
+    
+    def recommend_json_batch(self, user_inputs: List[UserInput], scoring: str = "strict") -> List[bytes]:
+        """recommend_json for each profile, in one call so it can be offloaded as one task"""
+        return [self.recommend_json(user_input, scoring=scoring) for user_input in user_inputs]
+    
+    def forward_chain_batch(self, user_inputs: List[UserInput]) -> List[List[Recommendation]]:
+        """Run forward_chain over many profiles, evaluating each distinct profile once"""
+        distinct: Dict[tuple, List[Recommendation]] = {}
+        results = []
+        for user_input in user_inputs:
+            key = RecommendationCache.make_key(user_input.dict())
+            recommendations = distinct.get(key)
+            if recommendations is None:
+                recommendations = distinct[key] = self.forward_chain(user_input)
+            results.append(recommendations)
+        return results
+    
+    def forward_chain_vectorized(self, user_inputs: List[UserInput]) -> List[List[Recommendation]]:
+        """Same results as forward_chain for every input, computed with NumPy
+
+        Rule bases that derive facts are evaluated with forward_chain_batch instead.
+        """
+        # One snapshot, so the ordinals and the matrix come from the same rules
+        snapshot = self.snapshot
+        if snapshot.chained:
+            return self.forward_chain_batch(user_inputs)
+        index = snapshot.index
+        result = self.vectorized_engine(snapshot).score(user_inputs)
+        recommendations = []
+        for i, user_input in enumerate(user_inputs):
+            fields = result.recommendations(i)
+            if fields:
+                # Image variants belong to the group's first rule, as in forward_chain
+                recommendations.append([
+                    Recommendation(**f, srcset=self.srcset(index.rules[index.ordinals[f["matched_rules"][0]]]))
+                    for f in fields])
+            else:
+                recommendations.append([self.get_fallback_recommendation(user_input)])
+        return recommendations
     
     def get_fallback_recommendation(self, user_input: UserInput) -> Recommendation:
         """Fallback recommendation when no rules match"""
-        print("Using fallback recommendation")
         if user_input.gender == "male":
             return Recommendation(
                 title="Safe Classic Style",
@@ -298,24 +524,622 @@ class FashionExpertSystem:
                 matched_rules=["FALLBACK"]
             )
 
+    def fallback_json(self, user_input: UserInput) -> bytes:
+        """Serialized fallback recommendation; there are only two, so they are encoded once"""
+        male = user_input.gender == "male"
+        body = self._fallback_json.get(male)
+        if body is None:
+            body = self._fallback_json[male] = encode_json(self.get_fallback_recommendation(user_input).dict(exclude_none=True))
+        return body
+
 # Initialize expert system
-expert_system = FashionExpertSystem()
+expert_system = FashionExpertSystem([] if saved_rules is not None else None)
+if saved_rules is not None:
+    expert_system.restore(saved_rules)
+rule_store = RuleStore(RULES_FILE, expert_system, validate=validate_rule)
+
+# Responsive image variants built by image_assets.py, served from /static/images
+IMAGE_DIR = Path(os.getenv("IMAGE_DIR", Path(__file__).resolve().parent / "static" / "images"))
+IMAGE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Public URL of this API; srcset URLs must be absolute, since the frontend runs on another origin
+IMAGE_BASE_URL = os.getenv("IMAGE_BASE_URL", "http://localhost:8000")
+
+def load_image_manifest(directory: Path) -> Optional[ImageManifest]:
+    path = directory / MANIFEST_NAME
+    if not path.exists():
+        return None
+    try:
+        return ImageManifest.load(path, IMAGE_BASE_URL)
+    except (ValueError, KeyError, OSError) as e:
+        logger.warning(f"Ignoring image manifest {path}: {e}")
+        return None
+
+expert_system.images = load_image_manifest(IMAGE_DIR)
+# Variant bytes read on first request; the set of files is bounded by the manifest
+image_payloads: Dict[str, CachedPayload] = {}
+RULES_RELOAD_INTERVAL = float(os.getenv("RULES_RELOAD_INTERVAL", "5"))
+
+# Cache of serialized /api/recommend responses, keyed on the normalized input
+_cache_ttl = os.getenv("RECOMMENDATION_CACHE_TTL")
+recommendation_cache = RecommendationCache(
+    max_size=int(os.getenv("RECOMMENDATION_CACHE_SIZE", "4096")),
+    ttl=float(_cache_ttl) if _cache_ttl else None,
+)
+
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "10000"))
+
+# Prometheus metrics, served at /metrics
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() not in ("0", "false", "no", "off")
+metrics_registry = Registry()
+responses_served = metrics_registry.register(Counter(
+    "stylist_responses_total", "Recommendations served, by where the response came from", ["source"]))
+if METRICS_ENABLED:
+    # MATCH_MEMO_SIZE distinct inputs' matches are remembered for counting table and cache hits
+    expert_system.metrics = EngineMetrics(metrics_registry, int(os.getenv("MATCH_MEMO_SIZE", "65536")))
+    app.add_middleware(MetricsMiddleware, histogram=metrics_registry.register(Histogram(
+        "stylist_http_request_duration_seconds", "HTTP request latency",
+        labels=["method", "route", "status"])))
+for _name, _help, _kind in [
+    ("hits", "Recommendation cache hits", "counter"),
+    ("misses", "Recommendation cache misses", "counter"),
+    ("evictions", "Recommendation cache evictions", "counter"),
+    ("hit_ratio", "Recommendation cache hits per lookup", "gauge"),
+    ("size", "Entries in the recommendation cache", "gauge"),
+]:
+    metrics_registry.register(Gauge(
+        f"stylist_cache_{_name}" + ("_total" if _kind == "counter" else ""), _help,
+        lambda _name=_name: recommendation_cache.stats()[_name], _kind))
+metrics_registry.register(Gauge("stylist_rules_loaded", "Rules in the current snapshot",
+                                lambda: len(expert_system.rules)))
+metrics_registry.register(Gauge("stylist_rules_version", "Version of the current rule snapshot",
+                                lambda: expert_system.version))
+
+def without_none(value: Any) -> Any:
+    """Drop None values from dicts at any depth, as response_model_exclude_none does for plain dicts"""
+    if isinstance(value, dict):
+        return {k: without_none(v) for k, v in value.items() if v is not None}
+    if isinstance(value, list):
+        return [without_none(v) for v in value]
+    return value
+
+def encode_response(response: BaseModel) -> bytes:
+    """Serialize a response model the same way FastAPI's JSONResponse does"""
+    return encode_json(response.dict(exclude_none=True))
+
+def table_fingerprint(system: FashionExpertSystem) -> str:
+    """Digest of everything a rendered response depends on: the rules and the image variants"""
+    if system.images is None:
+        return system.fingerprint
+    images = json.dumps([system.images.base_url, system.images.images], sort_keys=True)
+    return hashlib.sha256((system.fingerprint + images).encode("utf-8")).hexdigest()
+
+def build_recommendation_table(system: FashionExpertSystem) -> RecommendationTable:
+    """Precompute the serialized response for every input equivalence class"""
+    # The response only depends on which recommending rules matched (or, for
+    # the fallback, on the gender), so classes sharing a match set are rendered once
+    rendered: Dict[tuple, bytes] = {}
+    snapshot = system.snapshot
+    derived = {key for rule in snapshot.rules for key in rule.get("derives", ())}
+    if derived & set(UserInput.__fields__):
+        # A derived value fills in a missing attribute but not one the client
+        # sent, so "absent" and "unmentioned value" stop being one class
+        raise ValueError(f"rules derive input attributes {sorted(derived & set(UserInput.__fields__))}")
+    
+    def render(fields: Dict[str, Any]) -> bytes:
+        matched, _, _ = system.infer({k: v for k, v in fields.items() if v is not None}, snapshot)
+        signature = tuple(rule.id for rule in matched if rule.recommends)
+        signature = signature or ("fallback", fields["gender"] == "male")
+        body = rendered.get(signature)
+        if body is None:
+            body = rendered[signature] = system.recommend_json(UserInput.construct(**fields), record=False)
+        return body
+    
+    table = RecommendationTable.build(
+        snapshot.rules,
+        list(UserInput.__fields__),
+        [name for name, field in UserInput.__fields__.items() if field.required],
+        render,
+        # get_fallback_recommendation distinguishes male from everything else
+        extra={"gender": ["male"]},
+        max_entries=int(os.getenv("RECOMMENDATION_TABLE_MAX_ENTRIES", "100000")),
+        fingerprint=table_fingerprint(system),
+    )
+    table.version = snapshot.version
+    return table
+
+def load_recommendation_table(system: FashionExpertSystem, setting: str,
+                              saved: Optional[RecommendationTable] = None) -> Optional[RecommendationTable]:
+    """Build or load the lookup table according to ``RECOMMENDATION_TABLE``
+
+    ``off`` disables it, ``build`` builds it in memory, and any other value is
+    a file path that is loaded when it matches the current rules and
+    (re)written otherwise. A ``saved`` table from the rules snapshot is used
+    first if it still matches.
+    """
+    if setting == "off":
+        return None
+    if saved is not None and saved.fingerprint == table_fingerprint(system):
+        saved.version = system.version
+        return saved
+    path = None if setting == "build" else Path(setting)
+    if path is not None and path.exists():
+        try:
+            table = RecommendationTable.load(path, table_fingerprint(system))
+            table.version = system.version
+            return table
+        except (ValueError, KeyError, OSError) as e:
+            logger.warning(f"Rebuilding recommendation table {path}: {e}")
+    try:
+        table = build_recommendation_table(system)
+    except ValueError as e:  # TableTooLarge, or rules the table can't represent
+        logger.warning(f"Recommendation table disabled: {e}")
+        return None
+    if path is not None:
+        try:
+            table.save(path)
+        except OSError as e:
+            logger.warning(f"Could not write recommendation table {path}: {e}")
+    return table
+
+RECOMMENDATION_TABLE = os.getenv("RECOMMENDATION_TABLE", "build")
+recommendation_table = load_recommendation_table(expert_system, RECOMMENDATION_TABLE,
+                                                 saved_rules.table if saved_rules is not None else None)
+
+def write_rules_snapshot(digest: bytes) -> None:
+    """Save the compiled state built from ``digest``'s rules file for the next worker to start from"""
+    if rules_source_digest() != digest:
+        # The file changed while this worker was building; a later start saves the new rules
+        return
+    path = Path(RULES_SNAPSHOT)
+    try:
+        save_snapshot(path, expert_system.index, digest, expert_system.snapshot.fingerprint, recommendation_table)
+    except OSError as e:
+        logger.warning(f"Could not write rules snapshot {path}: {e}")
+    else:
+        logger.info(f"Wrote rules snapshot {path} ({len(expert_system.rules)} rules)")
+
+if RULES_SNAPSHOT and (saved_rules is None or recommendation_table not in (None, saved_rules.table)):
+    write_rules_snapshot(rules_digest)
+
+def refresh_recommendation_table() -> None:
+    """Rebuild the lookup table in the background after a rule change
+
+    Until the new table is ready, requests fall back to the cache and the
+    engine, since a table only serves the rule version it was built from.
+    """
+    if RECOMMENDATION_TABLE == "off":
+        return
+    
+    def rebuild():
+        global recommendation_table
+        version = expert_system.version
+        try:
+            table = load_recommendation_table(expert_system, RECOMMENDATION_TABLE)
+        except Exception as e:
+            logger.error(f"Rebuilding recommendation table failed: {e}", exc_info=True)
+            return
+        if table is not None and table.version == version == expert_system.version:
+            recommendation_table = table
+    
+    threading.Thread(target=rebuild, name="recommendation-table", daemon=True).start()
+
+rule_store.listeners.append(refresh_recommendation_table)
+
+def response_key(fields: Dict[str, Any], scoring: str) -> tuple:
+    """Cache key for a response; strict keys are unchanged so existing entries stay valid"""
+    key = RecommendationCache.make_key(fields)
+    return key if scoring == "strict" else key + (scoring,)
+
+def lookup_response_body(key: tuple, fields: Dict[str, Any], scoring: str = "strict") -> Optional[bytes]:
+    """Serialized response from the lookup table or the cache, if either has it"""
+    table = recommendation_table
+    # The table only holds strict results
+    if scoring == "strict" and table is not None and table.version == expert_system.version:
+        body, source = table.lookup(fields), "table"
+    else:
+        body, source = recommendation_cache.get(key, expert_system.version), "cache"
+    if body is not None:
+        responses_served.inc(labels=(source,))
+        # Inference was skipped, but per-rule counts must still cover every request
+        expert_system.count_matches(key, fields, scoring)
+    return body
+
+def response_body(user_input: UserInput, scoring: str = "strict") -> bytes:
+    """Serialized response for one profile, from the table, the cache or the engine"""
+    fields = user_input.dict()
+    key = response_key(fields, scoring)
+    # Read first, so a rule change during inference can't file the old rules' body under the new version
+    version = expert_system.version
+    body = lookup_response_body(key, fields, scoring)
+    if body is None:
+        body = expert_system.recommend_json(user_input, scoring=scoring)
+        recommendation_cache.put(key, body, version)
+        responses_served.inc(labels=("engine",))
+    return body
+
+# Streaming NDJSON scoring for profile sets too large to send as one batch
+BULK_WORKERS = int(os.getenv("BULK_WORKERS", "0"))
+bulk_scorer = BulkScorer(
+    ChunkScorer(UserInput, response_body, lambda: expert_system.version), lambda: expert_system.rules,
+    workers=BULK_WORKERS, chunk_size=int(os.getenv("BULK_CHUNK_SIZE", str(DEFAULT_CHUNK_SIZE))))
+rule_store.listeners.append(bulk_scorer.reset)
+
+def worker_engine(rules: List[Dict]) -> FashionExpertSystem:
+    """Engine for an inference worker process: this module's, holding ``rules``
+
+    A forked worker shares the parent's compiled snapshot until either side
+    writes to it; a spawned one imports this module and loads the rules file.
+    """
+    if expert_system.rules != rules:
+        expert_system.load_rules(rules)
+    return expert_system
+
+# Where engine evaluations run: see executor.py
+inference = InferenceExecutor(
+    expert_system,
+    mode=os.getenv("INFERENCE_EXECUTOR", "auto"),
+    workers=int(os.getenv("INFERENCE_WORKERS", "0")),
+    threads=int(os.getenv("INFERENCE_THREADS", "4")),
+    max_pending=int(os.getenv("INFERENCE_MAX_PENDING", "64")),
+    inline_budget=float(os.getenv("INFERENCE_INLINE_BUDGET_MS", "0.5")) / 1000,
+    process_threshold=float(os.getenv("INFERENCE_PROCESS_THRESHOLD_MS", "5")) / 1000,
+    factory=worker_engine,
+)
+rule_store.listeners.append(inference.reset)
+metrics_registry.register(Gauge("stylist_inference_pending", "Engine evaluations offloaded and not yet finished",
+                                lambda: inference.pending))
+metrics_registry.register(Gauge("stylist_inference_rejected_total", "Requests refused because too many were pending",
+                                lambda: inference.rejected, "counter"))
+
+# Per-user feedback and re-ranking: see feedback.py. Unset FEEDBACK_DB disables both
+FEEDBACK_DB = os.getenv("FEEDBACK_DB")
+_feedback_ttl = os.getenv("FEEDBACK_CACHE_TTL", "60")
+feedback_store = FeedbackStore(
+    FEEDBACK_DB,
+    cache_users=int(os.getenv("FEEDBACK_CACHE_USERS", "100000")),
+    cache_ttl=float(_feedback_ttl) if _feedback_ttl else None,
+    batch_size=int(os.getenv("FEEDBACK_BATCH_SIZE", "1000")),
+    flush_interval=float(os.getenv("FEEDBACK_FLUSH_INTERVAL", "1")),
+    user_weight=float(os.getenv("RERANK_USER_WEIGHT", "0.3")),
+    global_weight=float(os.getenv("RERANK_GLOBAL_WEIGHT", "0.1")),
+) if FEEDBACK_DB else None
+# Unpersonalized candidates per normalized input, so personalized requests skip the engine
+candidate_cache = RecommendationCache(
+    max_size=int(os.getenv("RECOMMENDATION_CACHE_SIZE", "4096")),
+    ttl=float(_cache_ttl) if _cache_ttl else None,
+)
+if feedback_store is not None:
+    metrics_registry.register(Gauge("stylist_feedback_pending", "Feedback rows queued and not yet committed",
+                                    lambda: feedback_store.stats()["pending"]))
+
+async def personalized_body(user_input: UserInput, user_id: str, scoring: str) -> bytes:
+    """The response re-ranked with ``user_id``'s and everyone's feedback"""
+    fields = user_input.dict()
+    key = response_key(fields, scoring)
+    version = expert_system.version
+    candidates = candidate_cache.get(key, version)
+    computed = candidates is None
+    if computed:
+        candidates = await inference.run(("candidates", scoring), "rank_candidates", (user_input, scoring))
+        candidate_cache.put(key, candidates, version)
+        responses_served.inc(labels=("engine",))
+    else:
+        expert_system.count_matches(key, fields, scoring)
+        responses_served.inc(labels=("personalized",))
+    scores = feedback_store.cached_scores(user_id)
+    if scores is None:
+        # A SQLite read, off the event loop
+        scores = await asyncio.to_thread(feedback_store.user_scores, user_id, False)
+    snapshot = expert_system.snapshot
+    index = snapshot.index
+    ranked = [(index.rules[index.ordinals[rule_id]], confidence, matched)
+              for rule_id, confidence, matched in feedback_store.rerank(candidates, scores, TOP_K)
+              # Rules deleted since the candidates were computed
+              if rule_id in index.ordinals]
+    # Computing the candidates counted the matches but not the fallback
+    return expert_system.ranked_json(user_input, ranked, snapshot, record=computed)
+
+ROOT_PAYLOAD = CachedPayload.from_data({"message": "AI Fashion Stylist API", "version": "1.0.0"})
 
 @app.get("/")
-async def root():
-    return {"message": "AI Fashion Stylist API", "version": "1.0.0"}
+async def root(request: Request):
+    return payload_response(request, ROOT_PAYLOAD, "public, max-age=3600")
+
+@app.post("/api/recommend", response_model=RecommendationResponse, response_model_exclude_none=True)
+async def get_recommendations(user_input: UserInput, trace: bool = False, scoring: Optional[Scoring] = None,
+                              user_id: Optional[str] = Query(None, min_length=1, max_length=128)):
+    """Get fashion recommendations based on user preferences
 
-@app.post("/api/recommend", response_model=RecommendationResponse)
-async def get_recommendations(user_input: UserInput):
-    """Get fashion recommendations based on user preferences"""
+    Pass ``?trace=true`` to include a per-request explanation of which rules
+    were evaluated, which condition failed and how long each stage took.
+    ``?scoring=partial`` also recommends rules that only partly match;
+    ``?scoring=strict`` requires every condition to hold. ``?user_id=``
+    re-ranks the candidates with that user's feedback when feedback is enabled.
+    """
+    scoring = scoring or SCORING_MODE
     try:
-        recommendations = expert_system.forward_chain(user_input)
-        return RecommendationResponse(recommendations=recommendations)
+        if trace:
+            body = await inference.run(("trace", scoring), "recommend_traced_json", (user_input, scoring))
+            return Response(content=body, media_type="application/json")
+        
+        if user_id is not None and feedback_store is not None:
+            body = await personalized_body(user_input, user_id, scoring)
+            return Response(content=body, media_type="application/json")
+        
+        # Served from the precomputed table, or the bytes stored on the first
+        # request, skipping inference, model construction and encoding entirely
+        fields = user_input.dict()
+        key = response_key(fields, scoring)
+        # Read before the await, so a rule change meanwhile can't file the old rules' body under the new version
+        version = expert_system.version
+        body = lookup_response_body(key, fields, scoring)
+        if body is None:
+            body = await inference.run(("recommend", scoring), "recommend_json", (user_input, True, scoring))
+            recommendation_cache.put(key, body, version)
+            responses_served.inc(labels=("engine",))
+        return Response(content=body, media_type="application/json")
+    except Saturated as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "1"})
     except Exception as e:
         logger.error(f"Error in /api/recommend: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error generating recommendations: {str(e)}")
 
+@app.post("/api/recommend/batch", response_model=BatchRecommendationResponse, response_model_exclude_none=True)
+async def get_batch_recommendations(batch: BatchRecommendationRequest, scoring: Optional[Scoring] = None):
+    """Get recommendations for many profiles at once, returned in input order"""
+    scoring = scoring or SCORING_MODE
+    if len(batch.profiles) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {MAX_BATCH_SIZE} profiles")
+    try:
+        # Identical profiles share one serialized result, taken from the
+        # recommendation cache when possible
+        version = expert_system.version
+        bodies: Dict[tuple, bytes] = {}
+        misses: Dict[tuple, UserInput] = {}
+        # Repeats of a missed profile, counted once the engine has remembered its matches
+        repeated_misses: Dict[tuple, int] = {}
+        keys = []
+        for user_input in batch.profiles:
+            fields = user_input.dict()
+            key = response_key(fields, scoring)
+            keys.append(key)
+            if key in misses:
+                responses_served.inc(labels=("batch_duplicate",))
+                repeated_misses[key] = repeated_misses.get(key, 0) + 1
+                continue
+            if key in bodies:
+                responses_served.inc(labels=("batch_duplicate",))
+                expert_system.count_matches(key, fields, scoring)
+                continue
+            body = lookup_response_body(key, fields, scoring)
+            if body is None:
+                misses[key] = user_input
+            else:
+                bodies[key] = body
+        
+        if misses:
+            computed = await inference.run(("recommend", scoring), "recommend_json_batch",
+                                           (list(misses.values()), scoring), units=len(misses))
+            for key, body in zip(misses, computed):
+                recommendation_cache.put(key, body, version)
+                bodies[key] = body
+            responses_served.inc(len(misses), labels=("engine",))
+            for key, repeats in repeated_misses.items():
+                fields = misses[key].dict()
+                for _ in range(repeats):
+                    expert_system.count_matches(key, fields, scoring)
+        
+        content = b'{"results":[' + b",".join(bodies[key] for key in keys) + b"]}"
+        return Response(content=content, media_type="application/json")
+    except Saturated as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "1"})
+    except Exception as e:
+        logger.error(f"Error in /api/recommend/batch: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Error generating recommendations: {str(e)}")
+
+class BodyStreamingResponse(StreamingResponse):
+    """StreamingResponse whose content may still be reading the request body
+
+    StreamingResponse listens for a disconnect on ``receive`` while streaming,
+    which would swallow the body messages; ``request.stream()`` raises on a
+    disconnect itself.
+    """
+
+    async def __call__(self, scope, receive, send) -> None:
+        await self.stream_response(send)
+
+@app.post("/api/recommend/stream")
+async def stream_recommendations(request: Request, scoring: Optional[Scoring] = None):
+    """Score newline-delimited JSON profiles from the request body, streaming one result per line
+
+    Results come back in input order as they are computed; a line that is not
+    a valid profile yields ``{"line": n, "error": ...}`` instead. The body is
+    read a chunk at a time, so memory does not grow with the input.
+    """
+    return BodyStreamingResponse(bulk_scorer.score_stream(request.stream(), scoring or SCORING_MODE),
+                                 media_type="application/x-ndjson")
+
+@app.get("/api/cache/stats")
+async def get_cache_stats():
+    """Hit, miss and eviction counters for the recommendation cache"""
+    return recommendation_cache.stats()
+
+@app.get("/api/executor/stats")
+async def get_executor_stats():
+    """Execution mode, pending and rejected evaluations, and the cost estimates behind auto mode"""
+    return inference.stats()
+
+@app.post("/api/feedback", status_code=202)
+async def post_feedback(feedback: Feedback):
+    """Record a like or dismiss of a recommendation; committed in the background"""
+    if feedback_store is None:
+        raise HTTPException(status_code=503, detail="Feedback is disabled (set FEEDBACK_DB)")
+    ordinals = expert_system.index.ordinals
+    unknown = [rule_id for rule_id in feedback.matched_rules if rule_id not in ordinals]
+    if unknown:
+        raise HTTPException(status_code=404, detail=f"Unknown rules: {', '.join(unknown)}")
+    feedback_store.record(feedback.user_id, feedback.matched_rules, feedback.action)
+    return {"status": "accepted"}
+
+@app.get("/api/feedback/stats")
+async def get_feedback_stats():
+    """Feedback write counters and the per-user cache"""
+    if feedback_store is None:
+        raise HTTPException(status_code=503, detail="Feedback is disabled (set FEEDBACK_DB)")
+    return feedback_store.stats()
+
+@app.get("/api/table/stats")
+async def get_table_stats():
+    """Size and build time of the precomputed recommendation table"""
+    table = recommendation_table
+    if table is None or table.version != expert_system.version:
+        return {"enabled": False}
+    return {"enabled": True, **table.stats()}
+
+@app.get("/metrics")
+async def get_metrics():
+    """Counters and histograms in the Prometheus text exposition format"""
+    return Response(content=metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/metrics/rules")
+async def get_rule_metrics():
+    """Rules ordered by how often they matched, to guide reordering and pruning"""
+    if expert_system.metrics is None:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return expert_system.metrics.rule_report(rule["id"] for rule in expert_system.rules)
+
+@app.get("/static/images/{name}")
+async def get_image(name: str, request: Request):
+    """A generated image variant; names are content hashed, so responses never change"""
+    manifest = expert_system.images
+    # Only files listed in the manifest are served, which also rules out path traversal
+    if manifest is None or name not in manifest.files:
+        raise HTTPException(status_code=404, detail="Image not found")
+    payload = image_payloads.get(name)
+    if payload is None:
+        try:
+            payload = image_payloads[name] = CachedPayload((IMAGE_DIR / name).read_bytes())
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Image not found")
+    return range_response(request, payload, CONTENT_TYPES[Path(name).suffix], IMAGE_CACHE_CONTROL)
+
+RULE_FIELDS = list(Rule.__fields__)
+RULES_CACHE_CONTROL = os.getenv("RULES_CACHE_CONTROL", "no-cache")
+# Serialized /api/rules payloads (full list and pages), per rule version
+rules_payloads = RecommendationCache(max_size=256)
+
+def rules_payload(offset: int = 0, limit: Optional[int] = None, fields: Optional[tuple] = None) -> CachedPayload:
+    """The /api/rules body for the current rules, serialized once per version"""
+    snapshot = expert_system.snapshot
+    key = (offset, limit, fields)
+    payload = rules_payloads.get(key, snapshot.version)
+    if payload is None:
+        if limit is None and fields is None and offset == 0:
+            payload = CachedPayload.from_data({"rules": [dict(rule) for rule in snapshot.rules]})
+        else:
+            page = snapshot.rules[offset:None if limit is None else offset + limit]
+            if fields is not None:
+                page = [{field: rule[field] for field in fields if field in rule} for rule in page]
+            payload = CachedPayload.from_data(
+                {"rules": page, "total": len(snapshot.rules), "offset": offset, "limit": limit})
+        rules_payloads.put(key, payload, snapshot.version)
+    return payload
+
 @app.get("/api/rules")
-async def get_rules():
-    """Get all available rules for admin purposes"""
-    return KNOWLEDGE_BASE
\ No newline at end of file
+async def get_rules(
+    request: Request,
+    offset: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1),
+    fields: Optional[str] = Query(None, description="Comma separated rule fields, e.g. id,conditions"),
+):
+    """Get all available rules for admin purposes
+
+    Responses carry a strong ETag and honour If-None-Match. ``offset``,
+    ``limit`` and ``fields`` page through large rule bases; paged responses
+    also report the ``total`` number of rules.
+    """
+    selected = None
+    if fields is not None:
+        selected = tuple(field.strip() for field in fields.split(",") if field.strip())
+        unknown = [field for field in selected if field not in RULE_FIELDS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown rule fields: {', '.join(unknown)}")
+    return payload_response(request, rules_payload(offset, limit, selected), RULES_CACHE_CONTROL)
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Guard rule edits with ADMIN_TOKEN; without one configured they are disabled"""
+    token = os.getenv("ADMIN_TOKEN")
+    if not token:
+        raise HTTPException(status_code=403, detail="Rule editing is disabled; set ADMIN_TOKEN to enable it")
+    if x_admin_token != token:
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+@app.get("/api/rules/{rule_id}")
+async def get_rule(rule_id: str):
+    """Get a single rule"""
+    try:
+        return dict(rule_store.get(rule_id))
+    except RuleNotFound:
+        raise HTTPException(status_code=404, detail=f"Rule {rule_id} not found")
+
+# Rule edits are plain (sync) endpoints so FastAPI runs them in its thread
+# pool; rebuilding snapshots and rewriting the file never blocks the event loop
+@app.post("/api/rules", status_code=201, dependencies=[Depends(require_admin)])
+def create_rule(rule: Rule):
+    """Add a rule"""
+    try:
+        return rule_store.add(rule.dict())
+    except RuleConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.put("/api/rules/{rule_id}", dependencies=[Depends(require_admin)])
+def update_rule(rule_id: str, rule: Rule):
+    """Replace a rule, keeping its position"""
+    try:
+        return rule_store.update(rule_id, rule.dict())
+    except RuleNotFound:
+        raise HTTPException(status_code=404, detail=f"Rule {rule_id} not found")
+
+@app.delete("/api/rules/{rule_id}", status_code=204, dependencies=[Depends(require_admin)])
+def delete_rule(rule_id: str):
+    """Delete a rule"""
+    try:
+        rule_store.delete(rule_id)
+    except RuleNotFound:
+        raise HTTPException(status_code=404, detail=f"Rule {rule_id} not found")
+    return Response(status_code=204)
+
+@app.post("/api/rules/reload", dependencies=[Depends(require_admin)])
+def reload_rules():
+    """Re-read the rules file"""
+    try:
+        rules = rule_store.load()
+    except Exception as e:
+        logger.error(f"Error reloading rules: {e}", exc_info=True)
+        raise HTTPException(status_code=422, detail=f"Error reloading rules: {str(e)}")
+    return {"rules": len(rules), "version": expert_system.version}
+
+async def watch_rules_file():
+    """Pick up rule files rewritten by other workers or by hand"""
+    while True:
+        await asyncio.sleep(RULES_RELOAD_INTERVAL)
+        try:
+            await asyncio.to_thread(rule_store.reload_if_changed)
+        except Exception as e:
+            logger.error(f"Error reloading {RULES_FILE}: {e}", exc_info=True)
+
+@app.on_event("startup")
+async def start_rules_watcher():
+    if RULES_RELOAD_INTERVAL > 0:
+        app.state.rules_watcher = asyncio.create_task(watch_rules_file())
+
+@app.on_event("startup")
+async def start_inference_workers():
+    inference.warm()
+
+@app.on_event("shutdown")
+async def stop_workers():
+    bulk_scorer.close()
+    inference.close()
+    if feedback_store is not None:
+        feedback_store.close()
@@ -0,0 +1,256 @@
+"""Minimal in-process metrics rendered in the Prometheus text exposition format.
+
+Updates are plain dict and integer operations with no locking: the hot path
+runs on the event loop, and an occasional lost increment from a thread pool
+endpoint is an acceptable price for keeping instrumentation cheap.
+"""
+import collections
+import time
+from bisect import bisect_left
+from operator import itemgetter
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100, 250, 1000, 10000)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name, self.help, self.label_names = name, help, tuple(labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, labels: Tuple[str, ...] = ()) -> None:
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in self.values.items():
+            yield f"{self.name}{_labels(self.label_names, labels)} {_number(value)}"
+
+
+class KeyedCounter(Counter):
+    """Counter with one label, keyed by the bare label value
+
+    Hot loops can then count a whole batch of values at once with
+    ``values.update(iterable)``, which runs in C.
+    """
+
+    def __init__(self, name: str, help: str, label: str):
+        super().__init__(name, help, [label])
+        self.values = collections.Counter()
+
+    def inc(self, amount: float = 1, labels: Tuple[str, ...] = ()) -> None:
+        self.values[labels[0]] += amount
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for label, value in self.values.items():
+            yield f"{self.name}{_labels(self.label_names, (label,))} {_number(value)}"
+
+
+class Gauge:
+    """Value read from a callback at scrape time
+
+    ``kind="counter"`` exposes a monotonically increasing value that is
+    maintained elsewhere, such as the result cache's own hit counter.
+    """
+
+    def __init__(self, name: str, help: str, read: Callable[[], float], kind: str = "gauge"):
+        self.name, self.help, self.read, self.kind = name, help, read, kind
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        yield f"{self.name} {_number(self.read())}"
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: Sequence[float] = LATENCY_BUCKETS,
+                 labels: Sequence[str] = ()):
+        self.name, self.help, self.label_names = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (last is +Inf), sum, count]
+        self.series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, labels: Tuple[str, ...] = ()) -> None:
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, (counts, total, count) in self.series.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = 'le="' + _number(bound) + '"'
+                yield f"{self.name}_bucket{_labels(self.label_names, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.label_names, labels)} {_number(total)}"
+            yield f"{self.name}_count{_labels(self.label_names, labels)} {count}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+_rule_id = itemgetter("id")
+
+
+class EngineMetrics:
+    """Counters the inference engine updates once per evaluated request
+
+    Requests answered from the lookup table or the cache skip the engine but
+    are still counted, from the matches the engine ``remember``-ed for the same
+    input. Up to ``memo_size`` inputs are remembered for the current rule version.
+    """
+
+    def __init__(self, registry: Registry, memo_size: int = 65536):
+        self.memo_size = memo_size
+        self._memo: Dict[Hashable, Tuple[int, List[str], bool]] = {}
+        self._memo_version: Any = None
+        self.inferences = registry.register(Counter(
+            "stylist_inferences_total", "Requests evaluated by the rule engine"))
+        self.fallbacks = registry.register(Counter(
+            "stylist_fallbacks_total", "Evaluations where no rule matched and the fallback was returned"))
+        self.rules_evaluated = registry.register(Histogram(
+            "stylist_rules_evaluated", "Index groups probed per evaluation (every rule when traced)", COUNT_BUCKETS))
+        self.rules_matched = registry.register(Histogram(
+            "stylist_rules_matched", "Rules matched per evaluation", COUNT_BUCKETS))
+        self.rule_matches = registry.register(KeyedCounter(
+            "stylist_rule_matches_total", "Evaluations in which each rule matched", "rule"))
+
+    def observe(self, evaluated: int, matched_rules: List[Dict]) -> None:
+        self.inferences.values[()] = self.inferences.values.get((), 0) + 1
+        self.rules_evaluated.observe(evaluated)
+        self.rules_matched.observe(len(matched_rules))
+        self.rule_matches.values.update(map(_rule_id, matched_rules))
+
+    def observe_ids(self, evaluated: int, rule_ids: List[str]) -> None:
+        """``observe`` for matches known only by rule id"""
+        self.inferences.values[()] = self.inferences.values.get((), 0) + 1
+        self.rules_evaluated.observe(evaluated)
+        self.rules_matched.observe(len(rule_ids))
+        self.rule_matches.values.update(rule_ids)
+
+    def fallback(self) -> None:
+        self.fallbacks.inc()
+
+    def remember(self, version: Any, key: Hashable, evaluated: int, rule_ids: List[str], fallback: bool) -> None:
+        """Record what the engine matched for an input, to count later requests answered without it"""
+        if version != self._memo_version or len(self._memo) >= self.memo_size:
+            self._memo = {}
+            self._memo_version = version
+        self._memo[key] = (evaluated, rule_ids, fallback)
+
+    def recall(self, version: Any, key: Hashable) -> Optional[Tuple[int, List[str], bool]]:
+        """``remember``-ed matches for an input under the rules at ``version``, or None"""
+        return self._memo.get(key) if version == self._memo_version else None
+
+    def rule_report(self, rule_ids: Iterable[str]) -> Dict[str, object]:
+        """Rules ordered by match count, and those that never matched
+
+        Frequently matched rules are candidates to move first; rules that
+        never match over a representative period are candidates to prune.
+        """
+        counts = {rule_id: self.rule_matches.values.get(rule_id, 0) for rule_id in rule_ids}
+        ranked = sorted(counts.items(), key=lambda item: item[1], reverse=True)
+        return {
+            "evaluations": self.inferences.values.get((), 0),
+            "rules": [{"id": rule_id, "matches": n} for rule_id, n in ranked],
+            "never_matched": [rule_id for rule_id, n in ranked if n == 0],
+        }
+
+
+class ObservationLog:
+    """Stands in for EngineMetrics where counts must be applied elsewhere, such as in a worker process
+
+    The log is picklable; ``replay`` applies it to the real metrics.
+    """
+
+    def __init__(self):
+        self.events: List[Tuple] = []
+        self.remembered: List[Tuple] = []
+
+    def observe(self, evaluated: int, matched_rules: List[Dict]) -> None:
+        self.events.append((evaluated, list(map(_rule_id, matched_rules))))
+
+    def fallback(self) -> None:
+        self.events.append(())
+
+    def remember(self, version: Any, key: Hashable, evaluated: int, rule_ids: List[str], fallback: bool) -> None:
+        # The worker numbers its rule versions on its own; replay supplies the parent's
+        self.remembered.append((key, evaluated, rule_ids, fallback))
+
+    def replay(self, metrics: EngineMetrics, version: Any = None) -> None:
+        """Apply the counts, and the remembered matches as those of the rules at ``version``"""
+        for event in self.events:
+            if event:
+                metrics.observe_ids(*event)
+            else:
+                metrics.fallback()
+        if version is not None:
+            for entry in self.remembered:
+                metrics.remember(version, *entry)
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request by method, route template and status"""
+
+    def __init__(self, app, histogram: Histogram, clock: Callable[[], float] = time.perf_counter):
+        self.app = app
+        self.histogram = histogram
+        self.clock = clock
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = self.clock()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            # Label by template (/api/rules/{rule_id}) so ids don't explode cardinality
+            path = getattr(route, "path", None) or "unmatched"
+            self.histogram.observe(self.clock() - start, (scope["method"], path, str(status[0])))
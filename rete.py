@@ -0,0 +1,98 @@
+"""Multi-step forward chaining over a Rete-style network.
+
+Rules whose ``derives`` add facts to working memory can enable further rules,
+so inference runs to a fixpoint instead of stopping after one matching pass.
+
+Every condition is an equality test on one fact, so the network is an alpha
+layer of (attribute, value) tests, shared by every rule that uses the same
+test, feeding a join counter per rule. Asserting a fact activates only the
+rules that test it; a rule joins the agenda when its counter reaches its
+number of conditions. Nothing is ever re-scanned.
+
+Conflict resolution: the agenda fires the rule with the highest ``salience``
+first (default 0), then the earliest in knowledge base order. Each rule fires
+at most once per run (refraction), and a derived fact never replaces one
+already in working memory, so runs always terminate.
+"""
+import heapq
+from typing import Any, Dict, List, Tuple
+
+
+class ReteNetwork:
+    """Compiled alpha network and join counters for a rule base in knowledge base order"""
+
+    def __init__(self, rules: List[Dict]):
+        self.rules = rules
+        # (attribute, value) -> positions of the rules testing it
+        self.alpha: Dict[Tuple[str, Any], List[int]] = {}
+        self.sizes = [len(rule["conditions"]) for rule in rules]
+        self.priority = [(-rule.get("salience", 0), position) for position, rule in enumerate(rules)]
+        for position, rule in enumerate(rules):
+            for test in rule["conditions"].items():
+                self.alpha.setdefault(test, []).append(position)
+
+    def session(self, facts: Dict[str, Any] = None) -> "ReteSession":
+        session = ReteSession(self)
+        if facts:
+            session.assert_facts(facts)
+        return session
+
+    def run(self, facts: Dict[str, Any]) -> "ReteSession":
+        """Working memory and fired rules after chaining from ``facts`` to a fixpoint"""
+        session = self.session(facts)
+        session.run()
+        return session
+
+
+class ReteSession:
+    """Working memory and agenda for one inference
+
+    Facts can be asserted between ``run`` calls; only rules testing the new
+    facts are re-evaluated.
+    """
+
+    def __init__(self, network: ReteNetwork):
+        self.network = network
+        self.facts: Dict[str, Any] = {}
+        self.fired: List[int] = []
+        self.activations = 0
+        self._counts: Dict[int, int] = {}
+        self._agenda: List[Tuple[int, int]] = []
+
+    def assert_fact(self, attribute: str, value: Any) -> bool:
+        """Add a fact; returns False if the attribute already has a value"""
+        if attribute in self.facts or value is None:
+            return False
+        self.facts[attribute] = value
+        network = self.network
+        successors = network.alpha.get((attribute, value))
+        if successors:
+            counts = self._counts
+            self.activations += len(successors)
+            for position in successors:
+                count = counts.get(position, 0) + 1
+                counts[position] = count
+                if count == network.sizes[position]:
+                    heapq.heappush(self._agenda, network.priority[position])
+        return True
+
+    def assert_facts(self, facts: Dict[str, Any]) -> None:
+        for attribute, value in facts.items():
+            self.assert_fact(attribute, value)
+
+    def run(self) -> List[int]:
+        """Fire agenda rules until it is empty; returns all fired positions in knowledge base order"""
+        rules = self.network.rules
+        agenda = self._agenda
+        while agenda:
+            _, position = heapq.heappop(agenda)
+            self.fired.append(position)
+            derives = rules[position].get("derives")
+            if derives:
+                self.assert_facts(derives)
+        self.fired.sort()
+        return self.fired
+
+    def fired_rules(self) -> List[Dict]:
+        rules = self.network.rules
+        return [rules[position] for position in self.fired]
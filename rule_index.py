@@ -0,0 +1,148 @@
+import copy
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+class RuleIndex:
+    """Compiled matcher that finds the rules whose conditions all hold for an input.
+
+    Rules are grouped by the set of attributes their conditions reference (their
+    signature) and, inside each group, hashed on the tuple of expected values.
+    A lookup therefore costs one dict probe per distinct signature plus the
+    number of matched rules, independent of how many rules are loaded.
+
+    Each rule is identified by an ordinal that fixes its place in knowledge
+    base order. Indexes are never modified once built; ``updated`` returns a
+    new index that shares every untouched bucket with the old one, so readers
+    holding the old index are unaffected.
+    """
+
+    def __init__(self, rules: List[Dict]):
+        self.rules: Dict[int, Dict] = {}
+        self.ordinals: Dict[str, int] = {}
+        # signature -> {value tuple -> [rule ordinals]}
+        self.groups: Dict[Tuple[str, ...], Dict[Tuple, List[int]]] = {}
+        self.next_ordinal = 0
+        for rule in rules:
+            self._insert(self.next_ordinal, rule)
+            self.next_ordinal += 1
+
+    @classmethod
+    def from_parts(cls, rules: List[Dict], ordinals: List[int], groups: Dict[Tuple[str, ...], Dict[Tuple, List[int]]],
+                   next_ordinal: int) -> "RuleIndex":
+        """An index built earlier, e.g. read from a snapshot file: ``rules`` in knowledge
+        base order, their ordinals, and the groups that refer to them"""
+        index = cls.__new__(cls)
+        index.rules = dict(zip(ordinals, rules))
+        index.ordinals = {rule["id"]: ordinal for ordinal, rule in zip(ordinals, rules)}
+        index.groups = groups
+        index.next_ordinal = next_ordinal
+        return index
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    @staticmethod
+    def _key(rule: Dict) -> Tuple[Tuple[str, ...], Tuple]:
+        signature = tuple(sorted(rule["conditions"]))
+        return signature, tuple(rule["conditions"][key] for key in signature)
+
+    def _insert(self, ordinal: int, rule: Dict) -> None:
+        signature, values = self._key(rule)
+        self.groups.setdefault(signature, {}).setdefault(values, []).append(ordinal)
+        self.rules[ordinal] = rule
+        self.ordinals[rule["id"]] = ordinal
+
+    def match(self, user_input: Dict) -> List[int]:
+        """Return ordinals of matching rules, in knowledge base order"""
+        matched: List[int] = []
+        for signature, buckets in self.groups.items():
+            try:
+                values = tuple(user_input[key] for key in signature)
+            except KeyError:
+                continue
+            ordinals = buckets.get(values)
+            if ordinals:
+                matched.extend(ordinals)
+        if len(self.groups) > 1:
+            matched.sort()
+        return matched
+
+    def matching_rules(self, user_input: Dict) -> List[Dict]:
+        """Return the matching rules themselves, in knowledge base order"""
+        return [self.rules[ordinal] for ordinal in self.match(user_input)]
+
+    def ordered_rules(self) -> List[Dict]:
+        """All rules in knowledge base order"""
+        return [self.rules[ordinal] for ordinal in sorted(self.rules)]
+
+    def updated(self, upserts: Iterable[Dict] = (), deletes: Iterable[str] = ()) -> "RuleIndex":
+        """Copy of the index with rules added, replaced (by id) or deleted.
+
+        Replaced rules keep their position; new rules go last. Only the
+        buckets a change touches are copied.
+        """
+        new = copy.copy(self)
+        new.rules = dict(self.rules)
+        new.ordinals = dict(self.ordinals)
+        new.groups = dict(self.groups)
+        copied = set()
+
+        def bucket(signature, values) -> List[int]:
+            if signature not in copied:
+                new.groups[signature] = dict(new.groups.get(signature, {}))
+                copied.add(signature)
+            buckets = new.groups[signature]
+            buckets[values] = list(buckets.get(values, ()))
+            return buckets[values]
+
+        def remove(ordinal: int) -> None:
+            rule = new.rules.pop(ordinal)
+            del new.ordinals[rule["id"]]
+            signature, values = self._key(rule)
+            ordinals = bucket(signature, values)
+            ordinals.remove(ordinal)
+            if not ordinals:
+                del new.groups[signature][values]
+                if not new.groups[signature]:
+                    del new.groups[signature]
+                    copied.discard(signature)
+
+        for rule_id in deletes:
+            remove(new.ordinals[rule_id])
+        for rule in upserts:
+            ordinal = new.ordinals.get(rule["id"])
+            if ordinal is None:
+                ordinal = new.next_ordinal
+                new.next_ordinal += 1
+            else:
+                remove(ordinal)
+            signature, values = self._key(rule)
+            ordinals = bucket(signature, values)
+            ordinals.append(ordinal)
+            ordinals.sort()
+            new.rules[ordinal] = rule
+            new.ordinals[rule["id"]] = ordinal
+        return new
+
+
+class RuleSnapshot:
+    """Immutable view of a rule base that the engine swaps in atomically.
+
+    A request reads ``FashionExpertSystem.snapshot`` once and works against it
+    throughout, so rule changes never show a half-applied state.
+    """
+
+    def __init__(self, index: RuleIndex, version: int):
+        self.index = index
+        self.rules = index.ordered_rules()
+        self.version = version
+        # Rules deriving facts need the Rete network instead of a single index pass
+        self.chained = any("derives" in rule for rule in self.rules)
+        # rules_fingerprint(rules), computed on first use
+        self.fingerprint: Optional[str] = None
+        self.network = None
+        self.partial = None
+        self.vectorized = None
+        # rule id -> pre-encoded JSON (head, tail) around the per-request fields,
+        # filled in by the engine on first use
+        self.fragments: Dict[str, Tuple[bytes, bytes]] = {}
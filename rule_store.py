@@ -0,0 +1,157 @@
+"""Rules kept in an external JSON (or YAML) file and edited at runtime.
+
+Every change is validated, applied to the engine as an incremental snapshot
+swap and then written back to the file, so other workers (and restarts) pick
+it up through ``reload_if_changed``. Edits hold an exclusive lock on a file
+next to the rules file and re-read it first, so concurrent edits from
+different workers are applied one after another rather than overwriting each
+other.
+"""
+import fcntl
+import json
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+
+class RuleConflict(ValueError):
+    pass
+
+
+class RuleNotFound(KeyError):
+    pass
+
+
+def read_rules_file(path: Path) -> Dict[str, Any]:
+    """Parse a rules file shaped like KNOWLEDGE_BASE: ``{"rules": [...]}``"""
+    path = Path(path)
+    text = path.read_text(encoding="utf-8")
+    if path.suffix in (".yaml", ".yml"):
+        import yaml
+        data = yaml.safe_load(text)
+    else:
+        data = json.loads(text)
+    if not isinstance(data, dict) or not isinstance(data.get("rules"), list):
+        raise ValueError(f"{path} does not contain a 'rules' list")
+    return data
+
+
+def write_rules_file(path: Path, data: Dict[str, Any]) -> None:
+    """Write atomically so readers never see a partially written file"""
+    path = Path(path)
+    if path.suffix in (".yaml", ".yml"):
+        import yaml
+        text = yaml.safe_dump(data, sort_keys=False, allow_unicode=True)
+    else:
+        text = json.dumps(data, indent=4, ensure_ascii=False) + "\n"
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(text, encoding="utf-8")
+    tmp.replace(path)
+
+
+class RuleStore:
+    """Owns the rules file and keeps an engine's snapshot in sync with it
+
+    The engine is assumed to already hold the file's current contents; call
+    ``load`` first if it does not.
+    """
+
+    def __init__(self, path: Path, engine: Any, validate: Optional[Callable[[Dict], Dict]] = None):
+        self.path = Path(path)
+        self.engine = engine
+        self.validate = validate or (lambda rule: rule)
+        self.listeners: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+        self._mtime = self._stat()
+
+    def _changed(self) -> None:
+        for listener in self.listeners:
+            listener()
+
+    def _stat(self) -> Optional[int]:
+        try:
+            return self.path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _load(self) -> List[Dict]:
+        mtime = self._stat()
+        rules = [self.validate(rule) for rule in read_rules_file(self.path)["rules"]]
+        self.engine.load_rules(rules)
+        self._mtime = mtime
+        return rules
+
+    def load(self) -> List[Dict]:
+        """(Re)read the file and replace the engine's rules with its contents"""
+        with self._lock:
+            rules = self._load()
+        self._changed()
+        return rules
+
+    def reload_if_changed(self) -> bool:
+        """Reload when another process has rewritten the file"""
+        mtime = self._stat()
+        if mtime is None or mtime == self._mtime:
+            return False
+        self.load()
+        return True
+
+    @contextmanager
+    def _editing(self):
+        """Hold the rules file lock, with the engine caught up to the file's current contents"""
+        reloaded = False
+        try:
+            with self._lock, open(self.path.with_name(f".{self.path.name}.lock"), "a") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    mtime = self._stat()
+                    if mtime is not None and mtime != self._mtime:
+                        self._load()
+                        reloaded = True
+                    yield
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+        except Exception:
+            # A rejected edit still leaves the engine on the file's newer rules
+            if reloaded:
+                self._changed()
+            raise
+
+    def _commit(self, upserts: List[Dict] = (), deletes: List[str] = ()) -> None:
+        self.engine.apply_changes(upserts, deletes)
+        write_rules_file(self.path, {"rules": [dict(rule) for rule in self.engine.rules]})
+        self._mtime = self._stat()
+
+    def get(self, rule_id: str) -> Dict:
+        index = self.engine.index
+        ordinal = index.ordinals.get(rule_id)
+        if ordinal is None:
+            raise RuleNotFound(rule_id)
+        return index.rules[ordinal]
+
+    def add(self, rule: Dict) -> Dict:
+        rule = self.validate(rule)
+        with self._editing():
+            if rule["id"] in self.engine.index.ordinals:
+                raise RuleConflict(f"Rule {rule['id']} already exists")
+            self._commit(upserts=[rule])
+        self._changed()
+        return rule
+
+    def update(self, rule_id: str, rule: Dict) -> Dict:
+        rule = self.validate({**rule, "id": rule_id})
+        with self._editing():
+            if rule_id not in self.engine.index.ordinals:
+                raise RuleNotFound(rule_id)
+            self._commit(upserts=[rule])
+        self._changed()
+        return rule
+
+    def delete(self, rule_id: str) -> None:
+        with self._editing():
+            if rule_id not in self.engine.index.ordinals:
+                raise RuleNotFound(rule_id)
+            self._commit(deletes=[rule_id])
+        self._changed()
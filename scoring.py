@@ -0,0 +1,52 @@
+"""Partial-match scoring: how much of each rule an input satisfies.
+
+In strict mode a rule either matches completely or is ignored. Partial mode
+scores every recommending rule by the weighted share of its conditions that
+hold (each condition weighs 1 unless the rule's ``weights`` says otherwise),
+so near misses can still be recommended, with reduced confidence.
+
+Scores are accumulated from an inverted index of (attribute, value) tests, so
+an input only touches rules that share at least one condition with it.
+"""
+from typing import Any, Dict, List, Tuple
+
+
+class PartialMatcher:
+    """Inverted index from condition tests to the recommending rules that use them"""
+
+    def __init__(self, rules: List[Dict]):
+        self.rules = rules
+        # (attribute, value) -> [(rule position, condition weight)]
+        self.tests: Dict[Tuple[str, Any], List[Tuple[int, float]]] = {}
+        self.totals: Dict[int, float] = {}
+        self.sizes: Dict[int, int] = {}
+        for position, rule in enumerate(rules):
+            if "recommendation" not in rule:
+                continue
+            weights = rule.get("weights") or {}
+            total = 0.0
+            for test in rule["conditions"].items():
+                weight = weights.get(test[0], 1.0)
+                self.tests.setdefault(test, []).append((position, weight))
+                total += weight
+            self.totals[position] = total
+            self.sizes[position] = len(rule["conditions"])
+
+    def score(self, facts: Dict[str, Any], min_score: float) -> List[Tuple[int, float]]:
+        """(rule position, score) for rules scoring at least ``min_score``, in knowledge base order
+
+        A rule whose conditions all hold scores exactly 1.0.
+        """
+        weights: Dict[int, float] = {}
+        counts: Dict[int, int] = {}
+        for test in facts.items():
+            for position, weight in self.tests.get(test, ()):
+                weights[position] = weights.get(position, 0.0) + weight
+                counts[position] = counts.get(position, 0) + 1
+        scored = []
+        for position, weight in weights.items():
+            score = 1.0 if counts[position] == self.sizes[position] else weight / self.totals[position]
+            if score >= min_score:
+                scored.append((position, score))
+        scored.sort()
+        return scored
@@ -0,0 +1,125 @@
+"""Versioned binary snapshot of the compiled rule base, for fast worker startup.
+
+Parsing, validating and compiling a large rules file and indexing the result
+dominates a worker's startup. A snapshot file holds the finished state instead:
+the compiled rules, the rule index, the rules fingerprint and the lookup
+table, so a worker only has to map the file and unmarshal it.
+
+Layout::
+
+    header | payload (marshal) | lookup table entries (uint32, native order)
+
+The header records the format, the marshal version and integer layout, a
+digest of the source the snapshot was built from, and a CRC-32 of everything
+after it. ``load_snapshot`` raises ``SnapshotMismatch`` when any of them
+disagree, and the caller rebuilds from the source and saves a new snapshot.
+
+The file is memory-mapped read-only. Table entries are served straight from
+the mapping, so every worker shares the same physical pages for them. Rules
+and indexes are Python objects, and each process unmarshals its own copy.
+"""
+import hashlib
+import marshal
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from pathlib import Path
+from typing import Optional
+
+from compact_rules import CompiledRule
+from lookup_table import RecommendationTable
+from rule_index import RuleIndex
+
+SNAPSHOT_FORMAT = 1
+MAGIC = b"STYLSNAP"
+# magic, format, marshal version, entry size, byte order, source digest, payload bytes, entry bytes, CRC-32
+HEADER = struct.Struct("<8sHHBc32sQQI")
+
+
+class SnapshotMismatch(ValueError):
+    pass
+
+
+class SavedRules:
+    """The state read from a snapshot file"""
+
+    def __init__(self, index: RuleIndex, fingerprint: Optional[str], table: Optional[RecommendationTable]):
+        self.index = index
+        self.fingerprint = fingerprint
+        self.table = table
+
+
+def source_digest(path: Path, schema: bytes = b"") -> bytes:
+    """Identifies what a snapshot was built from: the rules file, the rule
+    ``schema`` it was validated against and the compiled rule layout"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    digest.update(schema)
+    digest.update(" ".join(CompiledRule.__slots__).encode("ascii"))
+    return digest.digest()
+
+
+def _layout() -> tuple:
+    return SNAPSHOT_FORMAT, marshal.version, array("I").itemsize, sys.byteorder[0].encode("ascii")
+
+
+def save_snapshot(path: Path, index: RuleIndex, digest: bytes, fingerprint: Optional[str] = None,
+                  table: Optional[RecommendationTable] = None) -> None:
+    """Write a snapshot atomically, so a worker never maps a partially written file"""
+    ordinals = sorted(index.rules)
+    rules = tuple(index.rules[ordinal].fields() for ordinal in ordinals)
+    table_fields = None if table is None else (table.attributes, table.values, table.payloads, table.fingerprint)
+    payload = marshal.dumps((rules, ordinals, index.next_ordinal, index.groups, fingerprint, table_fields))
+    # Pad so the entries start on an item boundary
+    payload += b"\0" * (-(HEADER.size + len(payload)) % array("I").itemsize)
+    entries = b"" if table is None else array("I", table.entries).tobytes()
+    checksum = zlib.crc32(entries, zlib.crc32(payload))
+    header = HEADER.pack(MAGIC, *_layout(), digest, len(payload), len(entries), checksum)
+    path = Path(path)
+    # Per process, since workers starting together may all write the snapshot
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(header)
+        f.write(payload)
+        f.write(entries)
+    tmp.replace(path)
+
+
+def load_snapshot(path: Path, digest: bytes) -> SavedRules:
+    """Map and read a snapshot; raises SnapshotMismatch if it is stale, from
+    another build or Python, or damaged"""
+    with open(path, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(data)
+    if len(view) < HEADER.size:
+        raise SnapshotMismatch("Snapshot is truncated")
+    magic, fmt, marshal_version, itemsize, byteorder, source, payload_size, entries_size, checksum = \
+        HEADER.unpack_from(view)
+    if magic != MAGIC:
+        raise SnapshotMismatch("Not a rules snapshot")
+    if (fmt, marshal_version, itemsize, byteorder) != _layout():
+        raise SnapshotMismatch(f"Snapshot layout {(fmt, marshal_version, itemsize, byteorder)} "
+                               f"does not match {_layout()}")
+    if source != digest:
+        raise SnapshotMismatch("Snapshot was built from different rules")
+    end = HEADER.size + payload_size + entries_size
+    if len(view) != end:
+        raise SnapshotMismatch(f"Snapshot is {len(view)} bytes, its header says {end}")
+    payload = view[HEADER.size:HEADER.size + payload_size]
+    entries = view[HEADER.size + payload_size:end]
+    if zlib.crc32(entries, zlib.crc32(payload)) != checksum:
+        raise SnapshotMismatch("Snapshot checksum does not match")
+
+    rules, ordinals, next_ordinal, groups, fingerprint, table_fields = marshal.loads(payload)
+    index = RuleIndex.from_parts([CompiledRule.from_fields(fields) for fields in rules], ordinals, groups,
+                                 next_ordinal)
+    table = None
+    if table_fields is not None:
+        attributes, values, payloads, table_fingerprint = table_fields
+        table = RecommendationTable(attributes, values, entries.cast("I"), payloads, table_fingerprint)
+    return SavedRules(index, fingerprint, table)
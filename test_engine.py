@@ -1,10 +1,37 @@
+import asyncio
+import io
+import json
+import os
+import random
+import threading
 import pytest
 from fastapi.testclient import TestClient
-from main import app, FashionExpertSystem, UserInput
+import main
+from main import app, FashionExpertSystem, UserInput, KNOWLEDGE_BASE
+from rule_index import RuleIndex
+from rete import ReteNetwork
+from tracing import InferenceTrace
+from result_cache import RecommendationCache
+from lookup_table import RecommendationTable, TableTooLarge, rules_fingerprint
+from rule_store import RuleConflict, RuleNotFound, RuleStore, read_rules_file
+from metrics import Counter, EngineMetrics, Histogram, ObservationLog, Registry
+from http_cache import parse_range
+from image_assets import ImageManifest, build as build_images
+from executor import InferenceExecutor, Saturated
+from bulk import BulkScorer, ChunkScorer, LineSplitter, read_lines
+from compact_rules import CompiledRule, RuleCompiler
+from feedback import FeedbackStore
+from snapshot_file import SnapshotMismatch, load_snapshot, save_snapshot, source_digest
 
 client = TestClient(app)
 expert_system = FashionExpertSystem()
 
+def finish_table_rebuilds():
+    """Wait for background table rebuilds started by earlier tests, so they can't replace a patched table"""
+    for thread in threading.enumerate():
+        if thread.name == "recommendation-table":
+            thread.join()
+
 class TestFashionExpertSystem:
     
     def test_formal_male_recommendation(self):
@@ -120,6 +147,982 @@ class TestFashionExpertSystem:
         modern_found = any("R7" in r.matched_rules for r in recommendations)
         assert modern_found
 
+    def test_forward_chain_batch(self):
+        """Batch results match single calls, in input order, with duplicates"""
+        profiles = [
+            UserInput(gender="male", occasion="formal", weather="mild", body_type="athletic", preferred_style="classic"),
+            UserInput(gender="female", occasion="casual", weather="cold", body_type="slim", preferred_style="fitted"),
+            UserInput(gender="male", occasion="formal", weather="mild", body_type="athletic", preferred_style="classic"),
+        ]
+        results = expert_system.forward_chain_batch(profiles)
+        assert results == [expert_system.forward_chain(p) for p in profiles]
+        assert results[0] is results[2]
+
+    def test_recommend_json_matches_models(self):
+        """The fast serialization path produces the same bytes as the Pydantic models"""
+        rng = random.Random(11)
+        values = TestVectorizedEngine.VALUES
+        system = FashionExpertSystem(KNOWLEDGE_BASE["rules"] + [{
+            "id": "U1",
+            "conditions": {"occasion": "party"},
+            "recommendation": {"title": "Fête \"Chic\" ✨", "items": ["Robe\nlongue"], "explanation": "Très élégant"},
+            "confidence": 1,
+            "images": []
+        }])
+        for _ in range(300):
+            user_input = UserInput(**{key: rng.choice(options + ["other"]) for key, options in values.items()})
+            expected = main.encode_response(main.RecommendationResponse(recommendations=system.forward_chain(user_input)))
+            assert system.recommend_json(user_input) == expected
+
+class TestRuleIndex:
+    
+    def test_index_matches_linear_scan(self):
+        """Index returns exactly the rules matches_condition accepts, in order"""
+        profiles = [
+            {"gender": "male", "occasion": "formal", "weather": "rainy", "body_type": "slim", "preferred_style": "fitted"},
+            {"gender": "female", "occasion": "casual", "weather": "hot", "body_type": "pear", "preferred_style": "minimalist",
+             "color_preference": "dark", "height": "short"},
+            {"gender": "female", "occasion": "sports", "weather": "rainy", "body_type": "plus-size", "preferred_style": "modern"},
+            {"gender": "male", "occasion": "nonexistent", "weather": "alien", "body_type": "robot", "preferred_style": "impossible"},
+        ]
+        index = RuleIndex(KNOWLEDGE_BASE["rules"])
+        for profile in profiles:
+            expected = [rule["id"] for rule in KNOWLEDGE_BASE["rules"]
+                        if expert_system.matches_condition(rule["conditions"], profile)]
+            assert [rule["id"] for rule in index.matching_rules(profile)] == expected
+    
+    def test_custom_rule_base(self):
+        """Rules with shared titles are merged and unconditional rules always match"""
+        rules = [
+            {"id": "A", "conditions": {"occasion": "party"}, "confidence": 0.8, "images": [],
+             "recommendation": {"title": "Same", "items": ["a"], "explanation": "a"}},
+            {"id": "B", "conditions": {}, "confidence": 0.6, "images": [],
+             "recommendation": {"title": "Always", "items": ["b"], "explanation": "b"}},
+            {"id": "C", "conditions": {"occasion": "party", "gender": "female"}, "confidence": 0.9, "images": [],
+             "recommendation": {"title": "Same", "items": ["c"], "explanation": "c"}},
+        ]
+        index = RuleIndex(rules)
+        assert index.match({"occasion": "party", "gender": "female"}) == [0, 1, 2]
+        assert index.match({"occasion": "work", "gender": "female"}) == [1]
+        system = FashionExpertSystem([rules[0], rules[2]])
+        recommendations = system.forward_chain(UserInput(
+            gender="female", occasion="party", weather="mild", body_type="slim", preferred_style="classic"
+        ))
+        assert len(recommendations) == 1
+        assert recommendations[0].matched_rules == ["A", "C"]
+        assert recommendations[0].confidence == 1.0
+
+class TestForwardChaining:
+    
+    CHAIN = [
+        {"id": "D1", "conditions": {"weather": "cold"}, "derives": {"layering": "needed"}, "confidence": 0.9},
+        {"id": "D2", "conditions": {"layering": "needed", "occasion": "casual"}, "derives": {"outerwear": "coat"},
+         "confidence": 0.9},
+        {"id": "L1", "conditions": {"outerwear": "coat"}, "confidence": 0.8,
+         "recommendation": {"title": "Coat Layers", "items": ["Wool coat"], "explanation": "Cold and casual."}},
+        {"id": "L2", "conditions": {"weather": "cold"}, "confidence": 0.7,
+         "recommendation": {"title": "Warm Basics", "items": ["Sweater"], "explanation": "Cold weather."}},
+    ]
+    
+    @staticmethod
+    def rescan(rules, facts):
+        """Reference agenda semantics: re-test every unfired rule after each firing"""
+        facts, fired = dict(facts), set()
+        while True:
+            ready = [(-rule.get("salience", 0), i) for i, rule in enumerate(rules) if i not in fired
+                     and all(facts.get(k) == v for k, v in rule["conditions"].items())]
+            if not ready:
+                return sorted(fired), facts
+            _, i = min(ready)
+            fired.add(i)
+            for key, value in rules[i].get("derives", {}).items():
+                facts.setdefault(key, value)
+    
+    def test_derived_facts_enable_rules(self):
+        system = FashionExpertSystem([main.validate_rule(rule) for rule in self.CHAIN])
+        user_input = UserInput(gender="female", occasion="casual", weather="cold", body_type="slim", preferred_style="modern")
+        recommendations = system.forward_chain(user_input)
+        assert [r.matched_rules for r in recommendations] == [["L1"], ["L2"]]
+        
+        trace = InferenceTrace()
+        system.forward_chain(user_input, trace)
+        result = trace.to_dict()
+        assert result["rules_matched"] == ["D1", "D2", "L1", "L2"]
+        assert result["derived_facts"] == {"layering": "needed", "outerwear": "coat"}
+        
+        user_input.occasion = "formal"
+        assert [r.matched_rules for r in system.forward_chain(user_input)] == [["L2"]]
+    
+    def test_lookup_table_with_chained_rules(self):
+        system = FashionExpertSystem([main.validate_rule(rule) for rule in self.CHAIN])
+        table = main.build_recommendation_table(system)
+        for occasion in ["casual", "formal"]:
+            user_input = UserInput(gender="male", occasion=occasion, weather="cold", body_type="slim", preferred_style="modern")
+            assert table.lookup(user_input.dict()) == system.recommend_json(user_input)
+        
+        # A derived fact only fills an attribute the client left out, which the table can't express
+        fills_input = dict(self.CHAIN[0], id="D3", derives={"height": "tall"})
+        with pytest.raises(ValueError):
+            main.build_recommendation_table(FashionExpertSystem([main.validate_rule(fills_input)]))
+    
+    def test_conflict_resolution(self):
+        rules = [
+            {"id": "A", "conditions": {"weather": "cold"}, "derives": {"fabric": "wool"}, "confidence": 0.9},
+            {"id": "B", "conditions": {"weather": "cold"}, "derives": {"fabric": "fleece"}, "confidence": 0.9},
+        ]
+        assert ReteNetwork(rules).run({"weather": "cold"}).facts["fabric"] == "wool"
+        rules[1]["salience"] = 5
+        assert ReteNetwork(rules).run({"weather": "cold"}).facts["fabric"] == "fleece"
+        # Derived facts never replace facts already in working memory
+        assert ReteNetwork(rules).run({"weather": "cold", "fabric": "linen"}).facts["fabric"] == "linen"
+    
+    def test_incremental_assertion(self):
+        session = ReteNetwork(self.CHAIN).session({"occasion": "casual"})
+        assert session.run() == []
+        session.assert_fact("weather", "cold")
+        assert session.run() == [0, 1, 2, 3]
+    
+    def test_randomized_equivalence_with_rescan(self):
+        rng = random.Random(3)
+        facts = {f"f{i}": [f"v{j}" for j in range(3)] for i in range(6)}
+        for _ in range(20):
+            rules = []
+            for n in range(40):
+                keys = rng.sample(list(facts), rng.choice([1, 2]))
+                rule = {"id": f"R{n}", "conditions": {k: rng.choice(facts[k]) for k in keys}, "confidence": 0.5}
+                if rng.random() < 0.6:
+                    key = rng.choice(list(facts))
+                    rule["derives"] = {key: rng.choice(facts[key])}
+                if rng.random() < 0.2:
+                    rule["salience"] = rng.randint(-2, 2)
+                rules.append(rule)
+            network = ReteNetwork(rules)
+            for _ in range(20):
+                start = {k: rng.choice(v) for k, v in facts.items() if rng.random() < 0.4}
+                session = network.run(start)
+                assert (session.fired, session.facts) == self.rescan(rules, start)
+    
+    def test_single_pass_rules_unchanged(self):
+        system = FashionExpertSystem()
+        assert not system.snapshot.chained
+        network = ReteNetwork(system.rules)
+        for profile in [{"occasion": "formal", "gender": "male"}, {"weather": "rainy", "occasion": "sports"}]:
+            assert network.run(profile).fired_rules() == system.index.matching_rules(profile)
+    
+    def test_rule_needs_an_effect(self):
+        with pytest.raises(ValueError):
+            main.validate_rule({"id": "X", "conditions": {"weather": "cold"}, "confidence": 0.5})
+        assert "recommendation" not in main.validate_rule(self.CHAIN[0])
+
+class TestPartialScoring:
+    
+    @staticmethod
+    def rule(rule_id, conditions, confidence, title=None, **extra):
+        return main.validate_rule({
+            "id": rule_id, "conditions": conditions, "confidence": confidence,
+            "recommendation": {"title": title or rule_id, "items": ["Item"], "explanation": "Test."}, **extra})
+    
+    def test_near_miss_scaled_by_score(self):
+        system = FashionExpertSystem([
+            self.rule("A", {"occasion": "formal", "gender": "male"}, 0.8),
+            self.rule("B", {"occasion": "formal", "gender": "male"}, 0.8, weights={"occasion": 4}),
+            self.rule("C", {"occasion": "party", "weather": "hot", "height": "tall"}, 0.9),
+        ])
+        user_input = UserInput(gender="female", occasion="formal", weather="cold", body_type="slim", preferred_style="modern")
+        assert system.forward_chain(user_input)[0].matched_rules == ["FALLBACK"]
+        
+        recommendations = system.forward_chain(user_input, scoring="partial")
+        # B: 4 of 5 weight -> 0.8 * 0.8 + 0.08; A: half -> 0.4 + 0.05; C scores 0 and is left out
+        assert [(r.matched_rules, r.confidence) for r in recommendations] == [(["B"], 0.72), (["A"], 0.45)]
+    
+    def test_full_threshold_matches_strict(self, monkeypatch):
+        monkeypatch.setattr(main, "PARTIAL_MIN_SCORE", 1.0)
+        rng = random.Random(5)
+        attributes = ["gender", "occasion", "weather", "body_type", "preferred_style"]
+        for profile in range(200):
+            user_input = UserInput(**{a: rng.choice(["male", "formal", "cold", "slim", "modern", "other"]) for a in attributes})
+            assert expert_system.forward_chain(user_input, scoring="partial") == expert_system.forward_chain(user_input)
+    
+    def test_top_k_ties_keep_match_order(self):
+        system = FashionExpertSystem([self.rule(f"T{n}", {"weather": "cold"}, 0.5) for n in range(6)])
+        user_input = UserInput(gender="male", occasion="casual", weather="cold", body_type="slim", preferred_style="modern")
+        assert [r.matched_rules for r in system.forward_chain(user_input)] == [["T0"], ["T1"], ["T2"]]
+    
+    def test_weights_validated(self):
+        with pytest.raises(ValueError):
+            self.rule("W", {"occasion": "formal"}, 0.5, weights={"gender": 2})
+        with pytest.raises(ValueError):
+            self.rule("W", {"occasion": "formal"}, 0.5, weights={"occasion": 0})
+
+class TestInferenceTrace:
+    
+    def test_trace_records_rules_and_stages(self):
+        """A trace explains every rule and does not change the result"""
+        user_input = UserInput(
+            gender="male",
+            occasion="formal",
+            weather="rainy",
+            body_type="athletic",
+            preferred_style="classic"
+        )
+        trace = InferenceTrace()
+        traced = expert_system.forward_chain(user_input, trace)
+        assert traced == expert_system.forward_chain(user_input)
+        
+        data = trace.to_dict()
+        assert data["rules_matched"] == ["R1", "R9"]
+        assert data["rules_evaluated"] == len(KNOWLEDGE_BASE["rules"])
+        assert set(data["stages"]) == {"normalize", "match", "explain", "merge", "rank"}
+        r2 = next(rule for rule in data["rules"] if rule["id"] == "R2")
+        assert r2["failed_condition"] == {"attribute": "gender", "expected": "female", "actual": "male"}
+    
+    def test_trace_marks_fallback(self):
+        trace = InferenceTrace()
+        expert_system.forward_chain(UserInput(
+            gender="female", occasion="none", weather="none", body_type="none", preferred_style="none"
+        ), trace)
+        assert trace.fallback
+        assert trace.matched == []
+
+class TestRecommendationCache:
+    
+    def test_lru_eviction(self):
+        cache = RecommendationCache(max_size=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        assert cache.get("a") == 1
+        cache.put("c", 3)
+        assert cache.get("b") is None
+        assert cache.get("a") == 1 and cache.get("c") == 3
+        stats = cache.stats()
+        assert (stats["hits"], stats["misses"], stats["evictions"]) == (3, 1, 1)
+    
+    def test_ttl_expiry(self):
+        now = [0.0]
+        cache = RecommendationCache(ttl=10, clock=lambda: now[0])
+        cache.put("a", 1)
+        now[0] = 9.9
+        assert cache.get("a") == 1
+        now[0] = 10.0
+        assert cache.get("a") is None
+        assert cache.stats()["expirations"] == 1
+    
+    def test_rule_base_change_invalidates(self):
+        system = FashionExpertSystem()
+        cache = RecommendationCache()
+        cache.put("a", 1, system.version)
+        system.load_rules(KNOWLEDGE_BASE["rules"][:3])
+        assert cache.get("a", system.version) is None
+        assert cache.stats()["invalidations"] == 1
+    
+    def test_key_ignores_field_order(self):
+        assert RecommendationCache.make_key({"a": 1, "b": None}) == RecommendationCache.make_key({"b": None, "a": 1})
+
+    def test_incremental_updates_match_rebuild(self):
+        """updated() gives the same index as rebuilding, and leaves the original alone"""
+        rules = KNOWLEDGE_BASE["rules"]
+        index = RuleIndex(rules)
+        changed = dict(rules[2], conditions={"occasion": "casual", "weather": "mild"})
+        added = dict(rules[0], id="R13", conditions={"weather": "rainy"})
+        new = index.updated(upserts=[changed, added], deletes=["R5", "R9"])
+        
+        expected_rules = [changed if r["id"] == "R3" else r for r in rules if r["id"] not in ("R5", "R9")] + [added]
+        assert new.ordered_rules() == expected_rules
+        rebuilt = RuleIndex(expected_rules)
+        for profile in [
+            {"occasion": "casual", "weather": "mild"},
+            {"occasion": "casual", "weather": "rainy"},
+            {"occasion": "party", "preferred_style": "flashy", "weather": "hot"},
+        ]:
+            assert [r["id"] for r in new.matching_rules(profile)] == [r["id"] for r in rebuilt.matching_rules(profile)]
+        assert [r["id"] for r in index.matching_rules({"occasion": "casual", "weather": "rainy"})] == ["R9"]
+        assert index.ordered_rules() == rules
+
+class TestRuleStore:
+    
+    @pytest.fixture
+    def store(self, tmp_path):
+        path = tmp_path / "rules.json"
+        path.write_text(json.dumps(KNOWLEDGE_BASE))
+        system = FashionExpertSystem()
+        return RuleStore(path, system, validate=main.validate_rule)
+    
+    def new_rule(self, rule_id="R100"):
+        return {
+            "id": rule_id,
+            "conditions": {"occasion": "beach"},
+            "recommendation": {"title": "Beach Ready", "items": ["Linen shirt"], "explanation": "Sun and sand."},
+            "confidence": 0.9,
+            "images": []
+        }
+    
+    def test_add_update_delete_persist(self, store):
+        version = store.engine.version
+        store.add(self.new_rule())
+        assert store.engine.version == version + 1
+        beach = UserInput(gender="female", occasion="beach", weather="hot", body_type="slim", preferred_style="modern")
+        assert store.engine.forward_chain(beach)[0].matched_rules == ["R100"]
+        
+        store.update("R100", dict(self.new_rule(), confidence=0.5))
+        store.delete("R1")
+        saved = read_rules_file(store.path)["rules"]
+        assert [r["id"] for r in saved] == [r["id"] for r in store.engine.rules]
+        assert saved[-1]["confidence"] == 0.5
+        assert "R1" not in [r["id"] for r in saved]
+    
+    def test_errors(self, store):
+        with pytest.raises(RuleConflict):
+            store.add(self.new_rule("R1"))
+        with pytest.raises(RuleNotFound):
+            store.update("R404", self.new_rule())
+        with pytest.raises(RuleNotFound):
+            store.delete("R404")
+        with pytest.raises(ValueError):
+            store.add(dict(self.new_rule(), conditions={}))
+    
+    def test_reload_if_changed(self, store):
+        assert not store.reload_if_changed()
+        store.path.write_text(json.dumps({"rules": KNOWLEDGE_BASE["rules"][:2]}))
+        os.utime(store.path, ns=(0, 1))
+        assert store.reload_if_changed()
+        assert [r["id"] for r in store.engine.rules] == ["R1", "R2"]
+    
+    def test_concurrent_stores_keep_both_edits(self, store):
+        """An edit from a store that hasn't reloaded yet builds on the other store's edit"""
+        other = RuleStore(store.path, FashionExpertSystem(), validate=main.validate_rule)
+        store.add(self.new_rule("NEW_A"))
+        other.delete("R12")
+        saved = [r["id"] for r in read_rules_file(store.path)["rules"]]
+        assert "NEW_A" in saved and "R12" not in saved
+        assert [r["id"] for r in other.engine.rules] == saved
+        with pytest.raises(RuleConflict):
+            other.add(self.new_rule("NEW_A"))
+
+    def test_inflight_snapshot_unaffected(self, store):
+        snapshot = store.engine.snapshot
+        store.delete("R1")
+        assert snapshot.rules == KNOWLEDGE_BASE["rules"]
+        assert "R1" in snapshot.index.ordinals
+
+class TestVectorizedEngine:
+    
+    VALUES = {
+        "gender": ["male", "female"],
+        "occasion": ["formal", "casual", "party"],
+        "weather": ["hot", "cold", "rainy"],
+        "body_type": ["slim", "pear"],
+        "preferred_style": ["modern", "classic", "fitted"],
+        "color_preference": ["dark", None],
+        "height": ["short", None],
+    }
+    
+    def random_rules(self, rng, count):
+        rules = []
+        for n in range(count):
+            keys = rng.sample(sorted(self.VALUES), rng.randint(1, 3))
+            rules.append({
+                "id": f"T{n}",
+                "conditions": {key: rng.choice([v for v in self.VALUES[key] if v]) for key in keys},
+                "recommendation": {"title": f"Title {rng.randrange(count // 3)}", "items": [str(n)], "explanation": str(n)},
+                "confidence": rng.choice([0.8, 0.85, 0.9, 0.95, rng.uniform(0.5, 1.0)]),
+                "images": [],
+            })
+        return rules
+    
+    def test_randomized_equivalence(self):
+        """Vectorized results are identical to forward_chain on random rule bases"""
+        pytest.importorskip("numpy")
+        rng = random.Random(7)
+        for _ in range(5):
+            system = FashionExpertSystem(self.random_rules(rng, 60))
+            profiles = [
+                UserInput(**{key: rng.choice(values + ["other"]) for key, values in self.VALUES.items()})
+                for _ in range(300)
+            ]
+            assert system.forward_chain_vectorized(profiles) == [system.forward_chain(p) for p in profiles]
+    
+    def test_rule_change_mid_call_uses_one_snapshot(self, monkeypatch):
+        """The index and the matrix come from the rules the call started with"""
+        pytest.importorskip("numpy")
+        system = FashionExpertSystem()
+        profiles = [UserInput(gender="male", occasion="formal", weather="rainy", body_type="slim", preferred_style="fitted"),
+                    UserInput(gender="female", occasion="casual", weather="hot", body_type="pear", preferred_style="modern")]
+        expected = [system.forward_chain(p) for p in profiles]
+        build = system.vectorized_engine
+
+        def edited_meanwhile(*args):
+            system.apply_changes(deletes=["R1", "R3"])
+            return build(*args)
+
+        monkeypatch.setattr(system, "vectorized_engine", edited_meanwhile)
+        assert system.forward_chain_vectorized(profiles) == expected
+
+    def test_knowledge_base_equivalence(self):
+        pytest.importorskip("numpy")
+        profiles = [
+            UserInput(gender="male", occasion="formal", weather="rainy", body_type="slim", preferred_style="fitted"),
+            UserInput(gender="female", occasion="casual", weather="hot", body_type="pear", preferred_style="minimalist",
+                      color_preference="dark", height="short"),
+            UserInput(gender="female", occasion="none", weather="none", body_type="none", preferred_style="none"),
+        ]
+        assert expert_system.forward_chain_vectorized(profiles) == [expert_system.forward_chain(p) for p in profiles]
+
+    def test_equivalence_with_image_manifest(self, tmp_path):
+        """Recommendations carry the same srcset as forward_chain's once variants are built"""
+        pytest.importorskip("numpy")
+        Image = pytest.importorskip("PIL.Image")
+        (tmp_path / "src").mkdir()
+        for rule in KNOWLEDGE_BASE["rules"][:6]:
+            stem = rule["images"][0].rsplit("/", 1)[-1].rsplit("_", 1)[0]
+            Image.new("RGB", (400, 200), (10, 120, 40)).save(tmp_path / "src" / f"{stem}.jpg")
+        system = FashionExpertSystem()
+        system.images = ImageManifest(build_images(tmp_path / "src", tmp_path / "out", widths=[320]))
+        rng = random.Random(5)
+        values = {**self.VALUES, "occasion": ["formal", "casual", "party", "wedding"],
+                  "weather": ["hot", "cold", "rainy", "mild"]}
+        profiles = [UserInput(**{key: rng.choice(options) for key, options in values.items()}) for _ in range(300)]
+        expected = [system.forward_chain(p) for p in profiles]
+        assert any(r.srcset for recommendations in expected for r in recommendations)
+        assert system.forward_chain_vectorized(profiles) == expected
+
+class TestRecommendationTable:
+    
+    def test_table_matches_engine(self):
+        """Every lookup equals the freshly computed response, including unseen values"""
+        table = main.build_recommendation_table(expert_system)
+        rng = random.Random(3)
+        values = {
+            "gender": ["male", "female", "other"],
+            "age_range": [None, "25-34"],
+            "occasion": ["formal", "casual", "party", "sports", "wedding", "work"],
+            "weather": ["hot", "cold", "rainy", "mild"],
+            "body_type": ["plus-size", "slim", "pear", "athletic"],
+            "preferred_style": ["flashy", "modern", "fitted", "traditional", "minimalist", "classic"],
+            "color_preference": [None, "dark", "bright"],
+            "height": [None, "short", "tall"],
+        }
+        for _ in range(500):
+            user_input = UserInput(**{key: rng.choice(options) for key, options in values.items()})
+            expected = main.encode_response(main.RecommendationResponse(
+                recommendations=expert_system.forward_chain(user_input)))
+            assert table.lookup(user_input.dict()) == expected
+    
+    def test_save_and_load(self, tmp_path):
+        table = main.build_recommendation_table(expert_system)
+        path = tmp_path / "table.json"
+        table.save(path)
+        loaded = RecommendationTable.load(path, table.fingerprint)
+        fields = {"gender": "female", "occasion": "formal", "weather": "rainy",
+                  "body_type": "slim", "preferred_style": "fitted"}
+        assert loaded.lookup(fields) == table.lookup(fields)
+        with pytest.raises(ValueError):
+            RecommendationTable.load(path, "different rules")
+
+    def test_unwritable_path_keeps_table(self, tmp_path):
+        """A table file that can't be written is logged, not fatal to startup"""
+        path = tmp_path / "missing" / "table.json"
+        table = main.load_recommendation_table(expert_system, str(path))
+        assert table is not None and not path.exists()
+
+    def test_table_too_large(self):
+        with pytest.raises(TableTooLarge):
+            RecommendationTable.build(KNOWLEDGE_BASE["rules"], list(UserInput.__fields__), [],
+                                      lambda fields: b"", max_entries=10)
+
+class TestMetrics:
+    
+    def test_text_format(self):
+        registry = Registry()
+        counter = registry.register(Counter("requests_total", "Requests", ["route"]))
+        histogram = registry.register(Histogram("latency_seconds", "Latency", buckets=[0.1, 1]))
+        counter.inc(labels=('/a"b',))
+        histogram.observe(0.5)
+        histogram.observe(2)
+        text = registry.render()
+        assert '# TYPE requests_total counter' in text
+        assert 'requests_total{route="/a\\"b"} 1' in text
+        assert 'latency_seconds_bucket{le="0.1"} 0' in text
+        assert 'latency_seconds_bucket{le="1"} 1' in text
+        assert 'latency_seconds_bucket{le="+Inf"} 2' in text
+        assert 'latency_seconds_count 2' in text
+    
+    def test_engine_counts_matches_and_fallbacks(self):
+        system = FashionExpertSystem()
+        system.metrics = EngineMetrics(Registry())
+        system.forward_chain(UserInput(gender="male", occasion="formal", weather="cold", body_type="slim",
+                                       preferred_style="classic"))
+        system.recommend_json(UserInput(gender="female", occasion="other", weather="other", body_type="other", preferred_style="other"))
+        system.recommend_json(UserInput(gender="female", occasion="other", weather="other", body_type="other", preferred_style="other"),
+                              record=False)
+        report = system.metrics.rule_report(rule["id"] for rule in system.rules)
+        assert report["evaluations"] == 2
+        assert system.metrics.fallbacks.values[()] == 1
+        assert report["rules"][0] == {"id": "R1", "matches": 1}
+        assert "R1" not in report["never_matched"] and "R12" in report["never_matched"]
+
+    def test_cache_hits_counted_without_evaluating_again(self, monkeypatch):
+        """The engine remembers its matches, so a later hit for the same input is counted from them"""
+        system = FashionExpertSystem()
+        system.metrics = EngineMetrics(Registry())
+        user_input = UserInput(gender="male", occasion="formal", weather="cold", body_type="slim",
+                               preferred_style="classic")
+        system.recommend_json(user_input)
+        key = main.response_key(user_input.dict(), "strict")
+        monkeypatch.setattr(system, "evaluate", lambda *args: pytest.fail("evaluated again"))
+        system.count_matches(key, user_input.dict())
+        report = system.metrics.rule_report(["R1"])
+        assert report["evaluations"] == 2 and report["rules"] == [{"id": "R1", "matches": 2}]
+        # A rule change forgets the matches
+        system.apply_changes(deletes=["R12"])
+        assert system.metrics.recall(system.version, key) is None
+
+    def test_worker_matches_remembered_under_parent_version(self):
+        log, metrics = ObservationLog(), EngineMetrics(Registry())
+        log.remember(1, ("key",), 4, ["R1"], False)
+        log.replay(metrics, 7)
+        assert metrics.recall(7, ("key",)) == (4, ["R1"], False)
+        assert metrics.recall(1, ("key",)) is None
+
+class TestBulkScoring:
+    
+    PROFILE = {"gender": "female", "occasion": "formal", "weather": "warm", "body_type": "pear", "preferred_style": "classic"}
+    
+    def scorer(self, **kwargs):
+        return BulkScorer(ChunkScorer(UserInput, main.response_body), lambda: main.expert_system.rules, **kwargs)
+    
+    def test_line_splitter_bounds_long_lines(self):
+        splitter = LineSplitter(max_line=8)
+        assert splitter.feed(b"short\nabc") == [b"short"]
+        assert splitter.feed(b"defghijkl") == []
+        assert splitter.feed(b"mno\nok\n") == [None, b"ok"]
+        assert splitter.feed(b"last") == []
+        assert splitter.close() == [b"last"]
+    
+    def test_results_in_input_order_with_errors(self):
+        lines = [json.dumps(dict(self.PROFILE, occasion=occasion)) for occasion in ["formal", "casual", "party"]]
+        data = "\n".join([lines[0], "", "{not json", '{"gender": "male"}', "[1]", lines[1], lines[2]]).encode()
+        blocks = list(self.scorer(chunk_size=2).score_lines(read_lines(io.BytesIO(data), read_size=5)))
+        results = [json.loads(line) for line in b"".join(blocks).splitlines()]
+        assert len(results) == 6
+        for result, line in zip([results[0], results[4], results[5]], lines):
+            assert result == client.post("/api/recommend", content=line).json()
+        assert results[1]["line"] == 3 and results[1]["error"].startswith("Invalid JSON")
+        assert results[2]["line"] == 4 and "field required" in results[2]["error"]
+        assert results[3] == {"line": 5, "error": "Expected a JSON object"}
+    
+    def test_process_pool_matches_in_process(self):
+        data = "\n".join(json.dumps(dict(self.PROFILE, weather=weather)) for weather in ["warm", "cold", "hot"] * 5).encode()
+        scorer = self.scorer(workers=1, chunk_size=4)
+        try:
+            pooled = b"".join(scorer.score_lines(read_lines(io.BytesIO(data))))
+        finally:
+            scorer.close()
+        assert pooled == b"".join(self.scorer().score_lines(read_lines(io.BytesIO(data))))
+        assert pooled.count(b"\n") == 15
+
+    def test_stream_survives_rule_change(self):
+        """A rule change mid-stream replaces the pool without failing the stream"""
+        data = "\n".join(json.dumps(dict(self.PROFILE, weather=weather)) for weather in ["warm", "cold"] * 4).encode()
+        scorer = self.scorer(workers=1, chunk_size=2, window=1)
+        try:
+            blocks = scorer.score_lines(read_lines(io.BytesIO(data)))
+            first = next(blocks)
+            scorer.reset()
+            pooled = first + b"".join(blocks)
+
+            async def stream():
+                async def body():
+                    yield data[:len(data) // 2]
+                    scorer.reset()
+                    yield data[len(data) // 2:]
+                return b"".join([block async for block in scorer.score_stream(body())])
+            streamed = asyncio.run(stream())
+        finally:
+            scorer.close()
+        expected = b"".join(self.scorer().score_lines(read_lines(io.BytesIO(data))))
+        assert pooled == streamed == expected
+
+class TestInferenceExecutor:
+    
+    PROFILE = UserInput(gender="male", occasion="formal", weather="cold", body_type="slim", preferred_style="classic")
+    
+    def test_auto_mode_follows_observed_cost(self):
+        executor = InferenceExecutor(FashionExpertSystem(), workers=2, factory=main.worker_engine,
+                                     inline_budget=0.001, process_threshold=0.01)
+        assert executor.choose("recommend") == "thread"
+        executor.estimates["recommend"] = 0.0001
+        assert executor.choose("recommend") == "inline"
+        assert executor.choose("recommend", units=50) == "thread"
+        assert executor.choose("recommend", units=500) == "process"
+        executor.workers = 0
+        assert executor.choose("recommend", units=500) == "thread"
+    
+    def test_inline_and_thread_results_match(self):
+        system = FashionExpertSystem()
+        expected = system.recommend_json(self.PROFILE, record=False)
+        for mode in ("inline", "thread", "auto"):
+            executor = InferenceExecutor(system, mode=mode)
+            try:
+                for _ in range(2):
+                    assert asyncio.run(executor.run("recommend", "recommend_json", (self.PROFILE,))) == expected
+            finally:
+                executor.close()
+            assert "recommend" in executor.estimates
+    
+    def test_process_mode_replays_metrics(self):
+        system = FashionExpertSystem()
+        system.metrics = EngineMetrics(Registry())
+        executor = InferenceExecutor(system, mode="process", workers=1, factory=FashionExpertSystem)
+        try:
+            body = asyncio.run(executor.run("recommend", "recommend_json", (self.PROFILE,)))
+        finally:
+            executor.close()
+        assert body == system.recommend_json(self.PROFILE, record=False)
+        assert system.metrics.rule_report(["R1"])["rules"] == [{"id": "R1", "matches": 1}]
+    
+    def test_saturated_when_queue_is_full(self):
+        executor = InferenceExecutor(FashionExpertSystem(), mode="thread", max_pending=0)
+        with pytest.raises(Saturated):
+            asyncio.run(executor.run("recommend", "recommend_json", (self.PROFILE,)))
+        assert executor.rejected == 1
+
+    def test_cancelled_request_work_still_counts_as_pending(self):
+        """A request that goes away doesn't free its slot while its work is still running"""
+        started, release = threading.Event(), threading.Event()
+
+        class Slow:
+            def wait(self):
+                started.set()
+                release.wait(5)
+                return "done"
+
+        executor = InferenceExecutor(Slow(), mode="thread", max_pending=1)
+
+        async def scenario():
+            request = asyncio.ensure_future(executor.run("slow", "wait"))
+            await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+            request.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await request
+            assert executor.pending == 1
+            with pytest.raises(Saturated):
+                await executor.run("slow", "wait")
+            release.set()
+            for _ in range(500):
+                if not executor.pending:
+                    break
+                await asyncio.sleep(0.01)
+            assert await executor.run("slow", "wait") == "done"
+            assert executor.pending == 0
+
+        try:
+            asyncio.run(scenario())
+        finally:
+            release.set()
+            executor.close()
+    
+    def test_unknown_mode(self):
+        with pytest.raises(ValueError):
+            InferenceExecutor(FashionExpertSystem(), mode="gpu")
+
+class TestImageAssets:
+    
+    @pytest.fixture
+    def built(self, tmp_path):
+        Image = pytest.importorskip("PIL.Image")
+        source = tmp_path / "originals"
+        source.mkdir()
+        Image.new("RGB", (800, 400), (200, 30, 30)).save(source / "coat-look.jpg")
+        Image.new("RGBA", (200, 100), (0, 0, 255, 128)).save(source / "tiny.png")
+        (source / "notes.txt").write_text("not an image")
+        return tmp_path / "out", build_images(source, tmp_path / "out", widths=[320, 640, 1024])
+    
+    def test_variants_and_manifest(self, built):
+        output, manifest = built
+        coat = manifest["images"]["coat-look"]
+        # Never upscaled: 1024 is capped at the original width
+        assert sorted({v["width"] for v in coat["variants"]}) == [320, 640, 800]
+        assert {v["format"] for v in coat["variants"]} == {"webp", "jpeg"}
+        assert [v["width"] for v in manifest["images"]["tiny"]["variants"]] == [200, 200]
+        assert set(manifest["images"]) == {"coat-look", "tiny"}
+        for variant in coat["variants"]:
+            assert (output / variant["file"]).stat().st_size == variant["bytes"]
+        
+        loaded = ImageManifest.load(output / "manifest.json")
+        srcset = loaded.srcset("https://res.cloudinary.com/demo/image/upload/v1/coat-look_x8k2pq.jpg")
+        assert srcset["webp"].count("w, ") == 2 and srcset["webp"].endswith(" 800w")
+        assert loaded.srcset("https://images.unsplash.com/photo-123?w=800") == {}
+    
+    def test_rebuild_is_stable(self, built, tmp_path):
+        output, manifest = built
+        assert build_images(tmp_path / "originals", output, widths=[320, 640, 1024]) == manifest
+    
+    def test_recommendations_include_srcset(self, built):
+        output, _ = built
+        system = FashionExpertSystem([dict(KNOWLEDGE_BASE["rules"][0], images=["https://cdn.example.com/coat-look_ab12.jpg"])])
+        system.images = ImageManifest.load(output / "manifest.json")
+        user_input = UserInput(gender="male", occasion="formal", weather="cold", body_type="slim", preferred_style="classic")
+        recommendation = system.forward_chain(user_input)[0]
+        assert set(recommendation.srcset[0]) == {"webp", "jpeg"}
+        expected = main.encode_response(main.RecommendationResponse(recommendations=[recommendation]))
+        assert system.recommend_json(user_input) == expected
+
+    def test_srcset_is_memoized_per_requested_url(self, built):
+        output, _ = built
+        loaded = ImageManifest.load(output / "manifest.json")
+        url = "https://cdn.example.com/coat-look_ab12.jpg"
+        first = loaded.srcset(url)
+        assert list(loaded._srcsets) == [url]
+        assert loaded.srcset(url) is first
+
+    def test_srcset_urls_are_absolute(self, built, tmp_path):
+        """Relative manifest URLs are resolved against the API's public URL; absolute ones are kept"""
+        output, _ = built
+        url = "https://cdn.example.com/coat-look_ab12.jpg"
+        loaded = ImageManifest.load(output / "manifest.json", "https://api.example.com/")
+        assert all(candidate.startswith("https://api.example.com/static/images/coat-look-")
+                   for candidate in loaded.srcset(url)["webp"].split(", "))
+        manifest = build_images(tmp_path / "originals", tmp_path / "cdn", widths=[320],
+                                url_prefix="https://img.example.com/static/images/")
+        assert ImageManifest(manifest, "https://api.example.com").srcset(url)["jpeg"].startswith(
+            "https://img.example.com/static/images/coat-look-320w.")
+
+    def test_parse_range(self):
+        assert parse_range("bytes=0-9", 100) == (0, 9)
+        assert parse_range("bytes=90-", 100) == (90, 99)
+        assert parse_range("bytes=-10", 100) == (90, 99)
+        assert parse_range("bytes=50-500", 100) == (50, 99)
+        assert parse_range("bytes=0-1,5-6", 100) is None
+        assert parse_range("items=0-1", 100) is None
+        with pytest.raises(ValueError):
+            parse_range("bytes=100-", 100)
+
+class TestCompactRules:
+    
+    def test_compiled_rule_reads_like_the_validated_dict(self):
+        rules = [main.validate_rule(rule) for rule in KNOWLEDGE_BASE["rules"]]
+        compiled = [RuleCompiler().compile(rule) for rule in rules]
+        assert [dict(rule) for rule in compiled] == rules
+        assert json.dumps([dict(rule) for rule in compiled]) == json.dumps(rules)
+        assert compiled[0]["id"] == rules[0]["id"] and "derives" not in compiled[0]
+        assert compiled[0].get("weights") is None
+    
+    def test_equal_values_are_shared(self):
+        compiler = RuleCompiler()
+        first, second = (compiler.compile({
+            "id": rule_id, "conditions": {"weather": "cold"}, "confidence": 0.8, "images": ["a.jpg"],
+            "recommendation": {"title": "Layers", "items": ["Coat", "Scarf"], "explanation": "Warm"},
+        }) for rule_id in ("A", "B"))
+        assert first.conditions is second.conditions
+        assert first.outfit is second.outfit and first.images is second.images
+        assert first.title is second.title
+    
+    def test_item_access_cannot_modify_shared_parts(self):
+        rule = RuleCompiler().compile(main.validate_rule(KNOWLEDGE_BASE["rules"][0]))
+        rule["conditions"]["weather"] = "changed"
+        rule["recommendation"]["items"].append("changed")
+        rule["images"].clear()
+        assert dict(rule) == main.validate_rule(KNOWLEDGE_BASE["rules"][0])
+    
+    def test_engine_compiles_loaded_and_upserted_rules(self):
+        system = FashionExpertSystem()
+        assert all(isinstance(rule, CompiledRule) for rule in system.rules)
+        system.apply_changes(upserts=[main.validate_rule({**KNOWLEDGE_BASE["rules"][0], "id": "NEW"})])
+        added = system.rules[-1]
+        assert isinstance(added, CompiledRule) and added.conditions is system.rules[0].conditions
+    
+    def test_compiled_rules_pickle(self):
+        import pickle
+        rule = FashionExpertSystem().rules[0]
+        assert dict(pickle.loads(pickle.dumps(rule))) == dict(rule)
+
+
+class TestRulesSnapshot:
+    
+    PROFILE = UserInput(gender="male", occasion="formal", weather="cold", body_type="slim", preferred_style="classic")
+    
+    def saved(self, tmp_path, system):
+        (tmp_path / "rules.json").write_text(json.dumps({"rules": [dict(rule) for rule in system.rules]}))
+        digest = source_digest(tmp_path / "rules.json")
+        table = main.build_recommendation_table(system)
+        save_snapshot(tmp_path / "rules.snap", system.index, digest, system.fingerprint, table)
+        return digest, table
+    
+    def test_round_trip_restores_rules_index_and_table(self, tmp_path):
+        system = FashionExpertSystem()
+        digest, table = self.saved(tmp_path, system)
+        saved = load_snapshot(tmp_path / "rules.snap", digest)
+        restored = FashionExpertSystem([])
+        restored.restore(saved)
+        assert [dict(rule) for rule in restored.rules] == [dict(rule) for rule in system.rules]
+        assert restored.index.groups == system.index.groups
+        assert restored.fingerprint == rules_fingerprint(system.rules)
+        assert restored.recommend_json(self.PROFILE, record=False) == system.recommend_json(self.PROFILE, record=False)
+        fields = self.PROFILE.dict()
+        assert saved.table.lookup(fields) == table.lookup(fields)
+        assert saved.table.stats()["classes"] == table.stats()["classes"]
+        # Restored engines still take incremental edits
+        restored.apply_changes(deletes=["R1"])
+        assert "R1" not in restored.index.ordinals
+    
+    def test_workers_saving_together(self, tmp_path):
+        """Workers starting at once each write their own temporary file, so the result is always whole"""
+        system = FashionExpertSystem()
+        digest, table = self.saved(tmp_path, system)
+        children = []
+        for _ in range(4):
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    for _ in range(5):
+                        save_snapshot(tmp_path / "rules.snap", system.index, digest, system.fingerprint, table)
+                        table.save(tmp_path / "table.json")
+                finally:
+                    os._exit(0)
+            children.append(pid)
+        for pid in children:
+            os.waitpid(pid, 0)
+        assert load_snapshot(tmp_path / "rules.snap", digest).table.lookup(self.PROFILE.dict()) == \
+            table.lookup(self.PROFILE.dict())
+        assert RecommendationTable.load(tmp_path / "table.json", table.fingerprint).payloads == table.payloads
+        assert sorted(path.name for path in tmp_path.iterdir()) == ["rules.json", "rules.snap", "table.json"]
+
+    def test_stale_or_damaged_snapshot_is_rejected(self, tmp_path):
+        digest, _ = self.saved(tmp_path, FashionExpertSystem())
+        path = tmp_path / "rules.snap"
+        with pytest.raises(SnapshotMismatch, match="different rules"):
+            load_snapshot(path, bytes(32))
+        data = bytearray(path.read_bytes())
+        data[-1] ^= 0xFF
+        path.write_bytes(bytes(data))
+        with pytest.raises(SnapshotMismatch, match="checksum"):
+            load_snapshot(path, digest)
+        path.write_bytes(bytes(data[:-10]))
+        with pytest.raises(SnapshotMismatch, match="header says"):
+            load_snapshot(path, digest)
+    
+    def test_digest_follows_rules_file(self, tmp_path):
+        digest, _ = self.saved(tmp_path, FashionExpertSystem())
+        (tmp_path / "rules.json").write_text(json.dumps({"rules": KNOWLEDGE_BASE["rules"][:1]}))
+        assert source_digest(tmp_path / "rules.json") != digest
+        assert source_digest(tmp_path / "rules.json", b"schema v2") != source_digest(tmp_path / "rules.json")
+
+
+class TestFeedback:
+    
+    PROFILE = {"gender": "female", "occasion": "sports", "weather": "rainy", "body_type": "pear",
+               "preferred_style": "minimalist", "color_preference": "dark", "height": "short"}
+    
+    def candidates(self):
+        return FashionExpertSystem().rank_candidates(UserInput(**self.PROFILE))
+    
+    def test_feedback_is_visible_before_and_after_commit(self, tmp_path):
+        store = FeedbackStore(tmp_path / "feedback.db", flush_interval=60)
+        store.user_scores("u1")
+        store.record("u1", ["R1", "R2"], "like")
+        store.record("u1", ["R2"], "dismiss")
+        assert store.user_scores("u1") == {"R1": 1, "R2": 0}
+        assert store.flush() == 2
+        store.record("u1", ["R1"], "like")
+        assert store.user_scores("u1") == {"R1": 2, "R2": 0}
+        store.close()
+        reopened = FeedbackStore(tmp_path / "feedback.db")
+        assert reopened.user_scores("u1") == {"R1": 2, "R2": 0}
+        assert reopened.totals == {"R1": [2, 0], "R2": [1, 1]}
+        assert reopened.user_scores("someone else") == {}
+    
+    def test_writes_are_batched(self, tmp_path):
+        store = FeedbackStore(tmp_path / "feedback.db", batch_size=10, flush_interval=60)
+        for n in range(25):
+            store.record(f"user{n}", ["R1"], "like")
+        store.close()
+        assert store.stats()["flushed"] == 25
+        assert store.stats()["batches"] <= 4
+    
+    def test_rerank_blends_feedback_with_confidence(self, tmp_path):
+        store = FeedbackStore(tmp_path / "feedback.db", flush_interval=60)
+        candidates = self.candidates()
+        assert [c[0] for c in store.rerank(candidates, store.user_scores("new user"), 3)] == [c[0] for c in candidates[:3]]
+        store.record("u1", ["R12"], "like")
+        store.record("u1", ["R6"], "dismiss")
+        assert [c[0] for c in store.rerank(candidates, store.user_scores("u1"), 3)] == ["R12", "R9", "R11"]
+        # Confidences are reported unchanged
+        assert dict((c[0], c[1]) for c in candidates)["R12"] == store.rerank(candidates, store.user_scores("u1"), 3)[0][1]
+        store.close()
+    
+    def test_loads_never_wait_for_a_commit(self, tmp_path):
+        store = FeedbackStore(tmp_path / "feedback.db", flush_interval=60)
+        store.record("u1", ["R1"], "like")
+        store.flush()
+        with store._flush_lock:  # as if a batch were being committed
+            store.record("u1", ["R1"], "like")
+            loader = threading.Thread(target=store.user_scores, args=("u1",))
+            loader.start()
+            loader.join(timeout=5)
+            assert not loader.is_alive()
+        assert store.cached_scores("u1") == {"R1": 2}
+        store.close()
+
+    def test_batch_committed_after_a_load_read_counts_once(self, tmp_path):
+        """A batch committed between a load's read and its merge is added from memory, exactly once"""
+        store = FeedbackStore(tmp_path / "feedback.db", flush_interval=60)
+        store.record("u1", ["R1"], "like")
+        store.flush()
+        store.record("u1", ["R1"], "like")
+        db = store._reader()
+
+        class CommitAfterRead:
+            def execute(self, sql, *args):
+                result = db.execute(sql, *args)
+                if sql == "COMMIT":
+                    store.flush()
+                return result
+
+        store._local.db = CommitAfterRead()
+        assert store.user_scores("u1") == {"R1": 2}
+        store._local.db = db
+        store.users.discard("u1")
+        assert store.user_scores("u1") == {"R1": 2}
+        store.close()
+
+    def test_user_cache_is_bounded(self, tmp_path):
+        store = FeedbackStore(tmp_path / "feedback.db", cache_users=2)
+        for user in ("a", "b", "c"):
+            store.user_scores(user)
+        assert store.stats()["users"]["size"] == 2
+        assert store.stats()["users"]["evictions"] == 1
+        store.close()
+    
+    def test_feedback_endpoint_and_personalized_ranking(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(main, "feedback_store", None)
+        response = client.post("/api/feedback", json={"user_id": "u1", "matched_rules": ["R6"], "action": "like"})
+        assert response.status_code == 503
+        store = FeedbackStore(tmp_path / "feedback.db", flush_interval=60)
+        monkeypatch.setattr(main, "feedback_store", store)
+        
+        plain = client.post("/api/recommend", json=self.PROFILE).json()
+        assert client.post("/api/recommend?user_id=u1", json=self.PROFILE).json() == plain
+        response = client.post("/api/feedback", json={"user_id": "u1", "matched_rules": ["R12"], "action": "like"})
+        assert response.status_code == 202
+        response = client.post("/api/feedback", json={"user_id": "u1", "matched_rules": ["R6"], "action": "dismiss"})
+        assert response.status_code == 202
+        personalized = client.post("/api/recommend?user_id=u1", json=self.PROFILE).json()
+        assert [r["matched_rules"] for r in personalized["recommendations"]] == [["R12"], ["R9"], ["R11"]]
+        # Other users and unpersonalized requests are unaffected by u1's own scores
+        assert client.post("/api/recommend", json=self.PROFILE).json() == plain
+        
+        response = client.post("/api/feedback", json={"user_id": "u1", "matched_rules": ["NOPE"], "action": "like"})
+        assert response.status_code == 404
+        response = client.post("/api/feedback", json={"user_id": "u1", "matched_rules": ["R6"], "action": "love"})
+        assert response.status_code == 422
+        assert client.get("/api/feedback/stats").json()["recorded"] == 2
+        # A cold user is one cache miss, not one in cached_scores and another in user_scores
+        users = store.stats()["users"]
+        client.post("/api/recommend?user_id=u2", json=self.PROFILE)
+        assert store.stats()["users"]["misses"] == users["misses"] + 1
+        store.close()
+
+
 class TestAPI:
     
     def test_recommend_endpoint_success(self):
@@ -154,6 +1157,78 @@ class TestAPI:
         data = response.json()
         assert len(data["recommendations"]) >= 1
     
+    def test_recommend_endpoint_trace(self):
+        """Trace is only returned when requested"""
+        body = {
+            "gender": "male",
+            "occasion": "formal",
+            "weather": "mild",
+            "body_type": "athletic",
+            "preferred_style": "classic"
+        }
+        plain = client.post("/api/recommend", json=body).json()
+        assert "trace" not in plain
+        
+        traced = client.post("/api/recommend?trace=true", json=body).json()
+        assert traced["recommendations"] == plain["recommendations"]
+        assert traced["trace"]["rules_matched"] == ["R1"]
+    
+    def test_recommend_endpoint_cache(self, monkeypatch):
+        """Repeated requests are served from the cache with identical bodies"""
+        monkeypatch.setattr(main, "recommendation_table", None)
+        body = {
+            "gender": "female",
+            "occasion": "party",
+            "weather": "cold",
+            "body_type": "hourglass",
+            "preferred_style": "flashy"
+        }
+        before = client.get("/api/cache/stats").json()
+        first = client.post("/api/recommend", json=body)
+        second = client.post("/api/recommend", json=body)
+        after = client.get("/api/cache/stats").json()
+        
+        assert first.content == second.content
+        assert after["hits"] == before["hits"] + 1
+        expected = main.expert_system.forward_chain(UserInput(**body))
+        assert second.json()["recommendations"] == [r.dict(exclude_none=True) for r in expected]
+    
+    def test_batch_endpoint(self):
+        """Batch endpoint returns one result per profile, in order"""
+        profiles = [
+            {"gender": "male", "occasion": "sports", "weather": "hot", "body_type": "athletic", "preferred_style": "sporty"},
+            {"gender": "female", "occasion": "wedding", "weather": "mild", "body_type": "pear",
+             "preferred_style": "traditional", "height": "short"},
+            {"gender": "male", "occasion": "sports", "weather": "hot", "body_type": "athletic", "preferred_style": "sporty"},
+        ]
+        response = client.post("/api/recommend/batch", json={"profiles": profiles})
+        assert response.status_code == 200
+        results = response.json()["results"]
+        assert len(results) == 3
+        for profile, result in zip(profiles, results):
+            assert result == client.post("/api/recommend", json=profile).json()
+    
+    def test_batch_repeated_misses_evaluated_once(self, monkeypatch):
+        """Repeats of a profile the engine computes are counted from its remembered matches"""
+        finish_table_rebuilds()
+        monkeypatch.setattr(main, "recommendation_table", None)
+        monkeypatch.setattr(main, "recommendation_cache", RecommendationCache())
+        system = main.expert_system
+        evaluate, calls = system.evaluate, []
+        monkeypatch.setattr(system, "evaluate", lambda *args: calls.append(args) or evaluate(*args))
+        profile = {"gender": "female", "occasion": "party", "weather": "cold", "body_type": "athletic",
+                   "preferred_style": "flashy", "height": "tall"}
+        before = system.metrics.rule_report([])["evaluations"]
+        response = client.post("/api/recommend/batch", json={"profiles": [profile] * 3})
+        assert response.status_code == 200
+        assert len(calls) == 1
+        assert system.metrics.rule_report([])["evaluations"] == before + 3
+
+    def test_batch_endpoint_empty(self):
+        response = client.post("/api/recommend/batch", json={"profiles": []})
+        assert response.status_code == 200
+        assert response.json() == {"results": []}
+    
     def test_rules_endpoint(self):
         """Test the rules endpoint"""
         response = client.get("/api/rules")
@@ -161,6 +1236,182 @@ class TestAPI:
         data = response.json()
         assert "rules" in data
         assert len(data["rules"]) == 12
+        assert response.headers["etag"]
+    
+    def test_rules_conditional_requests(self):
+        """If-None-Match with the current ETag gets an empty 304"""
+        response = client.get("/api/rules", headers={"Accept-Encoding": "identity"})
+        etag = response.headers["etag"]
+        assert "content-encoding" not in response.headers
+        assert response.headers["cache-control"] == "no-cache"
+        
+        cached = client.get("/api/rules", headers={"If-None-Match": etag})
+        assert cached.status_code == 304
+        assert cached.content == b""
+        assert client.get("/api/rules", headers={"If-None-Match": '"stale"'}).status_code == 200
+    
+    def test_rules_compressed(self):
+        response = client.get("/api/rules", headers={"Accept-Encoding": "gzip"})
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.headers["vary"] == "Accept-Encoding"
+        assert len(response.json()["rules"]) == 12
+        assert client.get("/api/rules", headers={"If-None-Match": response.headers["etag"]}).status_code == 304
+    
+    def test_rules_pagination_and_fields(self):
+        data = client.get("/api/rules?offset=10&limit=5&fields=id,conditions").json()
+        assert data["total"] == 12
+        assert data["rules"] == [{"id": r["id"], "conditions": r["conditions"]} for r in KNOWLEDGE_BASE["rules"][10:]]
+        assert client.get("/api/rules?fields=id,bogus").status_code == 400
+        assert client.get("/api/rules?limit=0").status_code == 422
+    
+    def test_root_etag(self):
+        response = client.get("/")
+        assert response.json()["version"] == "1.0.0"
+        assert client.get("/", headers={"If-None-Match": response.headers["etag"]}).status_code == 304
+    
+    def test_rule_admin_endpoints(self, tmp_path, monkeypatch):
+        """Rule edits apply immediately and change the rules ETag"""
+        path = tmp_path / "rules.json"
+        path.write_text(json.dumps(KNOWLEDGE_BASE))
+        monkeypatch.setattr(main, "rule_store", RuleStore(path, main.expert_system, validate=main.validate_rule))
+        monkeypatch.setenv("ADMIN_TOKEN", "secret")
+        admin = {"X-Admin-Token": "secret"}
+        rule = {
+            "id": "R100",
+            "conditions": {"occasion": "beach"},
+            "recommendation": {"title": "Beach Ready", "items": ["Linen shirt"], "explanation": "Sun and sand."},
+            "confidence": 0.9
+        }
+        body = {"gender": "male", "occasion": "beach", "weather": "hot", "body_type": "slim", "preferred_style": "modern"}
+        etag = client.get("/api/rules").headers["etag"]
+        try:
+            assert client.post("/api/rules", json=rule, headers=admin).status_code == 201
+            assert client.post("/api/rules", json=rule, headers=admin).status_code == 409
+            assert client.get("/api/rules/R100").json()["recommendation"]["title"] == "Beach Ready"
+            assert client.post("/api/recommend", json=body).json()["recommendations"][0]["matched_rules"] == ["R100"]
+            assert client.get("/api/rules").headers["etag"] != etag
+            
+            response = client.put("/api/rules/R100", json=dict(rule, confidence=0.5), headers=admin)
+            assert response.json()["confidence"] == 0.5
+            assert client.put("/api/rules/R404", json=rule, headers=admin).status_code == 404
+            assert client.post("/api/rules", json=dict(rule, id="R101", confidence=2), headers=admin).status_code == 422
+            
+            assert client.delete("/api/rules/R100", headers=admin).status_code == 204
+            assert client.delete("/api/rules/R100", headers=admin).status_code == 404
+            assert client.get("/api/rules").headers["etag"] == etag
+        finally:
+            main.expert_system.load_rules(KNOWLEDGE_BASE["rules"])
+            main.refresh_recommendation_table()
+    
+    def test_metrics_endpoint(self):
+        body = {"gender": "male", "occasion": "formal", "weather": "cold", "body_type": "slim", "preferred_style": "classic"}
+        before = main.expert_system.metrics.rule_report(["R1"])["rules"][0]["matches"]
+        client.post("/api/recommend", json=body)
+        client.post("/api/recommend", json=body)
+        # Table and cache hits are counted as well as evaluated requests
+        assert main.expert_system.metrics.rule_report(["R1"])["rules"][0]["matches"] == before + 2
+        
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+        assert 'stylist_http_request_duration_seconds_count{method="POST",route="/api/recommend",status="200"}' in response.text
+        assert "stylist_cache_hit_ratio" in response.text
+        
+        report = client.get("/api/metrics/rules").json()
+        assert len(report["rules"]) == len(main.expert_system.rules)
+    
+    def test_recommend_partial_scoring(self):
+        body = {"gender": "female", "occasion": "wedding", "weather": "mild", "body_type": "slim", "preferred_style": "modern"}
+        strict = client.post("/api/recommend", json=body).json()
+        assert strict["recommendations"][0]["matched_rules"] == ["FALLBACK"]
+        partial = client.post("/api/recommend?scoring=partial", json=body).json()
+        assert partial["recommendations"][0]["matched_rules"] != ["FALLBACK"]
+        # Partial and strict results are cached separately
+        assert client.post("/api/recommend?scoring=partial", json=body).json() == partial
+        assert client.post("/api/recommend?scoring=strict", json=body).json() == strict
+        assert client.post("/api/recommend?scoring=fuzzy", json=body).status_code == 422
+    
+    def test_recommend_stream(self):
+        profile = {"gender": "male", "occasion": "formal", "weather": "cold", "body_type": "slim", "preferred_style": "classic"}
+        body = (json.dumps(profile) + "\n") * 3 + "oops\n"
+        response = client.post("/api/recommend/stream?scoring=partial", content=body)
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/x-ndjson"
+        lines = response.content.splitlines()
+        assert lines[:3] == [client.post("/api/recommend?scoring=partial", json=profile).content] * 3
+        assert json.loads(lines[3])["line"] == 4
+    
+    def test_rule_change_during_inference_not_cached_as_new(self, monkeypatch):
+        """A body computed from the old rules isn't served under the version that replaced them"""
+        finish_table_rebuilds()
+        monkeypatch.setattr(main, "recommendation_table", None)
+        monkeypatch.setattr(main, "recommendation_cache", RecommendationCache())
+        system = main.expert_system
+        body = {"gender": "male", "occasion": "formal", "weather": "mild", "body_type": "slim", "preferred_style": "modern"}
+        run = main.inference.run
+
+        async def edit_during_inference(*args, **kwargs):
+            result = await run(*args, **kwargs)
+            rule = dict(system.index.rules[system.index.ordinals["R1"]])
+            system.apply_changes([{**rule, "recommendation": {**rule["recommendation"], "title": "Edited Suit"}}])
+            return result
+
+        monkeypatch.setattr(main.inference, "run", edit_during_inference)
+        try:
+            assert client.post("/api/recommend", json=body).json()["recommendations"][0]["title"] == "Navy Two Piece Suit"
+            monkeypatch.setattr(main.inference, "run", run)
+            assert client.post("/api/recommend", json=body).json()["recommendations"][0]["title"] == "Edited Suit"
+            bulk = main.bulk_scorer.scorer([json.dumps(body).encode()], 1)
+            assert json.loads(bulk)["recommendations"][0]["title"] == "Edited Suit"
+        finally:
+            system.load_rules(KNOWLEDGE_BASE["rules"])
+
+    def test_recommend_sheds_load_when_saturated(self, monkeypatch):
+        finish_table_rebuilds()
+        monkeypatch.setattr(main, "inference", InferenceExecutor(main.expert_system, mode="thread", max_pending=0))
+        monkeypatch.setattr(main, "recommendation_table", None)
+        body = {"gender": "female", "occasion": "party", "weather": "snowy", "body_type": "tall", "preferred_style": "bold"}
+        response = client.post("/api/recommend?trace=true", json=body)
+        assert response.status_code == 429
+        assert response.headers["retry-after"] == "1"
+        assert client.post("/api/recommend/batch", json={"profiles": [body]}).status_code == 429
+        assert client.get("/api/executor/stats").json()["rejected"] == 2
+    
+    def test_static_images(self, tmp_path, monkeypatch):
+        Image = pytest.importorskip("PIL.Image")
+        (tmp_path / "src").mkdir()
+        Image.new("RGB", (400, 200), (10, 120, 40)).save(tmp_path / "src" / "look.jpg")
+        manifest = build_images(tmp_path / "src", tmp_path / "out", widths=[320])
+        monkeypatch.setattr(main, "IMAGE_DIR", tmp_path / "out")
+        monkeypatch.setattr(main.expert_system, "images", ImageManifest(manifest))
+        monkeypatch.setattr(main, "image_payloads", {})
+        variant = manifest["images"]["look"]["variants"][0]
+        
+        response = client.get(variant["url"])
+        assert response.status_code == 200
+        assert response.content == (tmp_path / "out" / variant["file"]).read_bytes()
+        assert response.headers["cache-control"] == "public, max-age=31536000, immutable"
+        assert response.headers["content-type"] == "image/webp"
+        assert response.headers["accept-ranges"] == "bytes"
+        
+        partial = client.get(variant["url"], headers={"Range": "bytes=0-9"})
+        assert partial.status_code == 206
+        assert partial.content == response.content[:10]
+        assert partial.headers["content-range"] == f"bytes 0-9/{len(response.content)}"
+        assert client.get(variant["url"], headers={"Range": "bytes=99999999-"}).status_code == 416
+        # A stale If-Range gets the whole body
+        assert client.get(variant["url"], headers={"Range": "bytes=0-9", "If-Range": '"old"'}).status_code == 200
+        assert client.get(variant["url"], headers={"If-None-Match": response.headers["etag"]}).status_code == 304
+        assert client.get("/static/images/manifest.json").status_code == 404
+        assert client.get("/static/images/..%2Fmain.py").status_code == 404
+    
+    def test_admin_token(self, monkeypatch):
+        monkeypatch.delenv("ADMIN_TOKEN", raising=False)
+        assert client.post("/api/rules/reload").status_code == 403
+        assert client.delete("/api/rules/R1").status_code == 403
+        monkeypatch.setenv("ADMIN_TOKEN", "secret")
+        assert client.post("/api/rules/reload").status_code == 401
+        assert client.delete("/api/rules/R404", headers={"X-Admin-Token": "secret"}).status_code == 404
 
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
\ No newline at end of file
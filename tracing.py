@@ -0,0 +1,44 @@
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class InferenceTrace:
+    """Per-request explanation of how the engine reached its recommendations.
+
+    The engine only touches a trace when one is passed in, so untraced calls
+    pay nothing beyond a handful of ``is None`` checks per request.
+    """
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+        self.rules: List[Dict[str, Any]] = []
+        self.matched: List[str] = []
+        self.derived: Dict[str, Any] = {}
+        self.fallback = False
+        self._started = time.perf_counter()
+        self._mark = self._started
+
+    def stage(self, name: str) -> None:
+        """Close the current stage, recording its duration under ``name``"""
+        now = time.perf_counter()
+        self.stages[name] = round((now - self._mark) * 1000, 4)
+        self._mark = now
+
+    def rule_evaluated(self, rule_id: str, failure: Optional[Tuple[str, Any, Any]]) -> None:
+        """Record the outcome of testing one rule against the input"""
+        entry: Dict[str, Any] = {"id": rule_id, "matched": failure is None}
+        if failure is not None:
+            key, expected, actual = failure
+            entry["failed_condition"] = {"attribute": key, "expected": expected, "actual": actual}
+        self.rules.append(entry)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "total_ms": round((self._mark - self._started) * 1000, 4),
+            "stages": self.stages,
+            "rules_evaluated": len(self.rules),
+            "rules_matched": self.matched,
+            "derived_facts": self.derived,
+            "fallback": self.fallback,
+            "rules": self.rules,
+        }
@@ -0,0 +1,199 @@
+"""Vectorized rule evaluation for large offline scoring jobs.
+
+Requires NumPy. Rules and profiles are encoded as integer matrices (one column
+per attribute, 0 meaning "absent or a value no rule mentions"), matches are
+computed with array operations over the distinct encoded profiles, and the
+title merge, match bonus and top-k selection of ``forward_chain`` are replayed
+column-wise with the same floating point operations so results are identical.
+"""
+from typing import Any, Dict, Iterable, List, Sequence
+
+import numpy as np
+
+
+class VectorizedResult:
+    """Top-k recommendation groups for each scored profile"""
+
+    def __init__(self, engine: "VectorizedEngine", codes: np.ndarray, inverse: np.ndarray,
+                 top_groups: np.ndarray, top_confidence: np.ndarray):
+        self.engine = engine
+        self.codes = codes                    # distinct encoded profiles
+        self.inverse = inverse                # profile -> row in ``codes``
+        self.top_groups = top_groups          # (distinct, k) title group ids, -1 when unused
+        self.top_confidence = top_confidence  # (distinct, k) rounded final confidence
+
+    def __len__(self) -> int:
+        return len(self.inverse)
+
+    def matched(self, i: int) -> np.ndarray:
+        """Boolean mask of rules matched by profile ``i``"""
+        return self.engine.match(self.codes[self.inverse[i]:self.inverse[i] + 1])[0]
+
+    def recommendations(self, i: int) -> List[Dict[str, Any]]:
+        """Recommendation fields for profile ``i``; empty when the fallback applies"""
+        row = self.inverse[i]
+        mask = None
+        results = []
+        for group, confidence in zip(self.top_groups[row], self.top_confidence[row]):
+            if group < 0:
+                break
+            if mask is None:
+                mask = self.matched(i)
+            members = [r for r in self.engine.group_members[group] if mask[r]]
+            rule = self.engine.rules[members[0]]
+            results.append({
+                "title": rule["recommendation"]["title"],
+                "items": rule["recommendation"]["items"],
+                "explanation": rule["recommendation"]["explanation"],
+                "images": rule["images"],
+                "confidence": float(confidence),
+                "matched_rules": [self.engine.rules[r]["id"] for r in members],
+            })
+        return results
+
+
+class VectorizedEngine:
+    """Integer-coded rule x attribute matrix evaluated with NumPy"""
+
+    def __init__(self, rules: List[Dict], attributes: Sequence[str], top_k: int = 3,
+                 chunk_cells: int = 1 << 22):
+        if any("derives" in rule for rule in rules):
+            raise ValueError("rules that derive facts need multi-step chaining, which is not vectorized")
+        self.rules = rules
+        self.attributes = list(attributes)
+        self.top_k = top_k
+        self.chunk_cells = chunk_cells
+        n_rules = len(rules)
+
+        # Per-attribute vocabulary of values referenced by at least one rule
+        self.vocab: List[Dict[Any, int]] = [{} for _ in self.attributes]
+        position = {attribute: j for j, attribute in enumerate(self.attributes)}
+        never = np.zeros(n_rules, dtype=bool)
+        constraints = []
+        for r, rule in enumerate(rules):
+            for key, value in rule["conditions"].items():
+                j = position.get(key)
+                if j is None or value is None:
+                    never[r] = True  # the input can never satisfy this condition
+                    continue
+                code = self.vocab[j].setdefault(value, len(self.vocab[j]) + 1)
+                constraints.append((j, code, r))
+
+        # allowed[j][code, r]: rule r accepts value ``code`` for attribute j
+        self.allowed = [np.ones((len(v) + 1, n_rules), dtype=bool) for v in self.vocab]
+        for j, code, r in constraints:
+            self.allowed[j][:, r] = False
+            self.allowed[j][code, r] = True
+        for table in self.allowed:
+            table[:, never] = False
+
+        # Title groups, and the "layers" in which members of each group fold in
+        titles: Dict[str, int] = {}
+        self.group_members: List[List[int]] = []
+        layers: List[List[tuple]] = []
+        for r, rule in enumerate(rules):
+            g = titles.setdefault(rule["recommendation"]["title"], len(titles))
+            if g == len(self.group_members):
+                self.group_members.append([])
+            depth = len(self.group_members[g])
+            self.group_members[g].append(r)
+            if depth == len(layers):
+                layers.append([])
+            layers[depth].append((r, g))
+        self.n_groups = len(titles)
+        self.layers = []
+        for layer in layers:
+            rule_ids = np.array([r for r, _ in layer], dtype=np.int64)
+            self.layers.append((
+                rule_ids,
+                np.array([g for _, g in layer], dtype=np.int64),
+                np.array([rules[r]["confidence"] for r in rule_ids], dtype=np.float64),
+                np.array([self._bonus(rules[r]["conditions"]) for r in rule_ids], dtype=np.float64),
+            ))
+
+    @staticmethod
+    def _bonus(conditions: Dict) -> float:
+        # calculate_match_bonus for a rule whose conditions all matched
+        matches = len(conditions)
+        return (matches / len(conditions)) * 0.1
+
+    def encode(self, profiles: Iterable[Dict[str, Any]]) -> np.ndarray:
+        """Encode profile dicts (or UserInput-like objects) into an int32 matrix"""
+        profiles = [p if isinstance(p, dict) else p.dict() for p in profiles]
+        codes = np.zeros((len(profiles), len(self.attributes)), dtype=np.int32)
+        for j, attribute in enumerate(self.attributes):
+            vocab = self.vocab[j]
+            if vocab:
+                codes[:, j] = np.fromiter((vocab.get(p.get(attribute), 0) for p in profiles),
+                                          dtype=np.int32, count=len(profiles))
+        return codes
+
+    def match(self, codes: np.ndarray) -> np.ndarray:
+        """Boolean (profiles x rules) matrix of fully matched rules"""
+        matched = self.allowed[0][codes[:, 0]]
+        for j in range(1, len(self.attributes)):
+            matched &= self.allowed[j][codes[:, j]]
+        return matched
+
+    def _score_chunk(self, codes: np.ndarray):
+        matched = self.match(codes)
+        n = len(codes)
+        confidence = np.zeros((n, self.n_groups))
+        bonus = np.zeros((n, self.n_groups))
+        first = np.full((n, self.n_groups), len(self.rules), dtype=np.int64)
+        seen = np.zeros((n, self.n_groups), dtype=bool)
+        for rule_ids, groups, rule_confidence, rule_bonus in self.layers:
+            m = matched[:, rule_ids]
+            was_seen = seen[:, groups]
+            confidence[:, groups] = np.where(
+                m, np.where(was_seen, (confidence[:, groups] + rule_confidence) / 2, rule_confidence),
+                confidence[:, groups])
+            bonus[:, groups] = np.where(
+                m, np.where(was_seen, bonus[:, groups] + rule_bonus, rule_bonus), bonus[:, groups])
+            first[:, groups] = np.where(m & ~was_seen, rule_ids, first[:, groups])
+            seen[:, groups] = was_seen | m
+
+        final = np.minimum(1.0, confidence + bonus)
+        # Python's round() and np.round() disagree on some ties, so round
+        # each distinct value with the builtin
+        values, inverse = np.unique(final[seen], return_inverse=True)
+        rounded = np.full(final.shape, -np.inf)
+        rounded[seen] = np.array([round(float(v), 2) for v in values])[inverse.ravel()]
+
+        # Highest confidence first, ties broken by first matched rule, which
+        # is the order forward_chain's stable sort leaves them in
+        order = np.lexsort((first, -rounded), axis=-1)[:, :self.top_k]
+        top_confidence = np.take_along_axis(rounded, order, axis=1)
+        top_groups = np.where(np.isfinite(top_confidence), order, -1)
+        return top_groups, np.where(top_groups >= 0, top_confidence, 0.0)
+
+    def _distinct(self, codes: np.ndarray):
+        """Distinct rows of ``codes`` and the row each profile maps to"""
+        radices = [len(v) + 1 for v in self.vocab]
+        if np.prod(radices, dtype=float) < 2 ** 62:
+            # Pack each row into one integer; a 1-D unique is far cheaper than axis=0
+            packed = np.zeros(len(codes), dtype=np.int64)
+            for j, radix in enumerate(radices):
+                packed = packed * radix + codes[:, j]
+            _, first, inverse = np.unique(packed, return_index=True, return_inverse=True)
+            return codes[first], inverse.ravel()
+        distinct, inverse = np.unique(codes, axis=0, return_inverse=True)
+        return distinct, inverse.ravel()
+
+    def score_codes(self, codes: np.ndarray) -> VectorizedResult:
+        """Score an already encoded profile matrix"""
+        distinct, inverse = self._distinct(codes)
+        k = min(self.top_k, self.n_groups)
+        top_groups = np.full((len(distinct), self.top_k), -1, dtype=np.int64)
+        top_confidence = np.zeros((len(distinct), self.top_k))
+        if k and len(distinct):
+            step = max(1, self.chunk_cells // max(len(self.rules), self.n_groups, 1))
+            for start in range(0, len(distinct), step):
+                groups, confidence = self._score_chunk(distinct[start:start + step])
+                top_groups[start:start + step, :k] = groups
+                top_confidence[start:start + step, :k] = confidence
+        return VectorizedResult(self, distinct, inverse, top_groups, top_confidence)
+
+    def score(self, profiles: Iterable[Dict[str, Any]]) -> VectorizedResult:
+        """Encode and score profiles"""
+        return self.score_codes(self.encode(profiles))